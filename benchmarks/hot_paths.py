@@ -0,0 +1,301 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.tick_recorder import TickRecorder
+from price_construction.price_crossing import PriceCrossing
+from util.currency_pair import CurrencyPair
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+PAIR_COUNTS = (10, 100, 1000, 10_000)
+DEPTHS = (1, 10)
+# A case is slower than its baseline if its median latency grew by more than this fraction.
+TOLERANCE = 0.25
+# Recording a step to a tick file may add at most this fraction to the mean step time.
+RECORDING_OVERHEAD = 0.10
+# Seconds to measure the recording overhead of a universe for, a few percent need many more steps than a latency.
+OVERHEAD_TIME = 3.0
+
+
+def build_universe(n_pairs: int) -> Tuple[List[CurrencyPair], List[CurrencyPair]]:
+    """
+    n_pairs quoted pairs: every currency against USD, then crosses between the other currencies.
+    Also returns up to n_pairs cross targets without a book of their own, which price through USD.
+    """
+    # Smallest number of currencies whose USD pairs and crosses give n_pairs pairs.
+    n = 2
+    while (n - 1) + (n - 1) * (n - 2) // 2 < n_pairs:
+        n += 1
+    currencies = [f"C{i:03d}" for i in range(n - 1)]
+    pairs = [CurrencyPair(c, "USD") for c in currencies]
+    crosses = [CurrencyPair(a, b) for a, b in itertools.combinations(currencies, 2)]
+    quoted_crosses = n_pairs - len(pairs)
+    pairs = (pairs + crosses[:quoted_crosses])[:n_pairs]
+    unquoted = [CurrencyPair(cp.quote, cp.base) for cp in crosses[quoted_crosses:]]
+    unquoted += [CurrencyPair(cp.quote, cp.base) for cp in crosses[:quoted_crosses]]
+    return pairs, unquoted[:n_pairs]
+
+
+def _seed_depth(simulation: FXMarketSimulation, depth: int, tick: float = 0.0001, size: float = 10):
+    """
+    Re-quote every book with `depth` levels around its current mid.
+    """
+    store = simulation.order_book_store
+    mids = (store.bid_prices[:, 0] + store.ask_prices[:, 0]) / 2
+    offsets = 1 + tick * (np.arange(depth) + 5)
+    sizes = np.full((len(store), depth), float(size))
+    store.update_all(mids[:, None] / offsets, sizes, mids[:, None] * offsets, sizes)
+    simulation.price_production.resync()
+
+
+def _cases(n_pairs: int, depth: int, seed: int, directory: str) -> List[Tuple[str, Callable, Optional[Callable]]]:
+    """
+    (name, call, setup) per hot path; setup runs untimed before every call. Tick files go to directory.
+    """
+    pairs, cross_targets = build_universe(n_pairs)
+    simulation = FXMarketSimulation(pairs, seed=seed, risk_factor=1.0, book_size=max(depth, 1))
+    _seed_depth(simulation, depth)
+    production = simulation.price_production
+    crossing = PriceCrossing(cross_targets, production)
+    rng = np.random.default_rng(seed)
+    # Created up front, so the step case does not time engine construction.
+    simulation.run_batch(1)
+    recorder = TickRecorder(os.path.join(directory, f"ticks-{n_pairs}-{depth}.bin"), pairs, max(depth, 1))
+    chosen = {}
+
+    def pick_pair():
+        chosen["pair"] = pairs[rng.integers(len(pairs))]
+
+    def change_book():
+        # Rewritten with its own levels, a book still invalidates the memoized consensus.
+        book = simulation.order_books[pairs[rng.integers(len(pairs))]]
+        book.update_bid(book.get_bid_prices().copy(), book.get_bid_sizes().copy())
+        production.update(book)
+
+    def pick_target():
+        # A book the target reads, rewritten with its own levels by the timed call.
+        target = cross_targets[rng.integers(len(cross_targets))]
+        book = simulation.order_books[crossing.plan.legs[crossing.plan.target_index[target]][0][0]]
+        chosen["target"], chosen["book"] = target, book
+        chosen["levels"] = (book.get_bid_prices().copy(), book.get_bid_sizes().copy())
+
+    def reprice_target():
+        # The book changes, the production invalidates the target through the cache and it is repriced.
+        book = chosen["book"]
+        book.update_bid(*chosen["levels"])
+        production.update(book)
+        return crossing.generate_mid_price(chosen["target"])
+
+    def recorded_step():
+        recorder.record(simulation.order_book_store, simulation.price_crossing, simulation.engine.step(),
+                        simulation.engine.book_rows)
+
+    return [
+        ("calculate_pair_price", lambda: production.calculate_pair_price(chosen["pair"]), pick_pair),
+        ("calculate_consensus_price", production.calculate_consensus_price, change_book),
+        ("generate_mid_price", reprice_target, pick_target),
+        # Re-quoting leaves single level books, so these run after the pricing cases.
+        ("place_orders", lambda: simulation.market_maker.place_orders(simulation.order_books), None),
+        ("simulation_step", simulation.engine.step, None),
+        ("recorded_simulation_step", recorded_step, None),
+    ]
+
+
+def measure_latency(call: Callable, setup: Optional[Callable] = None, min_time: float = 0.2,
+                    min_repeats: int = 5, max_repeats: int = 2000) -> Dict[str, float]:
+    """
+    Latency percentiles in microseconds and allocations of one call; setup runs untimed before every call.
+    """
+    latencies = []
+    deadline = time.perf_counter() + min_time
+    while len(latencies) < max_repeats and (len(latencies) < min_repeats or time.perf_counter() < deadline):
+        if setup is not None:
+            setup()
+        start = time.perf_counter_ns()
+        call()
+        latencies.append(time.perf_counter_ns() - start)
+    latencies = np.array(latencies[1:] if len(latencies) > 1 else latencies) / 1e3
+    # Allocations in a separate pass, tracing slows the calls down.
+    peaks, blocks = [], []
+    tracemalloc.start()
+    for _ in range(3):
+        if setup is not None:
+            setup()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        call()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        stats = tracemalloc.take_snapshot().compare_to(before, "filename")
+        blocks.append(sum(max(stat.count_diff, 0) for stat in stats))
+    tracemalloc.stop()
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        "repeats": len(latencies),
+        "mean_us": float(latencies.mean()),
+        "p50_us": float(p50),
+        "p90_us": float(p90),
+        "p99_us": float(p99),
+        "alloc_peak_kb": float(np.median(peaks)) / 1024,
+        "alloc_blocks": int(np.median(blocks)),
+    }
+
+
+def measure_overhead(call: Callable, slower_call: Callable, min_time: float = OVERHEAD_TIME,
+                     min_repeats: int = 5, groups: int = 20) -> float:
+    """
+    Fraction by which slower_call takes longer than call. The calls alternate two at a time and only the second
+    of each two is timed, so that the load of the machine changes both alike and neither is timed right after
+    the other, whose caching it could profit from. The repeats are split into groups of consecutive ones: the
+    total time of a group includes work done every few calls, such as writing a chunk, and the median over the
+    groups leaves out those during which the machine stalled.
+    """
+    latencies = ([], [])
+    deadline = time.perf_counter() + min_time
+    while len(latencies[0]) < min_repeats or time.perf_counter() < deadline:
+        for timed, timings in zip((call, slower_call), latencies):
+            timed()
+            start = time.perf_counter_ns()
+            timed()
+            timings.append(time.perf_counter_ns() - start)
+    fast, slow = np.array(latencies[0]), np.array(latencies[1])
+    ratios = [slow[group].sum() / fast[group].sum()
+              for group in np.array_split(np.arange(len(fast)), min(groups, len(fast)))]
+    return float(np.median(ratios)) - 1
+
+
+def run_hot_path_benchmarks(pair_counts: Sequence[int] = PAIR_COUNTS, depths: Sequence[int] = DEPTHS,
+                            seed: int = 0, min_time: float = 0.2, min_repeats: int = 5,
+                            max_repeats: int = 2000, overhead_time: float = OVERHEAD_TIME) -> Dict[str, dict]:
+    """
+    Latency percentiles (microseconds) and allocations per call of the pricing and simulation hot paths,
+    keyed by "<case>[pairs=<n>,depth=<d>]". The recorded step also holds the fraction recording adds to the
+    step, its "overhead", measured for overhead_time seconds.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for n_pairs in pair_counts:
+            for depth in depths:
+                universe = f"[pairs={n_pairs},depth={depth}]"
+                calls = {}
+                for name, call, setup in _cases(n_pairs, depth, seed, directory):
+                    results[name + universe] = measure_latency(call, setup, min_time, min_repeats, max_repeats)
+                    calls[name] = call
+                results["recorded_simulation_step" + universe]["overhead"] = measure_overhead(
+                    calls["simulation_step"], calls["recorded_simulation_step"], overhead_time, min_repeats)
+    return results
+
+
+def recording_overheads(results: Dict[str, dict]) -> Dict[str, float]:
+    """
+    Fraction that recording to a tick file adds to the simulation step time, keyed by "[pairs=<n>,depth=<d>]".
+    Measured by alternating plain and recorded steps (see measure_overhead), as the load of the machine changes
+    more between two separately timed cases than recording adds. Results without that measurement compare the
+    mean latencies of the two cases, so that the chunk writes every few steps count.
+    """
+    overheads = {}
+    for key, result in results.items():
+        if key.startswith("recorded_simulation_step["):
+            universe = key[len("recorded_simulation_step"):]
+            step = results.get("simulation_step" + universe)
+            if "overhead" in result:
+                overheads[universe] = result["overhead"]
+            elif step is not None:
+                overheads[universe] = result["mean_us"] / step["mean_us"] - 1
+    return overheads
+
+
+def compare_to_baseline(results: Dict[str, dict], baseline: Dict[str, dict],
+                        tolerance: float = TOLERANCE) -> List[str]:
+    """
+    Keys whose median latency exceeds the baseline's by more than tolerance.
+    Keys missing from the baseline are not compared.
+    """
+    return [key for key, result in results.items()
+            if key in baseline and result["p50_us"] > baseline[key]["p50_us"] * (1 + tolerance)]
+
+
+def host_info() -> Dict[str, object]:
+    """
+    The machine results are measured on. Latencies are only comparable on the same machine, so the
+    baseline file keeps one baseline per host.
+    """
+    return {"node": platform.node(), "machine": platform.machine(), "processor": platform.processor(),
+            "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__}
+
+
+def load_baseline(path: str = BASELINE_PATH, host: Optional[str] = None) -> Dict[str, dict]:
+    """
+    Results in the baseline of host (this machine by default), empty if the file has none for it.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        baselines = json.load(f)
+    return baselines.get(host or platform.node(), {}).get("results", {})
+
+
+def save_baseline(results: Dict[str, dict], path: str = BASELINE_PATH, host: Optional[str] = None):
+    """
+    Merge results into the baseline of host (this machine by default), keeping those of other hosts.
+    """
+    baselines = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            baselines = json.load(f)
+    host = host or platform.node()
+    previous = baselines.get(host, {}).get("results", {})
+    baselines[host] = {"host": host_info(), "results": {**previous, **results}}
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency and allocations of the pricing and simulation hot paths")
+    parser.add_argument("--pairs", type=int, nargs="+", default=list(PAIR_COUNTS))
+    parser.add_argument("--depths", type=int, nargs="+", default=list(DEPTHS))
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per case")
+    parser.add_argument("--overhead-time", type=float, default=OVERHEAD_TIME,
+                        help="seconds per recording overhead measurement")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--host", default=platform.node(), help="machine whose baseline to compare against or save")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with these results")
+    args = parser.parse_args()
+    results = run_hot_path_benchmarks(args.pairs, args.depths, min_time=args.min_time,
+                                      overhead_time=args.overhead_time)
+    baseline = load_baseline(args.baseline, args.host)
+    if not baseline:
+        print(f"No baseline for host {args.host} in {args.baseline}, run with --save-baseline to record one")
+    print(f"{'case':<52}{'p50 us':>11}{'p90 us':>11}{'p99 us':>11}{'peak kB':>10}{'blocks':>8}{'vs base':>9}")
+    for key, result in results.items():
+        ratio = f"{result['p50_us'] / baseline[key]['p50_us']:.2f}x" if key in baseline else "-"
+        print(f"{key:<52}{result['p50_us']:>11.1f}{result['p90_us']:>11.1f}{result['p99_us']:>11.1f}"
+              f"{result['alloc_peak_kb']:>10.1f}{result['alloc_blocks']:>8}{ratio:>9}")
+    overheads = recording_overheads(results)
+    for universe, overhead in overheads.items():
+        print(f"recording overhead{universe}: {overhead:+.1%}")
+    if args.save_baseline:
+        save_baseline(results, args.baseline, args.host)
+        print(f"Baseline of host {args.host} written to {args.baseline}")
+    else:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for key in regressions:
+            print(f"REGRESSION {key}: p50 {results[key]['p50_us']:.1f} us, "
+                  f"baseline {baseline[key]['p50_us']:.1f} us")
+        slow_recording = [universe for universe, overhead in overheads.items() if overhead > RECORDING_OVERHEAD]
+        for universe in slow_recording:
+            print(f"REGRESSION recording{universe}: adds {overheads[universe]:.1%} to the step, "
+                  f"limit {RECORDING_OVERHEAD:.0%}")
+        sys.exit(1 if regressions or slow_recording else 0)
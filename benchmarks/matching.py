@@ -0,0 +1,54 @@
+import argparse
+import time
+
+import numpy as np
+
+from market.orderbook import OrderBook
+from util.currency_pair import CurrencyPair
+from util.side import Side
+
+
+def run_matching_benchmark(n_orders: int = 100_000, book_size: int = 50, seed: int = 0) -> dict:
+    """
+    Throughput of OrderBook matching on a random mix of limit orders (60%), market orders (30%) and
+    cancels (10%) around a fixed mid. Returns orders/sec overall and per order type.
+    """
+    rng = np.random.default_rng(seed)
+    orderbook = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=book_size)
+    orderbook.update_bid(np.round(1.0999 - 0.0001 * np.arange(book_size // 2), 4), np.full(book_size // 2, 10.0))
+    orderbook.update_ask(np.round(1.1001 + 0.0001 * np.arange(book_size // 2), 4), np.full(book_size // 2, 10.0))
+    kinds = rng.choice(3, size=n_orders, p=[0.6, 0.3, 0.1])
+    buys = rng.integers(0, 2, n_orders).astype(bool)
+    sizes = rng.uniform(1, 20, n_orders)
+    offsets = np.round(rng.normal(0.0, 0.0005, n_orders), 4)
+    resting = []
+    elapsed = np.zeros(3)
+    counts = np.bincount(kinds, minlength=3)
+    for kind, buy, size, offset in zip(kinds, buys, sizes, offsets):
+        side = Side.BUY if buy else Side.SELL
+        start = time.perf_counter()
+        if kind == 0:
+            report = orderbook.submit_limit_order(side, 1.1 + offset, size)
+            if report.order_id is not None:
+                resting.append(report.order_id)
+        elif kind == 1:
+            orderbook.submit_market_order(side, size)
+        elif resting:
+            orderbook.cancel_order(resting.pop(int(rng.integers(len(resting)))))
+        elapsed[kind] += time.perf_counter() - start
+    return {
+        "orders": n_orders,
+        "orders_per_sec": n_orders / elapsed.sum(),
+        "limit_orders_per_sec": counts[0] / elapsed[0],
+        "market_orders_per_sec": counts[1] / elapsed[1],
+        "cancels_per_sec": counts[2] / elapsed[2],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OrderBook matching throughput")
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--book-size", type=int, default=50)
+    args = parser.parse_args()
+    for key, value in run_matching_benchmark(args.orders, args.book_size).items():
+        print(f"{key}: {value:,.0f}")
@@ -0,0 +1,52 @@
+import argparse
+from typing import Dict, Sequence
+
+import numpy as np
+
+from benchmarks.hot_paths import _seed_depth, build_universe, measure_latency
+from market.fx_market_simulation import FXMarketSimulation
+from price_construction.pricing_engine import PricingEngine
+
+
+def run_pricing_engine_benchmark(pair_counts: Sequence[int] = (100, 10_000), depth: int = 10, seed: int = 0,
+                                 min_time: float = 0.2) -> Dict[str, dict]:
+    """
+    Latency of every PricingEngine side by side on the same books: pricing all pairs in one batch,
+    pricing a single pair, and notifying the engine of one changed book.
+    Keyed by "<engine>.<operation>[pairs=<n>]".
+    """
+    results = {}
+    for n_pairs in pair_counts:
+        pairs, _ = build_universe(n_pairs)
+        for engine in PricingEngine:
+            simulation = FXMarketSimulation(pairs, seed=seed, risk_factor=1.0, book_size=depth,
+                                            pricing_engine=engine)
+            _seed_depth(simulation, depth)
+            production = simulation.price_production
+            books = list(simulation.order_books.values())
+            rng = np.random.default_rng(seed)
+            chosen = {}
+
+            def pick():
+                chosen["book"] = books[rng.integers(len(books))]
+
+            cases = {
+                "calculate_all_pair_prices": (production.calculate_all_pair_prices, None),
+                "calculate_pair_price": (lambda: production.calculate_pair_price(chosen["book"].currency_pair), pick),
+                "update": (lambda: production.update(chosen["book"]), pick),
+            }
+            for operation, (call, setup) in cases.items():
+                results[f"{engine.name}.{operation}[pairs={n_pairs}]"] = measure_latency(call, setup, min_time)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pricing engines side by side")
+    parser.add_argument("--pairs", type=int, nargs="+", default=[100, 10_000])
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per case")
+    args = parser.parse_args()
+    results = run_pricing_engine_benchmark(args.pairs, args.depth, min_time=args.min_time)
+    print(f"{'case':<56}{'p50 us':>11}{'p99 us':>11}{'peak kB':>10}")
+    for key, result in results.items():
+        print(f"{key:<56}{result['p50_us']:>11.1f}{result['p99_us']:>11.1f}{result['alloc_peak_kb']:>10.1f}")
@@ -0,0 +1,145 @@
+from typing import Dict
+
+import numpy as np
+
+
+class MakerPopulation:
+    """
+    State of many market makers as struct-of-arrays, one entry per maker.
+    Every maker quotes one bid and one ask on its pair (an index into the engine's pairs) each step:
+    around a reservation price that is skewed away from its inventory, at a half spread scaled by its
+    risk factor, for quote_size units capped so that no fill can take its inventory past max_inventory.
+    Inventory is held in the pair's base currency and cash in its quote currency.
+    """
+    def __init__(self, pairs, risk_factors, half_spreads, inventory_skews, max_inventories, quote_sizes):
+        self.pairs = np.asarray(pairs, dtype=np.int64)
+        n = len(self.pairs)
+        self.risk_factors = np.broadcast_to(np.asarray(risk_factors, dtype=float), n).copy()
+        self.half_spreads = np.broadcast_to(np.asarray(half_spreads, dtype=float), n).copy()
+        self.inventory_skews = np.broadcast_to(np.asarray(inventory_skews, dtype=float), n).copy()
+        self.max_inventories = np.broadcast_to(np.asarray(max_inventories, dtype=float), n).copy()
+        self.quote_sizes = np.broadcast_to(np.asarray(quote_sizes, dtype=float), n).copy()
+        self.inventory = np.zeros(n)
+        self.cash = np.zeros(n)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    @classmethod
+    def random(cls, n: int, n_pairs: int, rng: np.random.Generator) -> "MakerPopulation":
+        """
+        n heterogeneous makers spread evenly over n_pairs pairs, every pair getting one before any gets two.
+        """
+        pairs = (np.arange(n) + rng.integers(0, max(n_pairs, 1))) % max(n_pairs, 1)
+        return cls(pairs,
+                   risk_factors=rng.uniform(0.5, 1.5, n),
+                   half_spreads=rng.uniform(0.0001, 0.0005, n),
+                   inventory_skews=rng.uniform(0.0, 0.0005, n),
+                   max_inventories=rng.uniform(50, 500, n),
+                   quote_sizes=rng.uniform(5, 20, n))
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """
+        Every per maker array by name, restored by from_state.
+        """
+        return {"pairs": self.pairs, "risk_factors": self.risk_factors, "half_spreads": self.half_spreads,
+                "inventory_skews": self.inventory_skews, "max_inventories": self.max_inventories,
+                "quote_sizes": self.quote_sizes, "inventory": self.inventory, "cash": self.cash}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "MakerPopulation":
+        makers = cls(state["pairs"], state["risk_factors"], state["half_spreads"], state["inventory_skews"],
+                     state["max_inventories"], state["quote_sizes"])
+        makers.inventory[:] = state["inventory"]
+        makers.cash[:] = state["cash"]
+        return makers
+
+    def quotes(self, mids: np.ndarray):
+        """
+        (bid prices, bid sizes, ask prices, ask sizes) of every maker given the mid of every pair.
+        A maker at +max_inventory stops bidding and one at -max_inventory stops offering.
+        """
+        mid = mids[self.pairs]
+        reservation = mid * (1 - self.inventory_skews * self.inventory / self.max_inventories)
+        half_spread = mid * self.half_spreads * self.risk_factors
+        bid_sizes = np.clip(self.max_inventories - self.inventory, 0.0, self.quote_sizes)
+        ask_sizes = np.clip(self.max_inventories + self.inventory, 0.0, self.quote_sizes)
+        return reservation - half_spread, bid_sizes, reservation + half_spread, ask_sizes
+
+    def mark_to_market(self, mids: np.ndarray) -> np.ndarray:
+        """
+        Cash plus inventory valued at the given pair mids, per maker in its pair's quote currency.
+        """
+        return self.cash + self.inventory * mids[self.pairs]
+
+
+class TakerPopulation:
+    """
+    State of many market takers as struct-of-arrays, one entry per taker.
+    Each step a taker trades on its pair with probability `activity`, buying with probability buy_bias,
+    for a size drawn uniformly from [min_size, max_size). Orders are capped so that inventory stays within
+    +-max_inventory; a taker at its limit can only trade back towards flat.
+    """
+    def __init__(self, pairs, activity, buy_bias, min_sizes, max_sizes, max_inventories):
+        self.pairs = np.asarray(pairs, dtype=np.int64)
+        n = len(self.pairs)
+        self.activity = np.broadcast_to(np.asarray(activity, dtype=float), n).copy()
+        self.buy_bias = np.broadcast_to(np.asarray(buy_bias, dtype=float), n).copy()
+        self.min_sizes = np.broadcast_to(np.asarray(min_sizes, dtype=float), n).copy()
+        self.max_sizes = np.broadcast_to(np.asarray(max_sizes, dtype=float), n).copy()
+        self.max_inventories = np.broadcast_to(np.asarray(max_inventories, dtype=float), n).copy()
+        self.inventory = np.zeros(n)
+        self.cash = np.zeros(n)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    @classmethod
+    def random(cls, n: int, n_pairs: int, rng: np.random.Generator) -> "TakerPopulation":
+        """
+        n heterogeneous takers on uniformly drawn pairs.
+        """
+        return cls(rng.integers(0, max(n_pairs, 1), n),
+                   activity=rng.uniform(0.05, 0.5, n),
+                   buy_bias=rng.uniform(0.4, 0.6, n),
+                   min_sizes=rng.uniform(0.5, 1.0, n),
+                   max_sizes=rng.uniform(1.0, 5.0, n),
+                   max_inventories=rng.uniform(10, 100, n))
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """
+        Every per taker array by name, restored by from_state.
+        """
+        return {"pairs": self.pairs, "activity": self.activity, "buy_bias": self.buy_bias,
+                "min_sizes": self.min_sizes, "max_sizes": self.max_sizes, "max_inventories": self.max_inventories,
+                "inventory": self.inventory, "cash": self.cash}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "TakerPopulation":
+        takers = cls(state["pairs"], state["activity"], state["buy_bias"], state["min_sizes"], state["max_sizes"],
+                     state["max_inventories"])
+        takers.inventory[:] = state["inventory"]
+        takers.cash[:] = state["cash"]
+        return takers
+
+    def orders(self, rng: np.random.Generator):
+        """
+        Draw this step's orders: (buy flags, sizes), with size 0 for takers that do not trade.
+        """
+        n = len(self.pairs)
+        active = rng.random(n) < self.activity
+        buy = rng.random(n) < self.buy_bias
+        sizes = rng.uniform(self.min_sizes, self.max_sizes)
+        # At a limit only the reducing side is allowed.
+        buy = np.where(self.inventory >= self.max_inventories, False,
+                       np.where(self.inventory <= -self.max_inventories, True, buy))
+        room = np.where(buy, self.max_inventories - self.inventory, self.max_inventories + self.inventory)
+        sizes = np.where(active, np.clip(sizes, 0.0, room), 0.0)
+        return buy, sizes
+
+    def mark_to_market(self, mids: np.ndarray) -> np.ndarray:
+        """
+        Cash plus inventory valued at the given pair mids, per taker in its pair's quote currency.
+        """
+        return self.cash + self.inventory * mids[self.pairs]
+
@@ -0,0 +1,86 @@
+import json
+import os
+import re
+import shutil
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+STATE_FILE = "state.json"
+# Name of the version directory holding the current checkpoint, inside the checkpoint directory.
+POINTER_FILE = "CURRENT"
+VERSION_PATTERN = re.compile(r"v\d+")
+FORMAT_VERSION = 1
+
+
+def _current_version(path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, POINTER_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _fsync(path: str):
+    # Directories are opened read-only to flush the entries created in them.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_checkpoint(path: str, arrays: Dict[str, np.ndarray], state: dict):
+    """
+    Write a checkpoint directory: every array to its own .npy file, written from the array's buffer without
+    an intermediate copy, and state (anything JSON serializable) to state.json. Each checkpoint goes to a
+    new version directory inside path and is flushed to disk before the CURRENT file naming it is atomically
+    replaced, so a crash at any point leaves either the previous checkpoint or the new one readable at path.
+    Other files in path are left alone.
+    """
+    os.makedirs(path, exist_ok=True)
+    current = _current_version(path)
+    version = f"v{int(current[1:]) + 1 if current else 1}"
+    directory = os.path.join(path, version)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    for name, array in arrays.items():
+        with open(os.path.join(directory, name + ".npy"), "wb") as f:
+            np.save(f, np.asarray(array), allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+    with open(os.path.join(directory, STATE_FILE), "w") as f:
+        # dumps rather than dump, which encodes in pure Python.
+        f.write(json.dumps({"format_version": FORMAT_VERSION, "arrays": list(arrays), "state": state}))
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync(directory)
+    pointer = os.path.join(path, POINTER_FILE + ".tmp")
+    with open(pointer, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(path, POINTER_FILE))
+    _fsync(path)
+    # Earlier versions are no longer read.
+    for entry in os.listdir(path):
+        if entry != version and VERSION_PATTERN.fullmatch(entry):
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+
+def read_checkpoint(path: str) -> Tuple[Dict[str, np.ndarray], dict]:
+    """
+    (arrays, state) of a checkpoint written by write_checkpoint, read from the version CURRENT names.
+    Arrays are read-only memory maps of their files, copied only where they are loaded into the simulation.
+    """
+    version = _current_version(path)
+    if version is not None:
+        path = os.path.join(path, version)
+    with open(os.path.join(path, STATE_FILE)) as f:
+        contents = json.load(f)
+    if contents.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"{path} holds checkpoint format {contents.get('format_version')}, "
+                         f"expected {FORMAT_VERSION}")
+    arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r", allow_pickle=False)
+              for name in contents["arrays"]}
+    return arrays, contents["state"]
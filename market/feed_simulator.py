@@ -0,0 +1,66 @@
+import asyncio
+import heapq
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from market.quote_stream import BookUpdate, QuoteStream
+from util.currency_pair import CurrencyPair
+
+
+class FeedSimulator:
+    """
+    In-process market data feed. Every pair ticks as a Poisson process with its own rate, rates being
+    lognormally spread around mean_rate so that a few pairs are much busier than the rest. Each tick
+    moves the pair's mid by a lognormal step and quotes `levels` levels per side around it.
+    """
+    def __init__(self, currency_pairs: Sequence[CurrencyPair], mids: Sequence[float],
+                 mean_rate: float = 100.0, rate_dispersion: float = 1.0, volatility: float = 1e-4,
+                 levels: int = 3, half_spread: float = 0.0001, size: float = 10,
+                 rng: Optional[np.random.Generator] = None):
+        """
+        mids: Starting mid per pair.
+        mean_rate: Mean number of updates per second per pair.
+        rate_dispersion: Standard deviation of the log update rates.
+        volatility: Standard deviation of the log mid change per tick, for all pairs or per pair.
+        """
+        self.currency_pairs: List[CurrencyPair] = list(currency_pairs)
+        self.mids = np.array(mids, dtype=float)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        log_rates = self.rng.normal(0.0, rate_dispersion, len(self.currency_pairs))
+        # Scaled so that the rates average to mean_rate.
+        self.rates = mean_rate * np.exp(log_rates) / np.mean(np.exp(log_rates))
+        self.volatility = np.broadcast_to(np.asarray(volatility, dtype=float), len(self.currency_pairs))
+        self.offsets = half_spread * (1 + np.arange(levels))
+        self.sizes = np.full(levels, float(size))
+        self.sent = 0
+
+    def _tick(self, i: int) -> BookUpdate:
+        self.mids[i] *= np.exp(self.rng.normal(0.0, self.volatility[i]))
+        mid = self.mids[i]
+        return BookUpdate(self.currency_pairs[i], mid * (1 - self.offsets), self.sizes,
+                          mid * (1 + self.offsets), self.sizes, time.perf_counter_ns())
+
+    async def run(self, stream: QuoteStream, duration: float, close: bool = True):
+        """
+        Publish ticks into stream in real time for `duration` seconds. Ticks that fall due while the
+        consumer is busy are published together, as a burst. Closes the stream at the end unless close is False.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        # (next tick time, pair) for every pair, in one heap.
+        schedule = [(start + self.rng.exponential(1.0 / rate), i) for i, rate in enumerate(self.rates)]
+        heapq.heapify(schedule)
+        end = start + duration
+        while schedule and schedule[0][0] < end:
+            now = min(loop.time(), end)
+            while schedule[0][0] <= now:
+                due, i = schedule[0]
+                stream.publish(self._tick(i))
+                self.sent += 1
+                heapq.heapreplace(schedule, (due + self.rng.exponential(1.0 / self.rates[i]), i))
+            # Yield to the consumer until the next tick is due.
+            await asyncio.sleep(max(schedule[0][0] - loop.time(), 0.0))
+        if close:
+            stream.close()
@@ -1,50 +1,428 @@
-import random
-from typing import Dict, List
+import asyncio
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
+
+from market.agent_population import MakerPopulation, TakerPopulation
+from market.checkpoint import read_checkpoint, write_checkpoint
+from market.feed_simulator import FeedSimulator
+from market.historical_data import (DEFAULT_CHUNK_ROWS, Calibration, QuoteCalibrator, ingest_quotes,
+                                    open_sources)
 from market.market_maker import MarketMaker
 from market.market_taker import MarketTaker
-from market.orderbook import OrderBook
+from market.orderbook import LazyOrderBooks
+from market.orderbook_store import OrderBookStore
+from market.population_engine import PopulationEngine, PopulationStepResult
+from market.quote_stream import QuoteStream
+from market.shared_books import SharedBookWriter
+from market.simulation_engine import SimulationEngine, StepResult
+from market.tick_recorder import TickRecorder
+from price_construction.arbitrage import ArbitrageReport, ArbitrageScanner
+from price_construction.currency_graph import PricingPlan
 from price_construction.price_crossing import PriceCrossing
-from price_construction.vwap_price import VWAPPrice
+from price_construction.pricing_engine import PricingEngine
 from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler
 from util.side import Side
 
+# Store arrays saved by checkpoint(), in the argument order of OrderBookStore.load_snapshot.
+_STORE_COLUMNS = ("bid_prices", "bid_sizes", "ask_prices", "ask_sizes", "bid_levels", "ask_levels",
+                  "bid_versions", "ask_versions")
+
+
+def _pair_list(currency_pairs: Sequence[CurrencyPair]) -> List[List[str]]:
+    return [[cp.base, cp.quote] for cp in currency_pairs]
+
+
+def _pairs(pair_list: List[List[str]]) -> List[CurrencyPair]:
+    return [CurrencyPair(base, quote) for base, quote in pair_list]
+
+
+class _LazyTakers(dict):
+    """
+    MarketTaker per pair of a simulation, created on first lookup.
+    """
+    def __init__(self, simulation: "FXMarketSimulation"):
+        super().__init__()
+        self.simulation = simulation
+
+    def __missing__(self, currency_pair: CurrencyPair) -> MarketTaker:
+        simulation = self.simulation
+        if currency_pair not in simulation.order_books:
+            raise KeyError(currency_pair)
+        taker = self[currency_pair] = MarketTaker(currency_pair, simulation.price_production, rng=simulation.rng)
+        taker.profiler = simulation.profiler
+        return taker
+
 
 class FXMarketSimulation:
-    def __init__(self, currency_pairs: List[CurrencyPair]):
+    def __init__(self, currency_pairs: List[CurrencyPair],
+                 seed: Union[None, int, np.random.SeedSequence] = None,
+                 risk_factor: Optional[float] = None, book_size: int = 10,
+                 pricing_engine: PricingEngine = PricingEngine.VWAP_PRICE,
+                 profiler: Optional[Profiler] = None, plan: Optional[PricingPlan] = None):
+        """
+        seed: Seeds the single random generator used by every part of the simulation, so equal seeds
+              give identical runs.
+        risk_factor: Market maker risk factor, drawn uniformly from [0.5, 1.5) if not given.
+        book_size: Maximum number of levels per book side.
+        pricing_engine: Selects the PriceProduction that prices the books, with its default parameters.
+        profiler: Collects stage timings and counters of all components, see set_profiler.
+        plan: Compiled pricing plan over currency_pairs to use instead of compiling the routes, see load.
+        """
         self.currency_pairs = currency_pairs
+        self.rng = np.random.default_rng(seed)
         # Ensure that required pairs for crossing exist.
         # For instance, to price GBP/SEK, include GBP/USD.
-        self.order_books: Dict[CurrencyPair, OrderBook] = {
-            cp: OrderBook(currency_pair=cp, book_size=10) for cp in currency_pairs
-        }
+        # All books share one columnar store; each OrderBook is a view onto its row, created when the
+        # book is first looked up.
+        self.order_book_store = OrderBookStore(book_size=book_size, capacity=len(currency_pairs))
+        self.order_book_store.add_pairs(currency_pairs)
+        self.order_books: LazyOrderBooks = LazyOrderBooks(self.order_book_store)
+        self._seed_books()
         # Create a price production mechanism.
-        self.price_production = VWAPPrice(vwap_mid_price=3, vwap_spread=3)
-        for cp, ob in self.order_books.items():
-            self.price_production.update(ob)
-        # Create a PriceCrossing instance.
-        self.price_crossing = PriceCrossing(currency_pairs, self.price_production)
+        self.pricing_engine = pricing_engine
+        self.price_production = pricing_engine.create()
+        self.price_production.register_store(self.order_books)
+        # Orders matched or rested directly on a book reprice it.
+        self.order_books.on_change = self.price_production.update
+        # Create a PriceCrossing instance, from the compiled plan if one is given.
+        self.price_crossing = PriceCrossing(currency_pairs, self.price_production, plan=plan)
         # Create one MarketMaker that will price all currency pairs.
+        if risk_factor is None:
+            risk_factor = self.rng.uniform(0.5, 1.5)
         self.market_maker = MarketMaker(target_currency_pairs=currency_pairs,
                                         price_crossing=self.price_crossing,
-                                        risk_factor=random.uniform(0.5, 1.5))
+                                        risk_factor=risk_factor,
+                                        rng=self.rng)
+        # One MarketTaker per pair executing market orders, created on its first order.
+        self.market_takers: Dict[CurrencyPair, MarketTaker] = _LazyTakers(self)
+        self.engine: Optional[SimulationEngine] = None
+        self.population_engine: Optional[PopulationEngine] = None
+        self.recorder: Optional[TickRecorder] = None
+        self.publisher: Optional[SharedBookWriter] = None
+        self.calibration: Optional[Calibration] = None
+        self.arbitrage_scanner: Optional[ArbitrageScanner] = None
+        self.set_profiler(profiler if profiler is not None else NULL_PROFILER)
+
+    def save(self, path: str):
+        """
+        Save the pair universe and the compiled pricing plan, to be restored by load().
+        """
+        self.price_crossing.plan.save(path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "FXMarketSimulation":
+        """
+        Simulation over the universe saved by save(), reusing its compiled pricing plan.
+        kwargs are passed to the constructor (seed, risk_factor, book_size, pricing_engine, profiler).
+        """
+        plan = PricingPlan.load(path)
+        return cls(plan.pairs, plan=plan, **kwargs)
+
+    def checkpoint(self, path: str):
+        """
+        Write the full simulation state to the directory path, from which resume() continues bit-exactly:
+        the books with their resting orders, the compiled pricing plan, the price production's aggregates
+        and the cached mids, the market maker, takers and populations, the calibration and the random
+        generator. Recording, publishing and the profiler are not part of the state.
+        """
+        store = self.order_book_store
+        plan = self.price_crossing.plan
+        cache = self.price_crossing.cache
+        arrays = {f"store.{name}": getattr(store, name) for name in _STORE_COLUMNS}
+        arrays.update((f"production.{name}", array) for name, array in self.price_production.get_state().items())
+        arrays.update({"plan.leg_index": plan.leg_index, "plan.leg_inverted": plan.leg_inverted,
+                       "cache.values": cache.values, "cache.dirty": cache.dirty,
+                       "cache.uses_consensus": cache.uses_consensus})
+        # Only books that ever rested an order have order state beyond the store's levels.
+        books = [ob for ob in self.order_books.created_books() if ob.store is store and ob.next_order_id > 1]
+        orders = [ob.resting_orders() for ob in books]
+        arrays["orders.rows"] = np.array([ob.row for ob in books], dtype=np.int64)
+        arrays["orders.next_ids"] = np.array([ob.next_order_id for ob in books], dtype=np.int64)
+        arrays["orders.counts"] = np.array([len(o[0]) for o in orders], dtype=np.int64)
+        for i, name in enumerate(("ids", "buys", "prices", "remaining")):
+            arrays[f"orders.{name}"] = np.concatenate([o[i] for o in orders]) if orders else np.empty(0)
+        takers = list(self.market_takers.values())
+        arrays["takers.inventory"] = np.array([taker.inventory for taker in takers], dtype=float)
+        if self.population_engine is not None:
+            arrays.update((f"population.makers.{name}", array)
+                          for name, array in self.population_engine.makers.get_state().items())
+            arrays.update((f"population.takers.{name}", array)
+                          for name, array in self.population_engine.takers.get_state().items())
+        if self.calibration is not None:
+            arrays.update((f"calibration.{name}", getattr(self.calibration, name))
+                          for name in Calibration._fields[1:])
+        write_checkpoint(path, arrays, {
+            "targets": _pair_list(plan.targets),
+            "plan_pairs": _pair_list(plan.pairs),
+            "max_hops": plan.max_hops,
+            "store_pairs": _pair_list(store.currency_pairs),
+            "book_size": store.book_size,
+            "pricing_engine": self.pricing_engine.name,
+            "risk_factor": self.market_maker.risk_factor,
+            "takers": _pair_list(taker.currency_pair for taker in takers),
+            "population": self.population_engine is not None,
+            "calibration_pairs": None if self.calibration is None else _pair_list(self.calibration.currency_pairs),
+            "rng": self.rng.bit_generator.state,
+        })
+
+    @classmethod
+    def resume(cls, path: str, profiler: Optional[Profiler] = None) -> "FXMarketSimulation":
+        """
+        Simulation in the state written by checkpoint(path); stepping it gives the same results, bit for
+        bit, as stepping the checkpointed simulation would have.
+        """
+        arrays, state = read_checkpoint(path)
+        targets = _pairs(state["targets"])
+        plan = PricingPlan.from_arrays(targets, _pairs(state["plan_pairs"]), np.array(arrays["plan.leg_index"]),
+                                       np.array(arrays["plan.leg_inverted"]), state["max_hops"])
+        simulation = cls(targets, risk_factor=state["risk_factor"], book_size=state["book_size"],
+                         pricing_engine=PricingEngine[state["pricing_engine"]], profiler=profiler, plan=plan)
+        store = simulation.order_book_store
+        store.add_pairs(_pairs(state["store_pairs"]))
+        if store.currency_pairs != _pairs(state["store_pairs"]):
+            raise ValueError(f"The books of {path} do not match the pairs of its pricing plan")
+        store.load_snapshot(*(arrays[f"store.{name}"] for name in _STORE_COLUMNS))
+        simulation.price_production.set_state({name[len("production."):]: np.array(array)
+                                               for name, array in arrays.items() if name.startswith("production.")})
+        simulation.price_crossing.cache.restore(arrays["cache.values"], arrays["cache.dirty"],
+                                                arrays["cache.uses_consensus"])
+        offsets = np.r_[0, np.cumsum(arrays["orders.counts"])].tolist()
+        columns = [arrays[f"orders.{name}"] for name in ("ids", "buys", "prices", "remaining")]
+        for row, next_id, start, end in zip(arrays["orders.rows"].tolist(), arrays["orders.next_ids"].tolist(),
+                                            offsets[:-1], offsets[1:]):
+            simulation.order_books[store.currency_pairs[row]].restore_orders(
+                *(column[start:end] for column in columns), next_order_id=next_id)
+        for cp, inventory in zip(_pairs(state["takers"]), arrays["takers.inventory"].tolist()):
+            simulation.market_takers[cp].inventory = inventory
+        if state["population"]:
+            populations = [{name.split(".", 2)[2]: np.array(array) for name, array in arrays.items()
+                            if name.startswith(prefix)} for prefix in ("population.makers.", "population.takers.")]
+            simulation.run_population(0, makers=MakerPopulation.from_state(populations[0]),
+                                      takers=TakerPopulation.from_state(populations[1]))
+        if state["calibration_pairs"] is not None:
+            simulation.calibration = Calibration(_pairs(state["calibration_pairs"]),
+                                                 *(np.array(arrays[f"calibration.{name}"])
+                                                   for name in Calibration._fields[1:]))
+        simulation.rng.bit_generator.state = state["rng"]
+        return simulation
+
+    def set_profiler(self, profiler: Profiler):
+        """
+        Instrument the price production, price crossing, market maker, takers and engine with profiler;
+        NULL_PROFILER switches profiling off.
+        """
+        self.profiler = profiler
+        components = [self.price_production, self.price_crossing, self.market_maker, self.engine,
+                      self.population_engine, self.arbitrage_scanner, self.publisher]
+        for component in components + list(self.market_takers.values()):
+            if component is not None:
+                component.profiler = profiler
+
+    def _seed_books(self, half_spread: float = 0.0005, size: float = 10):
+        """
+        Quote every book around a random mid so that prices exist before the first step.
+        Mids come from a random value per currency, so crossed prices are consistent with direct ones.
+        """
+        currencies = sorted({c for cp in self.currency_pairs for c in cp.as_tuple()})
+        values = dict(zip(currencies, self.rng.lognormal(0.0, 1.0, len(currencies))))
+        mids = np.array([values[cp.base] / values[cp.quote] for cp in self.order_book_store.currency_pairs])
+        sizes = np.full(len(mids), float(size))
+        self.order_book_store.update_all(mids * (1 - half_spread), sizes, mids * (1 + half_spread), sizes)
+
+    def calibrate(self, sources: Sequence[Union[str, Tuple[str, CurrencyPair]]],
+                  chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Calibration:
+        """
+        Start the books from historical quotes instead of random mids. sources are quote files (see
+        read_quotes), given as paths or (path, pair) for files without a pair column; several files are
+        merged in time order. Files are streamed in chunks, every book ends up holding the last quote of
+        its pair, and mids, spreads and volatilities are calibrated per pair in constant memory.
+        The calibrated volatilities drive run_streaming.
+        """
+        calibrator = QuoteCalibrator()
+        ingest_quotes(open_sources(sources, chunk_rows), self.order_book_store, self.price_production, calibrator)
+        self.calibration = calibrator.calibration()
+        return self.calibration
 
-    def run(self, steps: int = 10):
+    def run(self, steps: int = 10, log: bool = True, on_step: Optional[Callable[[int], None]] = None):
+        """
+        Run the simulation pair by pair: the market maker quotes every book, then one market taker per pair
+        trades against it. Every step is printed unless log is False; on_step is called with the number
+        of every finished step.
+        """
+        profiler = self.profiler
         for step in range(steps):
-            print(f"\n--- Step {step} ---")
-            # MarketMaker places orders on every currency pair.
-            self.market_maker.place_orders(self.order_books)
-            # Print consensus prices and strategies.
-            for cp, ob in self.order_books.items():
-                mid, spread = self.price_production.calculate_consensus_price_for(cp)
-                strat = self.price_crossing.get_pricing_strategy(cp)
-                strat_str = strat["strategy"]
-                if strat_str == "cross":
-                    strat_str += f" via pivot {strat['pivot']}"
-                print(f"{cp}: Mid = {mid:.4f}, Spread = {spread:.4f}, Strategy = {strat_str}")
-            # Random market takers execute orders on random pairs.
-            for cp, ob in self.order_books.items():
-                side = random.choice(list(Side))
-                taker = MarketTaker(side, size=random.uniform(1, 5))
-                price, size = taker.place_order(ob)
-                print(f"MarketTaker {side.value} on {cp}: Executed {size:.2f} at {price:.4f}")
+            with profiler.stage("simulation.step"):
+                if log:
+                    print(f"\n--- Step {step} ---")
+                # MarketMaker places orders on every currency pair.
+                self.market_maker.place_orders(self.order_books)
+                if log:
+                    # Print derived prices and strategies.
+                    mids = self.price_crossing.generate_mid_prices()
+                    for cp in self.order_books:
+                        i = self.price_crossing.plan.target_index.get(cp)
+                        _, spread = self.price_production.calculate_pair_price(cp)
+                        self._print_price(cp, self.price_crossing.generate_mid_price(cp) if i is None else mids[i],
+                                          np.nan if spread is None else spread)
+                # Random market takers execute orders on random pairs.
+                with profiler.stage("simulation.takers"):
+                    for cp, ob in self.order_books.items():
+                        side = Side.BUY if self.rng.integers(0, 2) else Side.SELL
+                        price, size = self.market_takers[cp].place_order(ob, side, size=self.rng.uniform(1, 5))
+                        if profiler.enabled:
+                            profiler.add_pairs("taker.executed_size", [cp.id], size)
+                        if log:
+                            print(f"MarketTaker {side.value} on {cp}: Executed {size:.2f} at {price:.4f}")
+            if self.publisher is not None:
+                self.publisher.publish()
+            if on_step is not None:
+                on_step(step)
+
+    def _print_price(self, cp: CurrencyPair, mid: float, spread: float):
+        """
+        One line per pair: the mid derived by the price crossing, the book's spread and the pricing strategy.
+        """
+        strat = self.price_crossing.get_pricing_strategy(cp)
+        strat_str = strat["strategy"]
+        if strat_str == "cross":
+            strat_str += f" via {'/'.join(strat['pivots'])}"
+        print(f"{cp}: Mid = {mid:.4f}, Spread = {spread:.4f}, Strategy = {strat_str}")
+
+    def run_batch(self, steps: int = 10, log: bool = False,
+                  on_step: Optional[Callable[[int, StepResult], None]] = None) -> Optional[StepResult]:
+        """
+        Run the simulation headless on the vectorized SimulationEngine, which quotes and trades all pairs
+        per step in bulk. Printing every step is optional; on_step receives every step's result.
+        Returns the result of the last step.
+        """
+        if self.engine is None:
+            self.engine = SimulationEngine(self.order_book_store, self.price_crossing,
+                                           risk_factor=self.market_maker.risk_factor, rng=self.rng)
+            self.engine.profiler = self.profiler
+        on_step = self._step_callback(self._record_step if self.recorder else None,
+                                      self._print_step if log else None, on_step)
+        return self.engine.run(steps, on_step=on_step)
+
+    def run_population(self, steps: int = 10, n_makers: int = 1000, n_takers: int = 1000,
+                       makers: Optional[MakerPopulation] = None, takers: Optional[TakerPopulation] = None,
+                       on_step: Optional[Callable[[int, PopulationStepResult], None]] = None) \
+            -> Optional[PopulationStepResult]:
+        """
+        Run the simulation with a population of heterogeneous market makers and takers on the vectorized
+        PopulationEngine instead of the single market maker. The populations are created on the first
+        call, drawn at random (n_makers, n_takers) unless given, and kept by later calls; they are
+        available as population_engine.makers and population_engine.takers.
+        Returns the result of the last step.
+        """
+        if self.population_engine is None:
+            n_pairs = sum(cp in self.order_book_store for cp in self.price_crossing.target_currency_pairs)
+            if makers is None:
+                makers = MakerPopulation.random(n_makers, n_pairs, self.rng)
+            if takers is None:
+                takers = TakerPopulation.random(n_takers, n_pairs, self.rng)
+            self.population_engine = PopulationEngine(self.order_book_store, self.price_crossing, makers, takers,
+                                                      rng=self.rng)
+            self.population_engine.profiler = self.profiler
+        return self.population_engine.run(steps, on_step=self._step_callback(on_step))
+
+    def _step_callback(self, *callbacks: Optional[Callable]) -> Optional[Callable]:
+        """
+        One on_step callback calling the given ones in order, after publishing the step if publishing.
+        """
+        callbacks = [callback for callback in (self._publish_step if self.publisher else None,) + callbacks
+                     if callback]
+        if len(callbacks) > 1:
+            def on_step(step: int, result):
+                for callback in callbacks:
+                    callback(step, result)
+            return on_step
+        return callbacks[0] if callbacks else None
+
+    def scan_arbitrage(self, min_profit: float = 0.0) -> ArbitrageReport:
+        """
+        Triangles and longer cycles of pairs whose current top of book quotes allow a round trip profit
+        above min_profit, see ArbitrageScanner. Cheap enough to call from on_step every step.
+        """
+        scanner = self.arbitrage_scanner
+        if scanner is None or scanner.min_profit != min_profit:
+            scanner = self.arbitrage_scanner = ArbitrageScanner(self.order_book_store.currency_pairs, min_profit)
+            scanner.profiler = self.profiler
+        return scanner.scan_store(self.order_book_store)
+
+    def run_streaming(self, duration: float = 1.0, mean_rate: float = 100.0,
+                      on_quote: Optional[Callable[[np.ndarray, np.ndarray, np.ndarray], None]] = None) -> dict:
+        """
+        Drive the market maker from an in-process feed for `duration` seconds instead of stepping: books
+        tick independently at mean_rate updates per second on average, and only targets whose books
+        ticked are requoted. Quotes go to on_quote rather than into the books. When publishing, every
+        batch of book updates is published.
+        Returns QuoteStream.latency_stats().
+        """
+        store = self.order_book_store
+        mids = (store.bid_prices[:, 0] + store.ask_prices[:, 0]) / 2
+        volatility = 1e-4
+        if self.calibration is not None:
+            # Calibrated pairs tick with their historical volatility, the others with the default.
+            calibrated = np.full(CurrencyPair.count(), np.nan)
+            calibrated[CurrencyPair.ids(self.calibration.currency_pairs)] = self.calibration.volatilities
+            volatility = calibrated[CurrencyPair.ids(store.currency_pairs)]
+            volatility = np.where(np.isfinite(volatility), volatility, 1e-4)
+        feed = FeedSimulator(store.currency_pairs, mids, mean_rate=mean_rate, volatility=volatility, rng=self.rng)
+
+        async def stream_feed():
+            on_books = (lambda books: self.publisher.publish()) if self.publisher is not None else None
+            stream = QuoteStream(self.order_books, self.market_maker, on_quote=on_quote, on_books=on_books)
+            await asyncio.gather(stream.run(), feed.run(stream, duration))
+            return stream.latency_stats()
+
+        return asyncio.run(stream_feed())
+
+    def start_recording(self, path: str, chunk_steps: Optional[int] = None) -> TickRecorder:
+        """
+        Record every following run_batch step to a tick file at path, see TickRecorder.
+        """
+        self.stop_recording()
+        self.recorder = TickRecorder(path, self.order_book_store.currency_pairs, self.order_book_store.book_size,
+                                     chunk_steps=chunk_steps)
+        return self.recorder
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def start_publishing(self, name: Optional[str] = None) -> SharedBookWriter:
+        """
+        Publish the books and pair prices to shared memory after every following run, run_batch and
+        run_population step and every batch of run_streaming updates, for SharedBookReader(publisher.name)
+        in other processes. The current state is published right away.
+        """
+        self.stop_publishing()
+        self.publisher = SharedBookWriter(self.order_book_store, self.price_production, name=name)
+        self.publisher.profiler = self.profiler
+        self.publisher.publish()
+        return self.publisher
+
+    def stop_publishing(self):
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+
+    def _publish_step(self, step: int, result):
+        self.publisher.publish()
+
+    def _record_step(self, step: int, result: StepResult):
+        self.recorder.record(self.order_book_store, self.price_crossing, result, self.engine.book_rows)
+
+    def _print_step(self, step: int, result: StepResult):
+        print(f"\n--- Step {step} ---")
+        mids = self.price_crossing.generate_mid_prices()[self.engine.target_rows]
+        _, spreads = self.price_production.calculate_all_pair_prices()
+        for cp, mid in zip(self.engine.currency_pairs, mids.tolist()):
+            self._print_price(cp, mid, spreads[self.price_production.get_pair_index(cp)])
+        for i, cp in enumerate(self.engine.currency_pairs):
+            side = Side.BUY if result.taker_buys[i] else Side.SELL
+            print(f"MarketTaker {side.value} on {cp}: Executed {result.executed_sizes[i]:.2f} "
+                  f"at {result.executed_prices[i]:.4f}")
@@ -0,0 +1,305 @@
+import csv
+import heapq
+import itertools
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from market.orderbook_store import OrderBookStore
+from price_construction.price_production import PriceProduction
+from util.currency_pair import CurrencyPair
+
+# Record layout of binary quote files: a .npy array of this dtype, one file per pair.
+QUOTE_DTYPE = np.dtype([("timestamp", "<i8"), ("bid", "<f8"), ("ask", "<f8"),
+                        ("bid_size", "<f8"), ("ask_size", "<f8")])
+CSV_COLUMNS = ("timestamp", "bid", "ask", "bid_size", "ask_size")
+DEFAULT_CHUNK_ROWS = 65536
+
+
+class QuoteChunk(NamedTuple):
+    """
+    A block of top-of-book quotes, in time order. Pairs are given by CurrencyPair.id, timestamps in nanoseconds.
+    """
+    pair_ids: np.ndarray
+    timestamps: np.ndarray
+    bids: np.ndarray
+    asks: np.ndarray
+    bid_sizes: np.ndarray
+    ask_sizes: np.ndarray
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+class Calibration(NamedTuple):
+    """
+    Per pair statistics of historical quotes, aligned with currency_pairs.
+    mids/spreads are the last observed ones; volatilities are the standard deviation of the log mid change
+    between consecutive quotes and update_rates the number of quotes per second.
+    """
+    currency_pairs: List[CurrencyPair]
+    counts: np.ndarray
+    mids: np.ndarray
+    spreads: np.ndarray
+    mean_mids: np.ndarray
+    mid_stds: np.ndarray
+    mean_spreads: np.ndarray
+    spread_stds: np.ndarray
+    volatilities: np.ndarray
+    update_rates: np.ndarray
+
+
+def write_quotes(path: str, timestamps, bids, asks, bid_sizes, ask_sizes):
+    """
+    Write the quotes of one pair as a binary quote file readable by read_quotes.
+    """
+    records = np.empty(len(timestamps), dtype=QUOTE_DTYPE)
+    for name, values in zip(CSV_COLUMNS, (timestamps, bids, asks, bid_sizes, ask_sizes)):
+        records[name] = values
+    np.save(path, records)
+
+
+def read_quotes(path: str, currency_pair: Optional[CurrencyPair] = None,
+                chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[QuoteChunk]:
+    """
+    Stream a quote file in chunks of at most chunk_rows quotes, holding one chunk in memory at a time.
+
+    .npy files are binary quote files (see write_quotes) of currency_pair and are memory-mapped.
+    Other files are read as CSV with a header naming the columns timestamp, bid, ask, bid_size and
+    ask_size; a `pair` column ("EUR/USD") gives the pair of every row, otherwise all rows are currency_pair.
+    """
+    if path.endswith(".npy"):
+        return _read_binary(path, currency_pair, chunk_rows)
+    return _read_csv(path, currency_pair, chunk_rows)
+
+
+def _read_binary(path: str, currency_pair: Optional[CurrencyPair], chunk_rows: int) -> Iterator[QuoteChunk]:
+    if currency_pair is None:
+        raise ValueError(f"Binary quote file {path} needs its currency pair")
+    records = np.load(path, mmap_mode="r")
+    for start in range(0, len(records), chunk_rows):
+        block = np.array(records[start:start + chunk_rows])
+        yield QuoteChunk(np.full(len(block), currency_pair.id, dtype=np.int64), block["timestamp"],
+                         block["bid"], block["ask"], block["bid_size"], block["ask_size"])
+
+
+def _read_csv(path: str, currency_pair: Optional[CurrencyPair], chunk_rows: int) -> Iterator[QuoteChunk]:
+    pair_ids: Dict[str, int] = {}
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader)]
+        missing = [name for name in CSV_COLUMNS if name not in header]
+        if missing:
+            raise ValueError(f"{path} lacks the columns {', '.join(missing)}")
+        columns = [header.index(name) for name in CSV_COLUMNS]
+        pair_column = header.index("pair") if "pair" in header else None
+        if pair_column is None and currency_pair is None:
+            raise ValueError(f"{path} has no pair column and no currency pair was given")
+        while True:
+            rows = list(itertools.islice(reader, chunk_rows))
+            if not rows:
+                return
+            if pair_column is None:
+                ids = np.full(len(rows), currency_pair.id, dtype=np.int64)
+            else:
+                ids = np.array([_pair_id(row[pair_column], pair_ids) for row in rows], dtype=np.int64)
+            values = np.array([[row[c] for c in columns] for row in rows])
+            yield QuoteChunk(ids, values[:, 0].astype(np.int64), *values[:, 1:].astype(float).T)
+
+
+def _pair_id(name: str, pair_ids: Dict[str, int]) -> int:
+    pair_id = pair_ids.get(name)
+    if pair_id is None:
+        base, quote = name.strip().split("/")
+        pair_id = pair_ids[name] = CurrencyPair(base, quote).id
+    return pair_id
+
+
+def merge_quotes(sources: Sequence[Iterable[QuoteChunk]],
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[QuoteChunk]:
+    """
+    k-way merge of time-ordered quote streams, e.g. one per pair file, into one time-ordered stream of
+    chunks of at most chunk_rows quotes. Quotes with equal timestamps keep source order.
+
+    The merge works on whole chunks: a heap orders the sources by the last timestamp of their current
+    chunk, and everything buffered up to the smallest of those is released in one stable sort. Memory
+    holds one chunk per source plus the output.
+    """
+    iterators = [iter(source) for source in sources]
+    buffers: List[Optional[QuoteChunk]] = [None] * len(iterators)
+    heap: List[Tuple[int, int]] = []
+
+    def refill(i: int):
+        for chunk in iterators[i]:
+            if len(chunk):
+                buffers[i] = chunk
+                heapq.heappush(heap, (int(chunk.timestamps[-1]), i))
+                return
+        buffers[i] = None
+
+    for i in range(len(iterators)):
+        refill(i)
+    pending: List[QuoteChunk] = []
+    pending_rows = 0
+    while heap:
+        watermark = heap[0][0]
+        released = []
+        for i, buffer in enumerate(buffers):
+            if buffer is None:
+                continue
+            n = int(np.searchsorted(buffer.timestamps, watermark, side="right"))
+            if n:
+                released.append(_take(buffer, slice(0, n)))
+                buffers[i] = _take(buffer, slice(n, None))
+        # The sources whose chunk ended at the watermark are used up.
+        while heap and heap[0][0] == watermark:
+            refill(heapq.heappop(heap)[1])
+        merged = _concatenate(released)
+        pending.append(_take(merged, np.argsort(merged.timestamps, kind="stable")))
+        pending_rows += len(merged)
+        if pending_rows >= chunk_rows:
+            out = _concatenate(pending)
+            full = len(out) - len(out) % chunk_rows
+            for start in range(0, full, chunk_rows):
+                yield _take(out, slice(start, start + chunk_rows))
+            pending = [_take(out, slice(full, None))]
+            pending_rows = len(out) - full
+    if pending_rows:
+        yield _concatenate(pending)
+
+
+def _take(chunk: QuoteChunk, index) -> QuoteChunk:
+    return QuoteChunk(*(column[index] for column in chunk))
+
+
+def _concatenate(chunks: Sequence[QuoteChunk]) -> QuoteChunk:
+    return QuoteChunk(*(np.concatenate(columns) for columns in zip(*chunks)))
+
+
+def open_sources(sources: Sequence[Union[str, Tuple[str, CurrencyPair]]],
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[QuoteChunk]:
+    """
+    One time-ordered stream over quote files given as paths or (path, pair) tuples, merged if there are several.
+    """
+    streams = [read_quotes(source, chunk_rows=chunk_rows) if isinstance(source, str)
+               else read_quotes(source[0], source[1], chunk_rows) for source in sources]
+    return streams[0] if len(streams) == 1 else merge_quotes(streams, chunk_rows)
+
+
+class QuoteCalibrator:
+    """
+    Running per pair statistics of a quote stream in memory proportional to the number of pairs only.
+    Chunks are folded in with the parallel form of Welford's algorithm: the mean and sum of squared
+    deviations of every pair within a chunk are computed in one vectorized pass and then combined with
+    the running ones, so values are never accumulated as raw sums of squares.
+    """
+    # Running (count, mean, sum of squared deviations) per statistic, in this order.
+    STATISTICS = ("mid", "spread", "log_return")
+
+    def __init__(self):
+        self._size = 0
+        self._stats = np.zeros((len(self.STATISTICS), 3, 0))
+        self._last = np.zeros((2, 0))
+        self._first_timestamps = np.zeros(0, dtype=np.int64)
+        self._last_timestamps = np.zeros(0, dtype=np.int64)
+
+    def _reserve(self, size: int):
+        if size <= self._size:
+            return
+        size = max(size, 2 * self._size, 16)
+        grow = size - self._size
+        self._stats = np.concatenate([self._stats, np.zeros((len(self.STATISTICS), 3, grow))], axis=2)
+        # Last mid and spread per pair, NaN until the pair was seen.
+        self._last = np.concatenate([self._last, np.full((2, grow), np.nan)], axis=1)
+        self._first_timestamps = np.concatenate([self._first_timestamps, np.zeros(grow, dtype=np.int64)])
+        self._last_timestamps = np.concatenate([self._last_timestamps, np.zeros(grow, dtype=np.int64)])
+        self._size = size
+
+    def update(self, chunk: QuoteChunk):
+        if len(chunk) == 0:
+            return
+        self._reserve(int(chunk.pair_ids.max()) + 1)
+        # Group the chunk by pair, keeping time order within each pair.
+        order = np.argsort(chunk.pair_ids, kind="stable")
+        ids = chunk.pair_ids[order]
+        mids = (chunk.bids[order] + chunk.asks[order]) / 2
+        spreads = chunk.asks[order] - chunk.bids[order]
+        timestamps = chunk.timestamps[order]
+        first = np.r_[True, ids[1:] != ids[:-1]]
+        last = np.r_[ids[1:] != ids[:-1], True]
+        previous = np.where(first, self._last[0, ids], np.r_[np.nan, mids[:-1]])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = np.log(mids / previous)
+        has_return = np.isfinite(returns)
+        new = first & (self._stats[0, 0, ids] == 0)
+        self._combine(0, ids, mids, np.ones(len(ids), dtype=bool))
+        self._combine(1, ids, spreads, np.ones(len(ids), dtype=bool))
+        self._combine(2, ids, returns, has_return)
+        self._first_timestamps[ids[new]] = timestamps[new]
+        self._last_timestamps[ids[last]] = timestamps[last]
+        self._last[0, ids[last]] = mids[last]
+        self._last[1, ids[last]] = spreads[last]
+
+    def _combine(self, statistic: int, ids: np.ndarray, values: np.ndarray, valid: np.ndarray):
+        ids, values = ids[valid], values[valid]
+        n_b = np.bincount(ids, minlength=self._size).astype(float)
+        seen = n_b > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.bincount(ids, weights=values, minlength=self._size) / n_b
+        m2_b = np.bincount(ids, weights=(values - mean_b[ids]) ** 2, minlength=self._size)
+        n_a, mean_a, m2_a = self._stats[statistic]
+        n = n_a + n_b
+        delta = np.where(seen, mean_b - mean_a, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(seen, n_b / n, 0.0)
+        self._stats[statistic, 1] = mean_a + delta * weight
+        self._stats[statistic, 2] = m2_a + np.where(seen, m2_b, 0.0) + delta ** 2 * n_a * weight
+        self._stats[statistic, 0] = n
+
+    def calibration(self) -> Calibration:
+        """
+        Statistics of every pair seen so far, in pair id order.
+        """
+        ids = np.flatnonzero(self._stats[0, 0] > 0) if self._size else np.zeros(0, dtype=np.int64)
+        (counts, mean_mids, mid_m2), (_, mean_spreads, spread_m2), (return_counts, _, return_m2) = \
+            self._stats[:, :, ids]
+        elapsed = (self._last_timestamps[ids] - self._first_timestamps[ids]) / 1e9
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mid_stds = np.sqrt(mid_m2 / (counts - 1))
+            spread_stds = np.sqrt(spread_m2 / (counts - 1))
+            volatilities = np.sqrt(return_m2 / (return_counts - 1))
+            update_rates = np.where(elapsed > 0, (counts - 1) / elapsed, np.nan)
+        return Calibration([CurrencyPair.from_id(i) for i in ids.tolist()], counts.astype(np.int64),
+                           self._last[0, ids], self._last[1, ids], mean_mids, mid_stds, mean_spreads, spread_stds,
+                           volatilities, update_rates)
+
+
+def ingest_quotes(chunks: Iterable[QuoteChunk], store: OrderBookStore,
+                  price_production: Optional[PriceProduction] = None,
+                  calibrator: Optional[QuoteCalibrator] = None) -> int:
+    """
+    Stream quote chunks into the books of the store: after every chunk each book holds the last quote of
+    its pair as a single level per side, and price_production is resynchronized. Quotes of pairs without
+    a book only feed the calibrator. Returns the number of quotes read.
+    """
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        if calibrator is not None:
+            calibrator.update(chunk)
+        if len(chunk) == 0:
+            continue
+        # Index of the last quote of every pair in the chunk.
+        reversed_ids = chunk.pair_ids[::-1]
+        unique_ids, reversed_last = np.unique(reversed_ids, return_index=True)
+        last = len(chunk) - 1 - reversed_last
+        rows = store.pair_rows.lookup_ids(unique_ids)
+        known = rows >= 0
+        if not known.any():
+            continue
+        last = last[known]
+        store.update_all(chunk.bids[last], chunk.bid_sizes[last], chunk.asks[last], chunk.ask_sizes[last],
+                         rows=rows[known])
+        if price_production is not None:
+            price_production.update_rows(store, rows[known])
+    return total
@@ -1,40 +1,66 @@
-import random
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from market.orderbook import OrderBook
 from price_construction.price_crossing import PriceCrossing
 from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler, profiled
 
 
 class MarketMaker:
+    profiler: Profiler = NULL_PROFILER
+
     def __init__(self, target_currency_pairs: List[CurrencyPair],
                  price_crossing: PriceCrossing,
-                 risk_factor: float = 1.0):
+                 risk_factor: float = 1.0,
+                 rng: Optional[np.random.Generator] = None):
         """
         target_currency_pairs: List of all currency pairs to be priced.
         price_crossing: Instance of PriceCrossing that encapsulates pricing strategies.
         risk_factor: Influences how aggressively prices are skewed.
+        rng: Random generator for the skews, a fresh unseeded one by default.
         """
         self.target_currency_pairs = target_currency_pairs
         self.price_crossing = price_crossing
         self.risk_factor = risk_factor
+        self.rng = rng if rng is not None else np.random.default_rng()
 
-    def generate_bid_ask(self, target: CurrencyPair) -> (float, float):
-        mid = self.price_crossing.generate_mid_price(target)
+    @profiled("maker.generate_bid_ask")
+    def generate_bid_ask(self, target: CurrencyPair, mid: float = None) -> (float, float):
+        if mid is None:
+            mid = self.price_crossing.generate_mid_price(target)
         # Apply a small random skew scaled by risk_factor.
-        skew = random.uniform(0.0001, 0.001) * self.risk_factor
+        skew = self.rng.uniform(0.0001, 0.001) * self.risk_factor
         bid_price = mid - skew
         ask_price = mid + skew
         return bid_price, ask_price
 
+    @profiled("maker.place_orders")
     def place_orders(self, order_books: Dict[CurrencyPair, OrderBook]):
+        # Price all targets in one pass before quoting.
+        mids = self.price_crossing.generate_mid_prices()
+        target_index = self.price_crossing.plan.target_index
         for cp in self.target_currency_pairs:
             ob = order_books.get(cp)
             if ob is None:
                 continue
-            bid_price, ask_price = self.generate_bid_ask(cp)
+            i = target_index.get(cp)
+            bid_price, ask_price = self.generate_bid_ask(cp, None if i is None else mids[i])
             # For simplicity, fixed sizes.
             ob.update_bid([bid_price], [10])
             ob.update_ask([ask_price], [10])
             # Update the price production mechanism.
             self.price_crossing.price_production.update(ob)
+
+    @profiled("maker.requote")
+    def requote(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Quotes for the targets whose mid may have moved since they were last priced, e.g. after
+        price_production.update was called for the books that ticked.
+        Returns (target rows in price_crossing.plan, bid prices, ask prices).
+        """
+        rows = self.price_crossing.refresh_dirty()
+        mids = self.price_crossing.cache.values[rows]
+        skews = self.rng.uniform(0.0001, 0.001, len(rows)) * self.risk_factor
+        return rows, mids - skews, mids + skews
@@ -1,21 +1,29 @@
-import random
+from typing import Optional
+
+import numpy as np
 
 from market.orderbook import OrderBook
 from price_construction.price_production import PriceProduction
 from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler, profiled
+from util.side import Side
 
 
 class MarketTaker:
-    def __init__(self, currency_pair: CurrencyPair, price_production: PriceProduction, risk_factor=1):
+    profiler: Profiler = NULL_PROFILER
+
+    def __init__(self, currency_pair: CurrencyPair, price_production: PriceProduction, risk_factor=1,
+                 rng: Optional[np.random.Generator] = None):
         self.currency_pair = currency_pair
         self.price_production = price_production
         self.risk_factor = risk_factor
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.inventory = 0  # Could be used for risk management adjustments
 
     def generate_bid_ask(self):
         consensus_mid, _ = self.price_production.calculate_consensus_price()
         # Adjust skew based on risk (this is a very simple example)
-        skew = random.uniform(0.0001, 0.001) * self.risk_factor
+        skew = self.rng.uniform(0.0001, 0.001) * self.risk_factor
         bid_price = consensus_mid - skew
         ask_price = consensus_mid + skew
         return bid_price, ask_price
@@ -24,4 +32,17 @@ class MarketTaker:
         bid_price, ask_price = self.generate_bid_ask()
         order_book.update_bid([bid_price], [10])
         order_book.update_ask([ask_price], [10])
-        self.price_production.update(order_book)
\ No newline at end of file
+        self.price_production.update(order_book)
+
+    @profiled("taker.place_order")
+    def place_order(self, order_book: OrderBook, side: Side, size: float) -> (float, float):
+        """
+        Execute a market order against the book. Returns (average executed price, executed size);
+        the price is NaN if nothing could be executed.
+        """
+        report = order_book.submit_market_order(side, size)
+        self.inventory += report.executed_size if side is Side.BUY else -report.executed_size
+        # Books with an on_change hook notify the price production themselves.
+        if order_book.on_change is None:
+            self.price_production.update(order_book)
+        return report.average_price, report.executed_size
@@ -0,0 +1,32 @@
+from typing import List, NamedTuple, Optional
+
+from util.side import Side
+
+
+class Fill(NamedTuple):
+    """
+    Execution against one resting order. resting_order_id is None for liquidity that entered the book
+    through a snapshot update (update_bid/update_ask) rather than as an individual order.
+    """
+    price: float
+    size: float
+    resting_order_id: Optional[int]
+
+
+class ExecutionReport(NamedTuple):
+    """
+    Result of submitting an order. order_id is set when the unfilled part of a limit order rests in the book.
+    unrested_size is the unfilled part of a limit order that could not rest because its side of the book
+    already held book_size other levels; it is dropped and order_id is None.
+    """
+    order_id: Optional[int]
+    side: Side
+    requested_size: float
+    executed_size: float
+    average_price: float
+    fills: List[Fill]
+    unrested_size: float = 0.0
+
+    @property
+    def remaining_size(self) -> float:
+        return self.requested_size - self.executed_size
@@ -1,24 +1,66 @@
+from collections import deque
+from collections.abc import MutableMapping
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
 import numpy as np
 
+from market.order import ExecutionReport, Fill
+from market.orderbook_store import OrderBookStore
 from util.currency_pair import CurrencyPair
+from util.side import Side
 
 
 class OrderBook:
-    def __init__(self, currency_pair: CurrencyPair, book_size: int = 10):
+    """
+    Lightweight view onto one row of an OrderBookStore.
+    Without an explicit store the book gets a private single-row store.
+
+    Orders are matched with price-time priority. Levels live in the store's sorted arrays, best price
+    first, and are located by binary search. Within a level, liquidity written by update_bid/update_ask
+    has priority over orders that rested later; those are kept in a FIFO queue per level.
+    Any write to the book through the store replaces the resting orders on that side. Matching, resting
+    and cancelling orders bump the store's version of the sides they change and then call on_change.
+    """
+    def __init__(self, currency_pair: CurrencyPair = None, book_size: int = 10,
+                 store: Optional[OrderBookStore] = None):
+        if store is None:
+            store = OrderBookStore(book_size=book_size, capacity=1)
         self.currency_pair = currency_pair
-        self.book_size = book_size
-        self.bid_prices = np.zeros(book_size)
-        self.bid_sizes = np.zeros(book_size)
-        self.ask_prices = np.zeros(book_size)
-        self.ask_sizes = np.zeros(book_size)
+        self.store = store
+        self.book_size = store.book_size
+        self.row = store.add_pair(currency_pair)
+        # Resting orders: order id -> [side, price, remaining size], and per (side, price) level the
+        # order ids in time priority. Cancelled ids are left in the queues and skipped lazily.
+        self._orders: Dict[int, list] = {}
+        self._queues: Dict[Tuple[Side, float], Deque[int]] = {}
+        self._next_order_id = 1
+        self._known_versions = {Side.BUY: store.bid_versions[self.row], Side.SELL: store.ask_versions[self.row]}
+        # Called with the book after orders changed its levels, e.g. the update of the PriceProduction
+        # pricing it.
+        self.on_change: Optional[Callable[["OrderBook"], None]] = None
+
+    # Arrays are looked up through the store on every access, so views stay valid if the store grows.
+    @property
+    def bid_prices(self):
+        return self.store.bid_prices[self.row, :self.store.bid_levels[self.row]]
+
+    @property
+    def bid_sizes(self):
+        return self.store.bid_sizes[self.row, :self.store.bid_levels[self.row]]
+
+    @property
+    def ask_prices(self):
+        return self.store.ask_prices[self.row, :self.store.ask_levels[self.row]]
+
+    @property
+    def ask_sizes(self):
+        return self.store.ask_sizes[self.row, :self.store.ask_levels[self.row]]
 
     def update_bid(self, new_prices, new_sizes):
-        self.bid_prices = np.array(new_prices)
-        self.bid_sizes = np.array(new_sizes)
+        self.store.update_bid(self.row, new_prices, new_sizes)
 
     def update_ask(self, new_prices, new_sizes):
-        self.ask_prices = np.array(new_prices)
-        self.ask_sizes = np.array(new_sizes)
+        self.store.update_ask(self.row, new_prices, new_sizes)
 
     def get_bid_prices(self):
         return self.bid_prices
@@ -33,4 +75,262 @@ class OrderBook:
         return self.ask_sizes
 
     def get_currency_pair(self):
-        return self.currency_pair
\ No newline at end of file
+        return self.currency_pair
+
+    def submit_market_order(self, side: Side, size: float) -> ExecutionReport:
+        """
+        Buy from the asks or sell into the bids, walking levels until `size` is filled or the side is empty.
+        """
+        return self._submit(side, size, None)
+
+    def submit_limit_order(self, side: Side, price: float, size: float) -> ExecutionReport:
+        """
+        Match against levels at or better than `price`; the unfilled remainder rests at `price`.
+        If the book side already holds book_size other levels the remainder is dropped and reported as
+        the report's unrested_size.
+        """
+        return self._submit(side, size, float(price))
+
+    def cancel_order(self, order_id: int) -> bool:
+        """
+        Remove the unfilled part of a resting order. Returns False if the order is no longer in the book.
+        """
+        order = self._orders.get(order_id)
+        if order is None:
+            return False
+        side, price, remaining = order
+        self._sync_orders(side)
+        if order_id not in self._orders:
+            return False
+        del self._orders[order_id]
+        prices, sizes, levels = self._side_arrays(side)
+        n = levels[self.row]
+        pos = self._find_level(side, prices, n, price)
+        if pos < n and prices[pos] == price:
+            sizes[pos] -= remaining
+            if sizes[pos] <= 0:
+                self._remove_levels(prices, sizes, levels, pos, 1)
+            self._written(side)
+            if self.on_change is not None:
+                self.on_change(self)
+        return True
+
+    @property
+    def next_order_id(self) -> int:
+        return self._next_order_id
+
+    def resting_orders(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (order ids, buy flags, prices, remaining sizes) of the resting orders in id order, e.g. to restore them
+        with restore_orders. Orders on sides rewritten through the store since they rested are dropped first.
+        """
+        self._sync_orders(Side.BUY)
+        self._sync_orders(Side.SELL)
+        ids = np.array(sorted(self._orders), dtype=np.int64)
+        orders = [self._orders[oid] for oid in ids.tolist()]
+        return (ids, np.array([order[0] is Side.BUY for order in orders], dtype=bool),
+                np.array([order[1] for order in orders], dtype=float),
+                np.array([order[2] for order in orders], dtype=float))
+
+    def restore_orders(self, ids, buys, prices, remaining, next_order_id: int):
+        """
+        Replace the resting orders by those returned by resting_orders() of a book in the same state. Their
+        sizes are already part of the store's levels, which are left unchanged.
+        """
+        self._orders = {}
+        self._queues = {}
+        for oid, buy, price, size in zip(np.asarray(ids).tolist(), np.asarray(buys).tolist(),
+                                         np.asarray(prices).tolist(), np.asarray(remaining).tolist()):
+            side = Side.BUY if buy else Side.SELL
+            self._orders[oid] = [side, price, size]
+            # Ids grow with time, so id order is time priority within a level.
+            self._queues.setdefault((side, price), deque()).append(oid)
+        self._next_order_id = next_order_id
+        self._known_versions = {Side.BUY: self.store.bid_versions[self.row],
+                                Side.SELL: self.store.ask_versions[self.row]}
+
+    def _side_arrays(self, side: Side):
+        # Side.BUY orders rest on the bids, Side.SELL orders on the asks.
+        if side is Side.BUY:
+            return self.store.bid_prices[self.row], self.store.bid_sizes[self.row], self.store.bid_levels
+        return self.store.ask_prices[self.row], self.store.ask_sizes[self.row], self.store.ask_levels
+
+    @staticmethod
+    def _find_level(side: Side, prices, n: int, price: float, how: str = "left") -> int:
+        # Bids are sorted descending, asks ascending.
+        if side is Side.BUY:
+            return int(np.searchsorted(-prices[:n], -price, side=how))
+        return int(np.searchsorted(prices[:n], price, side=how))
+
+    def _sync_orders(self, side: Side):
+        """
+        Drop the resting orders of a side whose levels were rewritten through the store since we last matched.
+        """
+        versions = self.store.bid_versions if side is Side.BUY else self.store.ask_versions
+        version = versions[self.row]
+        if version == self._known_versions[side]:
+            return
+        self._known_versions[side] = version
+        self._orders = {oid: order for oid, order in self._orders.items() if order[0] is not side}
+        self._queues = {key: queue for key, queue in self._queues.items() if key[0] is not side}
+
+    def _written(self, side: Side):
+        """
+        Bump the store version of a side the book changed itself, which keeps its resting orders.
+        """
+        versions = self.store.bid_versions if side is Side.BUY else self.store.ask_versions
+        versions[self.row] += 1
+        self._known_versions[side] = versions[self.row]
+
+    def _remove_levels(self, prices, sizes, levels, pos: int, count: int):
+        n = levels[self.row]
+        prices[pos:n - count] = prices[pos + count:n]
+        sizes[pos:n - count] = sizes[pos + count:n]
+        prices[n - count:n] = 0.0
+        sizes[n - count:n] = 0.0
+        levels[self.row] = n - count
+
+    def _submit(self, side: Side, size: float, limit_price: Optional[float]) -> ExecutionReport:
+        opposite = Side.SELL if side is Side.BUY else Side.BUY
+        self._sync_orders(side)
+        self._sync_orders(opposite)
+        prices, sizes, levels = self._side_arrays(opposite)
+        n = levels[self.row]
+        k = n if limit_price is None else self._find_level(opposite, prices, n, limit_price, how="right")
+        fills: List[Fill] = []
+        executed = 0.0
+        average_price = np.nan
+        if k > 0:
+            # Sweep all marketable levels at once.
+            level_sizes = sizes[:k]
+            filled_before = np.cumsum(level_sizes) - level_sizes
+            taken = np.minimum(level_sizes, np.maximum(size - filled_before, 0.0))
+            # Empty levels inside the swept range take nothing but are still consumed.
+            nonzero = np.flatnonzero(taken)
+            touched = int(nonzero[-1]) + 1 if len(nonzero) else 0
+            for i in nonzero:
+                fills.extend(self._consume_level(opposite, float(prices[i]), float(level_sizes[i]),
+                                                 float(taken[i])))
+            executed = float(taken.sum())
+            if executed > 0:
+                average_price = float(np.dot(prices[:touched], taken[:touched]) / executed)
+            sizes[:touched] -= taken[:touched]
+            consumed = int(np.count_nonzero(sizes[:touched] <= 0))
+            if consumed:
+                self._remove_levels(prices, sizes, levels, 0, consumed)
+            if touched:
+                self._written(opposite)
+        order_id = None
+        unrested = 0.0
+        if limit_price is not None and size - executed > 0:
+            order_id = self._rest(side, limit_price, size - executed)
+            if order_id is None:
+                unrested = size - executed
+        if (executed > 0 or order_id is not None) and self.on_change is not None:
+            self.on_change(self)
+        return ExecutionReport(order_id, side, size, executed, average_price, fills, unrested)
+
+    def _consume_level(self, side: Side, price: float, level_size: float, quantity: float) -> List[Fill]:
+        fills = []
+        key = (side, price)
+        queue = self._queues.get(key)
+        named = sum(self._orders[oid][2] for oid in queue if oid in self._orders) if queue else 0.0
+        anonymous = min(level_size - named, quantity)
+        if anonymous > 0:
+            fills.append(Fill(price, anonymous, None))
+            quantity -= anonymous
+        while quantity > 0 and queue:
+            oid = queue[0]
+            order = self._orders.get(oid)
+            if order is None:
+                queue.popleft()
+                continue
+            take = min(order[2], quantity)
+            fills.append(Fill(price, take, oid))
+            order[2] -= take
+            quantity -= take
+            if order[2] <= 0:
+                queue.popleft()
+                del self._orders[oid]
+        if queue is not None and not queue:
+            del self._queues[key]
+        return fills
+
+    def _rest(self, side: Side, price: float, size: float) -> Optional[int]:
+        """
+        Rest an order at `price` and return its id, None if that needs a new level and the side is full.
+        """
+        prices, sizes, levels = self._side_arrays(side)
+        n = levels[self.row]
+        pos = self._find_level(side, prices, n, price)
+        if pos < n and prices[pos] == price:
+            sizes[pos] += size
+        else:
+            if n == self.book_size:
+                return None
+            prices[pos + 1:n + 1] = prices[pos:n]
+            sizes[pos + 1:n + 1] = sizes[pos:n]
+            prices[pos] = price
+            sizes[pos] = size
+            levels[self.row] = n + 1
+        self._written(side)
+        order_id = self._next_order_id
+        self._next_order_id += 1
+        self._orders[order_id] = [side, price, size]
+        self._queues.setdefault((side, price), deque()).append(order_id)
+        return order_id
+
+
+class LazyOrderBooks(MutableMapping):
+    """
+    Mapping from CurrencyPair to the OrderBook views of all pairs in an OrderBookStore.
+    A view is only created when its pair is first looked up, so a large universe costs one store row
+    per pair until its book is touched. Iterating keys, len and `in` never create views; books of other
+    stores can be assigned and are kept as given.
+    """
+    def __init__(self, store: OrderBookStore):
+        self.store = store
+        self._books: Dict[CurrencyPair, OrderBook] = {}
+        # Assigned pairs that have no row in the store.
+        self._extra: Dict[CurrencyPair, None] = {}
+        # on_change given to every view created from now on (see OrderBook.on_change).
+        self.on_change: Optional[Callable[[OrderBook], None]] = None
+
+    def __getitem__(self, currency_pair: CurrencyPair) -> OrderBook:
+        book = self._books.get(currency_pair)
+        if book is None:
+            if currency_pair not in self.store:
+                raise KeyError(currency_pair)
+            book = self._books[currency_pair] = OrderBook(currency_pair=currency_pair, store=self.store)
+            book.on_change = self.on_change
+        return book
+
+    def __setitem__(self, currency_pair: CurrencyPair, order_book: OrderBook):
+        self._books[currency_pair] = order_book
+        if currency_pair not in self.store:
+            self._extra[currency_pair] = None
+
+    def __delitem__(self, currency_pair: CurrencyPair):
+        raise TypeError("Books of a LazyOrderBooks mapping cannot be removed")
+
+    def __contains__(self, currency_pair) -> bool:
+        return currency_pair in self.store or currency_pair in self._extra
+
+    def __iter__(self):
+        yield from self.store.currency_pairs
+        yield from self._extra
+
+    def __len__(self) -> int:
+        return len(self.store) + len(self._extra)
+
+    def created(self) -> int:
+        """
+        Number of book views created or assigned so far.
+        """
+        return len(self._books)
+
+    def created_books(self) -> List[OrderBook]:
+        """
+        The book views created or assigned so far.
+        """
+        return list(self._books.values())
@@ -0,0 +1,258 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from util.currency_pair import CurrencyPair
+from util.pair_index import PairIndex
+
+
+class OrderBookStore:
+    """
+    Columnar storage for the order books of many currency pairs.
+    Every side of every book is one row of a preallocated (pairs x levels) array,
+    so updates write in place and all books can be processed in one NumPy pass.
+    """
+    def __init__(self, book_size: int = 10, capacity: int = 16):
+        self.book_size = book_size
+        self.currency_pairs: List[CurrencyPair] = []
+        self.index: Dict[CurrencyPair, int] = {}
+        self.pair_rows = PairIndex()
+        self._allocate(max(capacity, 1))
+
+    def _allocate(self, capacity: int):
+        self.capacity = capacity
+        # Bid prices, bid sizes, ask prices and ask sizes, one array so that all of them can be copied at once.
+        self._books = np.zeros((4, capacity, self.book_size))
+        self._bid_prices, self._bid_sizes, self._ask_prices, self._ask_sizes = self._books
+        # Number of populated levels per row of the bid and the ask side, levels are packed best-first.
+        self._levels = np.zeros((2, capacity), dtype=np.int64)
+        self._bid_levels, self._ask_levels = self._levels
+        # Bumped by every write through the store, so OrderBook can tell when its resting orders were replaced.
+        self._bid_versions = np.zeros(capacity, dtype=np.int64)
+        self._ask_versions = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self, capacity: int):
+        n = len(self.currency_pairs)
+        old = (self._bid_prices, self._bid_sizes, self._ask_prices, self._ask_sizes,
+               self._bid_levels, self._ask_levels, self._bid_versions, self._ask_versions)
+        self._allocate(capacity)
+        new = (self._bid_prices, self._bid_sizes, self._ask_prices, self._ask_sizes,
+               self._bid_levels, self._ask_levels, self._bid_versions, self._ask_versions)
+        for src, dst in zip(old, new):
+            dst[:n] = src[:n]
+
+    def __len__(self):
+        return len(self.currency_pairs)
+
+    def __contains__(self, currency_pair: CurrencyPair):
+        return currency_pair in self.index
+
+    def add_pair(self, currency_pair: CurrencyPair) -> int:
+        """
+        Register a currency pair and return its row. Registering twice returns the same row.
+        """
+        row = self.index.get(currency_pair)
+        if row is not None:
+            return row
+        row = len(self.currency_pairs)
+        if row == self.capacity:
+            self._grow(2 * self.capacity)
+        self.currency_pairs.append(currency_pair)
+        self.index[currency_pair] = row
+        if currency_pair is not None:
+            self.pair_rows[currency_pair] = row
+        return row
+
+    def add_pairs(self, currency_pairs: Sequence[CurrencyPair]) -> np.ndarray:
+        """
+        add_pair for many pairs at once, growing the arrays at most once. Returns their rows.
+        """
+        new_pairs = [cp for cp in dict.fromkeys(currency_pairs) if cp not in self.index]
+        start = len(self.currency_pairs)
+        if start + len(new_pairs) > self.capacity:
+            self._grow(max(2 * self.capacity, start + len(new_pairs)))
+        self.currency_pairs.extend(new_pairs)
+        self.index.update(zip(new_pairs, range(start, start + len(new_pairs))))
+        self.pair_rows.set_many([cp for cp in new_pairs if cp is not None],
+                                [start + i for i, cp in enumerate(new_pairs) if cp is not None])
+        return np.array([self.index[cp] for cp in currency_pairs], dtype=np.int64)
+
+    def get_index(self, currency_pair: CurrencyPair) -> Optional[int]:
+        return self.index.get(currency_pair)
+
+    def get_indices(self, currency_pairs) -> np.ndarray:
+        """
+        Rows of many pairs at once, -1 for pairs that are not registered.
+        """
+        return self.pair_rows.lookup(currency_pairs)
+
+    # Views over the registered rows only.
+    @property
+    def bid_prices(self) -> np.ndarray:
+        return self._bid_prices[:len(self.currency_pairs)]
+
+    @property
+    def bid_sizes(self) -> np.ndarray:
+        return self._bid_sizes[:len(self.currency_pairs)]
+
+    @property
+    def ask_prices(self) -> np.ndarray:
+        return self._ask_prices[:len(self.currency_pairs)]
+
+    @property
+    def ask_sizes(self) -> np.ndarray:
+        return self._ask_sizes[:len(self.currency_pairs)]
+
+    @property
+    def bid_levels(self) -> np.ndarray:
+        return self._bid_levels[:len(self.currency_pairs)]
+
+    @property
+    def ask_levels(self) -> np.ndarray:
+        return self._ask_levels[:len(self.currency_pairs)]
+
+    @property
+    def books(self) -> np.ndarray:
+        """
+        bid_prices, bid_sizes, ask_prices and ask_sizes as one (4, pairs, levels) view.
+        """
+        return self._books[:, :len(self.currency_pairs)]
+
+    @property
+    def levels(self) -> np.ndarray:
+        """
+        bid_levels and ask_levels as one (2, pairs) view.
+        """
+        return self._levels[:, :len(self.currency_pairs)]
+
+    @property
+    def bid_versions(self) -> np.ndarray:
+        return self._bid_versions[:len(self.currency_pairs)]
+
+    @property
+    def ask_versions(self) -> np.ndarray:
+        return self._ask_versions[:len(self.currency_pairs)]
+
+    def max_levels(self) -> int:
+        """
+        Number of populated levels of the deepest book side, at least 1.
+        """
+        n = len(self.currency_pairs)
+        if n == 0:
+            return 1
+        return max(int(self._levels[:, :n].max()), 1)
+
+    def _write_side(self, prices_2d, sizes_2d, levels, versions, row: int, new_prices, new_sizes):
+        n = len(new_prices)
+        if n > self.book_size:
+            raise ValueError(f"Got {n} levels but the book holds at most {self.book_size}")
+        if len(new_sizes) != n:
+            raise ValueError("Prices and sizes must have the same number of levels")
+        prices_2d[row, :n] = new_prices
+        sizes_2d[row, :n] = new_sizes
+        prices_2d[row, n:] = 0.0
+        sizes_2d[row, n:] = 0.0
+        levels[row] = n
+        versions[row] += 1
+
+    def update_bid(self, row: int, new_prices, new_sizes):
+        self._write_side(self._bid_prices, self._bid_sizes, self._bid_levels, self._bid_versions, row, new_prices, new_sizes)
+
+    def update_ask(self, row: int, new_prices, new_sizes):
+        self._write_side(self._ask_prices, self._ask_sizes, self._ask_levels, self._ask_versions, row, new_prices, new_sizes)
+
+    def update_all(self, bid_prices, bid_sizes, ask_prices, ask_sizes, rows=None, bid_levels=None, ask_levels=None):
+        """
+        Replace both sides of many books in one call.
+        Inputs are (pairs,) arrays for top-of-book quotes or (pairs, levels) arrays for deeper books.
+        rows selects which books are written; by default all registered books in row order.
+        bid_levels/ask_levels give the number of populated levels per book when the (pairs, levels) inputs
+        are padded with empty levels; by default every given level is populated.
+        """
+        if rows is None:
+            rows = slice(0, len(self.currency_pairs))
+        self._write_sides(self._bid_prices, self._bid_sizes, self._bid_levels, self._bid_versions, rows,
+                          bid_prices, bid_sizes, bid_levels)
+        self._write_sides(self._ask_prices, self._ask_sizes, self._ask_levels, self._ask_versions, rows,
+                          ask_prices, ask_sizes, ask_levels)
+
+    def load_snapshot(self, bid_prices, bid_sizes, ask_prices, ask_sizes, bid_levels, ask_levels,
+                      bid_versions=None, ask_versions=None):
+        """
+        Overwrite all registered books with full (pairs x book_size) arrays and their level counts,
+        e.g. a snapshot previously taken from the same store. Every book counts as written unless the
+        versions of the snapshot are given too, which restores them.
+        """
+        n = len(self.currency_pairs)
+        self._bid_prices[:n] = bid_prices
+        self._bid_sizes[:n] = bid_sizes
+        self._ask_prices[:n] = ask_prices
+        self._ask_sizes[:n] = ask_sizes
+        self._bid_levels[:n] = bid_levels
+        self._ask_levels[:n] = ask_levels
+        if bid_versions is None:
+            self._bid_versions[:n] += 1
+        else:
+            self._bid_versions[:n] = bid_versions
+        if ask_versions is None:
+            self._ask_versions[:n] += 1
+        else:
+            self._ask_versions[:n] = ask_versions
+
+    def _write_sides(self, prices_2d, sizes_2d, levels, versions, rows, new_prices, new_sizes, new_levels=None):
+        new_prices = np.asarray(new_prices, dtype=float)
+        new_sizes = np.asarray(new_sizes, dtype=float)
+        if new_prices.ndim == 1:
+            new_prices = new_prices[:, None]
+            new_sizes = new_sizes[:, None]
+        n = new_prices.shape[1]
+        if n > self.book_size:
+            raise ValueError(f"Got {n} levels but the book holds at most {self.book_size}")
+        if not isinstance(rows, slice):
+            rows = np.asarray(rows)
+        prices_2d[rows, :n] = new_prices
+        sizes_2d[rows, :n] = new_sizes
+        prices_2d[rows, n:] = 0.0
+        sizes_2d[rows, n:] = 0.0
+        levels[rows] = n if new_levels is None else new_levels
+        versions[rows] += 1
+
+    def sweep(self, rows, buy, quantities):
+        """
+        Execute one market order against each of many books at once, walking levels best-first.
+        buy[i] takes quantities[i] from the asks of book rows[i], otherwise from its bids. Rows must be distinct.
+        Consumed levels are removed and the remaining levels shifted to the front.
+        Returns (average execution prices, executed sizes); the price is NaN where nothing was executed.
+        """
+        rows = np.asarray(rows)
+        buy = np.asarray(buy, dtype=bool)
+        quantities = np.asarray(quantities, dtype=float)
+        average_prices = np.full(len(rows), np.nan)
+        executed = np.zeros(len(rows))
+        width = self.max_levels()
+        columns = np.arange(width)
+        for side_mask, prices_2d, sizes_2d, levels, versions in (
+                (buy, self._ask_prices, self._ask_sizes, self._ask_levels, self._ask_versions),
+                (~buy, self._bid_prices, self._bid_sizes, self._bid_levels, self._bid_versions)):
+            side_rows = rows[side_mask]
+            if len(side_rows) == 0:
+                continue
+            prices = prices_2d[side_rows, :width]
+            sizes = sizes_2d[side_rows, :width]
+            filled_before = np.cumsum(sizes, axis=1) - sizes
+            taken = np.minimum(sizes, np.maximum(quantities[side_mask, None] - filled_before, 0.0))
+            total = taken.sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                average_prices[side_mask] = np.where(total > 0, np.sum(prices * taken, axis=1) / total, np.nan)
+            executed[side_mask] = total
+            remaining = sizes - taken
+            # Levels are consumed from the front, so drop the leading empty ones.
+            consumed = np.sum((remaining <= 0) & (columns < levels[side_rows, None]), axis=1)
+            source = columns + consumed[:, None]
+            valid = source < width
+            source = np.minimum(source, width - 1)
+            prices_2d[side_rows, :width] = np.where(valid, np.take_along_axis(prices, source, axis=1), 0.0)
+            sizes_2d[side_rows, :width] = np.where(valid, np.take_along_axis(remaining, source, axis=1), 0.0)
+            levels[side_rows] -= consumed
+            versions[side_rows] += 1
+        return average_prices, executed
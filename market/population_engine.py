@@ -0,0 +1,175 @@
+from typing import Callable, List, NamedTuple, Optional
+
+import numpy as np
+
+from market.agent_population import MakerPopulation, TakerPopulation
+from market.orderbook_store import OrderBookStore
+from price_construction.price_crossing import PriceCrossing
+from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler, profiled
+
+
+class PopulationStepResult(NamedTuple):
+    """
+    Outcome of one population step, one entry per pair (see PopulationEngine.currency_pairs).
+    Sizes are totals over all takers of a pair; prices are NaN where nothing traded or nobody quoted.
+    """
+    mid_prices: np.ndarray
+    bid_prices: np.ndarray
+    ask_prices: np.ndarray
+    buy_sizes: np.ndarray
+    sell_sizes: np.ndarray
+    executed_buy_sizes: np.ndarray
+    executed_sell_sizes: np.ndarray
+    buy_prices: np.ndarray
+    sell_prices: np.ndarray
+
+
+class _BookSide:
+    """
+    One side of all books built from the makers' quotes: quotes with a positive size, sorted by pair and
+    then best price first, at most `depth` per pair.
+    """
+    def __init__(self, pairs: np.ndarray, prices: np.ndarray, sizes: np.ndarray, bids: bool,
+                 n_pairs: int, depth: int):
+        quoted = np.flatnonzero(sizes > 0)
+        order = quoted[np.lexsort((-prices[quoted] if bids else prices[quoted], pairs[quoted]))]
+        positions = _group_positions(pairs[order], n_pairs)
+        visible = positions < depth
+        self.makers = order[visible]
+        self.pairs = pairs[self.makers]
+        self.prices = prices[self.makers]
+        self.sizes = sizes[self.makers]
+        self.positions = positions[visible]
+        self.n_pairs = n_pairs
+        self.depth = depth
+
+    def best_prices(self) -> np.ndarray:
+        best = np.full(self.n_pairs, np.nan)
+        top = self.positions == 0
+        best[self.pairs[top]] = self.prices[top]
+        return best
+
+    def match(self, quantities: np.ndarray):
+        """
+        Fill quantities[p] against the quotes of pair p, best first.
+        Returns (taken per quote, executed size per pair, executed notional per pair).
+        """
+        filled_before = np.cumsum(self.sizes) - self.sizes
+        # Quotes of earlier pairs are not part of this pair's book.
+        first = self.positions == 0
+        pair_offset = np.zeros(self.n_pairs)
+        pair_offset[self.pairs[first]] = filled_before[first]
+        filled_before -= pair_offset[self.pairs]
+        taken = np.minimum(self.sizes, np.maximum(quantities[self.pairs] - filled_before, 0.0))
+        executed = np.bincount(self.pairs, weights=taken, minlength=self.n_pairs)
+        notional = np.bincount(self.pairs, weights=taken * self.prices, minlength=self.n_pairs)
+        return taken, executed, notional
+
+    def residual_books(self, taken: np.ndarray):
+        """
+        (pairs x depth) prices and sizes of what is left after taking `taken`, and the levels per pair.
+        Quotes are consumed best first, so the levels left are shifted forward by the ones used up.
+        """
+        remaining = self.sizes - taken
+        left = remaining > 0
+        consumed = np.bincount(self.pairs, weights=~left, minlength=self.n_pairs).astype(np.int64)
+        pairs = self.pairs[left]
+        positions = self.positions[left] - consumed[pairs]
+        prices = np.zeros((self.n_pairs, self.depth))
+        sizes = np.zeros((self.n_pairs, self.depth))
+        prices[pairs, positions] = self.prices[left]
+        sizes[pairs, positions] = remaining[left]
+        return prices, sizes, np.bincount(pairs, minlength=self.n_pairs)
+
+
+def _group_positions(groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Position of every element within its group, for elements sorted by group.
+    """
+    starts = np.searchsorted(groups, np.arange(n_groups))
+    return np.arange(len(groups)) - starts[groups]
+
+
+class PopulationEngine:
+    """
+    Headless stepping of a population of market makers and takers over all pairs.
+    Each step every maker quotes its pair around the PriceCrossing mid, skewed by its inventory, and the
+    books are rebuilt from the best `book_size` quotes per side. Every taker then draws an order; orders
+    of one pair and side are batched and filled against the book best price first, and each taker gets
+    its pro rata share of the fill at the batch's average price. Quote generation, matching and the
+    inventory and cash updates of all agents are vectorized over the population.
+    """
+    profiler: Profiler = NULL_PROFILER
+
+    def __init__(self, store: OrderBookStore, price_crossing: PriceCrossing, makers: MakerPopulation,
+                 takers: TakerPopulation, rng: Optional[np.random.Generator] = None):
+        self.store = store
+        self.price_crossing = price_crossing
+        self.makers = makers
+        self.takers = takers
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Only targets that have a book are traded; agents refer to them by position.
+        self.currency_pairs: List[CurrencyPair] = [cp for cp in price_crossing.target_currency_pairs if cp in store]
+        self.target_rows = price_crossing.plan.target_rows.lookup(self.currency_pairs)
+        self.book_rows = store.get_indices(self.currency_pairs)
+        self.pair_ids = CurrencyPair.ids(self.currency_pairs)
+        n = len(self.currency_pairs)
+        for name, agents in (("maker", makers), ("taker", takers)):
+            if len(agents) and (agents.pairs.min() < 0 or agents.pairs.max() >= n):
+                raise ValueError(f"Every {name} must trade one of the {n} pairs of the engine")
+
+    @profiled("population.step")
+    def step(self) -> PopulationStepResult:
+        n = len(self.currency_pairs)
+        depth = self.store.book_size
+        makers, takers, profiler = self.makers, self.takers, self.profiler
+        mids = self.price_crossing.generate_mid_prices()[self.target_rows]
+        with profiler.stage("population.quote"):
+            bid_prices, bid_sizes, ask_prices, ask_sizes = makers.quotes(mids)
+            bids = _BookSide(makers.pairs, bid_prices, bid_sizes, True, n, depth)
+            asks = _BookSide(makers.pairs, ask_prices, ask_sizes, False, n, depth)
+        with profiler.stage("population.match"):
+            buy, sizes = takers.orders(self.rng)
+            buy_sizes = np.bincount(takers.pairs, weights=np.where(buy, sizes, 0.0), minlength=n)
+            sell_sizes = np.bincount(takers.pairs, weights=np.where(buy, 0.0, sizes), minlength=n)
+            # Buyers lift the makers' asks, sellers hit their bids.
+            ask_taken, executed_buys, buy_notional = asks.match(buy_sizes)
+            bid_taken, executed_sells, sell_notional = bids.match(sell_sizes)
+            # Each maker has at most one quote per side, so the indexed updates do not collide.
+            makers.inventory[asks.makers] -= ask_taken
+            makers.cash[asks.makers] += ask_taken * asks.prices
+            makers.inventory[bids.makers] += bid_taken
+            makers.cash[bids.makers] -= bid_taken * bids.prices
+            with np.errstate(invalid="ignore", divide="ignore"):
+                buy_prices = np.where(executed_buys > 0, buy_notional / executed_buys, np.nan)
+                sell_prices = np.where(executed_sells > 0, sell_notional / executed_sells, np.nan)
+                buy_ratios = np.where(buy_sizes > 0, executed_buys / buy_sizes, 0.0)
+                sell_ratios = np.where(sell_sizes > 0, executed_sells / sell_sizes, 0.0)
+            fills = sizes * np.where(buy, buy_ratios[takers.pairs], sell_ratios[takers.pairs])
+            fill_prices = np.where(buy, buy_prices[takers.pairs], sell_prices[takers.pairs])
+            signed = np.where(buy, fills, -fills)
+            takers.inventory += signed
+            takers.cash -= np.where(fills > 0, signed * fill_prices, 0.0)
+        with profiler.stage("population.books"):
+            bid_book = bids.residual_books(bid_taken)
+            ask_book = asks.residual_books(ask_taken)
+            self.store.update_all(bid_book[0], bid_book[1], ask_book[0], ask_book[1], rows=self.book_rows,
+                                  bid_levels=bid_book[2], ask_levels=ask_book[2])
+        if profiler.enabled:
+            profiler.add_pairs("population.executed_size", self.pair_ids, executed_buys + executed_sells)
+        self.price_crossing.price_production.update_rows(self.store, self.book_rows)
+        return PopulationStepResult(mids, bids.best_prices(), asks.best_prices(), buy_sizes, sell_sizes,
+                                    executed_buys, executed_sells, buy_prices, sell_prices)
+
+    def run(self, steps: int, on_step: Optional[Callable[[int, PopulationStepResult], None]] = None) \
+            -> Optional[PopulationStepResult]:
+        """
+        Advance `steps` steps, passing every result to on_step if given. Returns the last result.
+        """
+        result = None
+        for step in range(steps):
+            result = self.step()
+            if on_step is not None:
+                on_step(step, result)
+        return result
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from market.market_maker import MarketMaker
+from market.orderbook import OrderBook
+from util.currency_pair import CurrencyPair
+
+
+class BookUpdate(NamedTuple):
+    """
+    New levels for one book, best price first, stamped with time.perf_counter_ns() on arrival.
+    """
+    currency_pair: CurrencyPair
+    bid_prices: np.ndarray
+    bid_sizes: np.ndarray
+    ask_prices: np.ndarray
+    ask_sizes: np.ndarray
+    received_ns: int
+
+
+class QuoteStream:
+    """
+    Event driven quoting. Book updates are published into a one-slot mailbox per pair; a newer update
+    for a pair that has not been processed yet replaces the older one, so bursts coalesce and only the
+    newest book is applied. The consumer applies all pending updates, notifies the price production for
+    those books only, in one batch, and lets the market maker requote the targets depending on them.
+
+    Tick-to-quote latency is the time from an update's arrival to the publication of the quotes it led to.
+    """
+    def __init__(self, order_books: Dict[CurrencyPair, OrderBook], market_maker: MarketMaker,
+                 on_quote: Optional[Callable[[np.ndarray, np.ndarray, np.ndarray], None]] = None,
+                 on_books: Optional[Callable[[List[OrderBook]], None]] = None):
+        """
+        on_quote: Receives (target rows in market_maker.price_crossing.plan, bid prices, ask prices)
+                  whenever quotes are published.
+        on_books: Receives the books of every batch of applied updates, once the price production knows them.
+        """
+        self.order_books = order_books
+        self.market_maker = market_maker
+        self.price_production = market_maker.price_crossing.price_production
+        self.on_quote = on_quote
+        self.on_books = on_books
+        n_targets = len(market_maker.price_crossing.plan)
+        # Latest quote per target, NaN until first quoted.
+        self.bid_prices = np.full(n_targets, np.nan)
+        self.ask_prices = np.full(n_targets, np.nan)
+        self._pending: Dict[CurrencyPair, BookUpdate] = {}
+        # Pairs with a pending update, in the order they became pending; None stops the consumer.
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self.closed = False
+        self.received = 0
+        self.coalesced = 0
+        self.processed = 0
+        self.quotes = 0
+        self._latencies_ns: List[int] = []
+
+    def publish(self, update: BookUpdate):
+        """
+        Hand over a book update; never blocks. Updates for pairs without a book, and updates published
+        after close(), are dropped.
+        """
+        if self.closed or update.currency_pair not in self.order_books:
+            return
+        self.received += 1
+        if update.currency_pair in self._pending:
+            self.coalesced += 1
+        else:
+            self._ready.put_nowait(update.currency_pair)
+        self._pending[update.currency_pair] = update
+
+    def close(self):
+        """
+        Stop the consumer once the updates published so far are processed.
+        """
+        if not self.closed:
+            self.closed = True
+            self._ready.put_nowait(None)
+
+    async def run(self):
+        """
+        Consume updates until close() is called.
+        """
+        while True:
+            pair = await self._ready.get()
+            pairs = [pair]
+            # Everything that became ready meanwhile is handled in the same pass.
+            while not self._ready.empty():
+                pairs.append(self._ready.get_nowait())
+            # Nothing is queued behind the None, publish() drops updates once closed.
+            stop = None in pairs
+            self._process([cp for cp in pairs if cp is not None])
+            if stop:
+                return
+
+    def _process(self, pairs: List[CurrencyPair]):
+        if not pairs:
+            return
+        received = []
+        books = []
+        for cp in pairs:
+            update = self._pending.pop(cp)
+            ob = self.order_books[cp]
+            ob.update_bid(update.bid_prices, update.bid_sizes)
+            ob.update_ask(update.ask_prices, update.ask_sizes)
+            books.append(ob)
+            received.append(update.received_ns)
+        self.price_production.update_many(books)
+        if self.on_books is not None:
+            self.on_books(books)
+        rows, bids, asks = self.market_maker.requote()
+        self.bid_prices[rows] = bids
+        self.ask_prices[rows] = asks
+        if self.on_quote is not None and len(rows):
+            self.on_quote(rows, bids, asks)
+        quoted_ns = time.perf_counter_ns()
+        self.processed += len(received)
+        self.quotes += len(rows)
+        self._latencies_ns.extend(quoted_ns - t for t in received)
+
+    def latency_stats(self) -> dict:
+        """
+        Tick-to-quote latency percentiles in microseconds over the processed updates, and update counts.
+        """
+        latencies = np.array(self._latencies_ns, dtype=np.float64) / 1e3
+        stats = {"received": self.received, "coalesced": self.coalesced, "processed": self.processed,
+                 "quotes": self.quotes}
+        if len(latencies):
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            stats.update(mean_us=float(latencies.mean()), p50_us=float(p50), p90_us=float(p90),
+                         p99_us=float(p99), max_us=float(latencies.max()))
+        return stats
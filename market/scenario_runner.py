@@ -0,0 +1,125 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional, Sequence
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.simulation_engine import StepResult
+from util.currency_pair import CurrencyPair
+
+# Columns of the summary array, one row per run.
+SUMMARY_FIELDS = (
+    "mean_quoted_spread",    # mean of (ask - bid) / mid over steps and pairs
+    "mean_execution_cost",   # size weighted mean of |executed price - mid| / mid
+    "executed_volume",       # total size executed by the takers
+    "mid_return_std",        # standard deviation of the per-step log mid returns
+)
+
+
+class _RunSummary:
+    """
+    Accumulates the SUMMARY_FIELDS of one run from the engine's step results.
+    """
+    def __init__(self):
+        self.steps = 0
+        self.quoted_spread_sum = 0.0
+        self.cost_sum = 0.0
+        self.volume = 0.0
+        self.return_count = 0
+        self.return_sum = 0.0
+        self.return_square_sum = 0.0
+        self.last_mids = None
+
+    def __call__(self, step: int, result: StepResult):
+        mids = result.mid_prices
+        self.steps += 1
+        self.quoted_spread_sum += np.mean((result.ask_prices - result.bid_prices) / mids)
+        executed = result.executed_sizes > 0
+        self.cost_sum += np.sum(np.abs(result.executed_prices[executed] / mids[executed] - 1.0)
+                                * result.executed_sizes[executed])
+        self.volume += np.sum(result.executed_sizes)
+        if self.last_mids is not None:
+            returns = np.log(mids / self.last_mids)
+            self.return_count += len(returns)
+            self.return_sum += np.sum(returns)
+            self.return_square_sum += np.sum(returns * returns)
+        self.last_mids = mids
+
+    def as_row(self) -> np.ndarray:
+        return_variance = 0.0
+        if self.return_count:
+            mean = self.return_sum / self.return_count
+            return_variance = max(self.return_square_sum / self.return_count - mean * mean, 0.0)
+        return np.array([
+            self.quoted_spread_sum / max(self.steps, 1),
+            self.cost_sum / self.volume if self.volume > 0 else np.nan,
+            self.volume,
+            np.sqrt(return_variance),
+        ])
+
+
+def run_scenario(currency_pairs: Sequence[CurrencyPair], steps: int, risk_factor: float,
+                 seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    One headless simulation run, summarised as a row of SUMMARY_FIELDS.
+    """
+    simulation = FXMarketSimulation(list(currency_pairs), seed=seed, risk_factor=risk_factor)
+    summary = _RunSummary()
+    simulation.run_batch(steps, on_step=summary)
+    return summary.as_row()
+
+
+# Per worker process state, set once by _init_worker.
+_worker_state = {}
+
+
+def _init_worker(shm_name: str, shape, currency_pairs, steps):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state["shm"] = shm
+    _worker_state["results"] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker_state["currency_pairs"] = currency_pairs
+    _worker_state["steps"] = steps
+
+
+def _run_in_worker(run_index: int, risk_factor: float, seed: np.random.SeedSequence) -> int:
+    _worker_state["results"][run_index] = run_scenario(_worker_state["currency_pairs"], _worker_state["steps"],
+                                                       risk_factor, seed)
+    return run_index
+
+
+class ScenarioRunner:
+    """
+    Monte-Carlo runner for FXMarketSimulation. Runs are sharded over a process pool; each run gets
+    its own generator spawned from one SeedSequence, so results depend only on the seed and never on
+    the number of workers. Workers write their summary row straight into a shared memory array.
+    """
+    def __init__(self, currency_pairs: Sequence[CurrencyPair], steps: int = 100, workers: Optional[int] = None):
+        self.currency_pairs = list(currency_pairs)
+        self.steps = steps
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+
+    def run(self, risk_factors: Sequence[float], seed: int = 0) -> np.ndarray:
+        """
+        One run per entry of risk_factors. Returns a (runs x len(SUMMARY_FIELDS)) array.
+        """
+        risk_factors = [float(r) for r in risk_factors]
+        seeds = np.random.SeedSequence(seed).spawn(len(risk_factors))
+        shape = (len(risk_factors), len(SUMMARY_FIELDS))
+        if self.workers <= 1 or len(risk_factors) <= 1:
+            results = np.empty(shape)
+            for i, (risk_factor, run_seed) in enumerate(zip(risk_factors, seeds)):
+                results[i] = run_scenario(self.currency_pairs, self.steps, risk_factor, run_seed)
+            return results
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(risk_factors)), initializer=_init_worker,
+                                     initargs=(shm.name, shape, self.currency_pairs, self.steps)) as pool:
+                # Consume the iterator so worker exceptions are raised here.
+                list(pool.map(_run_in_worker, range(len(risk_factors)), risk_factors, seeds,
+                              chunksize=max(1, len(risk_factors) // (4 * self.workers))))
+            return np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
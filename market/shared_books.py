@@ -0,0 +1,303 @@
+import json
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from market.orderbook_store import OrderBookStore
+from price_construction.price_production import PriceProduction
+from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler, profiled
+
+MAGIC = b"FXSHM001"
+# Magic, header length, then the control block: publish sequence and the version of each buffer.
+PREAMBLE_SIZE = 40
+ALIGNMENT = 4096
+
+
+def _columns(n_pairs: int, book_size: int) -> List[tuple]:
+    """
+    (name, dtype, shape) of every column of one buffer. Rows follow the store's pair order.
+    """
+    book = (n_pairs, book_size)
+    return [
+        ("bid_prices", "<f8", book),
+        ("bid_sizes", "<f8", book),
+        ("ask_prices", "<f8", book),
+        ("ask_sizes", "<f8", book),
+        ("bid_levels", "<i8", (n_pairs,)),
+        ("ask_levels", "<i8", (n_pairs,)),
+        # Mid and spread of every book from the price production, NaN where it does not price the pair.
+        ("mid_prices", "<f8", (n_pairs,)),
+        ("spreads", "<f8", (n_pairs,)),
+        # Publish sequence number and wall clock time in ns of the snapshot.
+        ("meta", "<i8", (2,)),
+    ]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing segment without taking ownership of it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Before Python 3.13 attaching registers the segment with the resource tracker, which would unlink it
+    # when the attaching process exits even though the writer owns it.
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class _Layout:
+    """
+    Layout of a shared segment: preamble, JSON header, then two buffers of the same columns, each
+    column stored contiguously.
+    """
+    def __init__(self, header: dict):
+        self.header = header
+        encoded = json.dumps(header).encode()
+        self.encoded_header = encoded
+        self.data_offset = -(-(PREAMBLE_SIZE + len(encoded)) // ALIGNMENT) * ALIGNMENT
+        self.columns: Dict[str, tuple] = {}
+        offset = 0
+        for name, dtype, shape in _columns(len(header["currency_pairs"]), header["book_size"]):
+            shape = tuple(shape)
+            self.columns[name] = (np.dtype(dtype), shape, offset)
+            offset += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 64) * 64
+        self.buffer_bytes = offset
+        self.size = self.data_offset + 2 * offset
+
+    def control(self, buffer) -> np.ndarray:
+        """
+        [sequence, version of buffer 0, version of buffer 1] over the segment.
+        """
+        return np.ndarray(3, dtype="<i8", buffer=buffer, offset=16)
+
+    def views(self, buffer, index: int) -> Dict[str, np.ndarray]:
+        base = self.data_offset + index * self.buffer_bytes
+        return {name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=base + offset)
+                for name, (dtype, shape, offset) in self.columns.items()}
+
+
+class BookSnapshot(NamedTuple):
+    """
+    Books and prices of one publish, as (pairs x book_size) and (pairs,) arrays in the writer's pair order.
+    """
+    sequence: int
+    published_ns: int
+    bid_prices: np.ndarray
+    bid_sizes: np.ndarray
+    ask_prices: np.ndarray
+    ask_sizes: np.ndarray
+    bid_levels: np.ndarray
+    ask_levels: np.ndarray
+    mid_prices: np.ndarray
+    spreads: np.ndarray
+
+
+class SharedBookWriter:
+    """
+    Publishes the books of an OrderBookStore and the prices of a PriceProduction to a
+    multiprocessing.shared_memory segment that SharedBookReader attaches to from other processes.
+
+    The segment holds two buffers. Each publish writes the buffer readers are not pointed at and then
+    flips the sequence number to it, bracketing the write with a per buffer version that is odd while
+    the buffer is being written (a seqlock). The simulation never waits for readers, and readers never
+    see a partly written buffer: a reader finishing within one publish interval reads the current buffer
+    in place, and a slower one notices the changed version and retries.
+    """
+    profiler: Profiler = NULL_PROFILER
+
+    def __init__(self, store: OrderBookStore, price_production: Optional[PriceProduction] = None,
+                 name: Optional[str] = None):
+        """
+        name: Name of the segment, generated if not given; readers attach by it (see name).
+        The segment is sized for the pairs the store holds now.
+        """
+        self.store = store
+        self.price_production = price_production
+        self.currency_pairs = list(store.currency_pairs)
+        self.layout = _Layout({"currency_pairs": [[cp.base, cp.quote] for cp in self.currency_pairs],
+                               "book_size": store.book_size})
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=self.layout.size)
+        self.name = self._shm.name
+        buffer = self._shm.buf
+        buffer[:8] = MAGIC
+        buffer[8:16] = np.array([len(self.layout.encoded_header)], dtype="<u8").tobytes()
+        buffer[PREAMBLE_SIZE:PREAMBLE_SIZE + len(self.layout.encoded_header)] = self.layout.encoded_header
+        self._control = self.layout.control(buffer)
+        self._control[:] = 0
+        self._buffers = [self.layout.views(buffer, 0), self.layout.views(buffer, 1)]
+        self._price_known = self._price_rows = None
+        self._priced = -1
+
+    @property
+    def sequence(self) -> int:
+        """
+        Number of snapshots published so far; readers see zeroed books before the first.
+        """
+        return int(self._control[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _prices(self):
+        n = len(self.currency_pairs)
+        mids, spreads = np.full(n, np.nan), np.full(n, np.nan)
+        if self.price_production is None:
+            return mids, spreads
+        all_mids, all_spreads = self.price_production.calculate_all_pair_prices()
+        if self._priced != len(all_mids):
+            # Price index of every book, looked up again only when the production registered new pairs.
+            rows = self.price_production.get_pair_indices(self.currency_pairs)
+            self._price_known = np.flatnonzero(rows >= 0)
+            self._price_rows = rows[self._price_known]
+            self._priced = len(all_mids)
+        mids[self._price_known] = all_mids[self._price_rows]
+        spreads[self._price_known] = all_spreads[self._price_rows]
+        return mids, spreads
+
+    @profiled("shared.publish")
+    def publish(self):
+        """
+        Copy the current books and prices into the inactive buffer and make it the current one.
+        """
+        store = self.store
+        n = len(self.currency_pairs)
+        if len(store) != n:
+            raise ValueError(f"The segment holds {n} pairs but the store now has {len(store)}")
+        mids, spreads = self._prices()
+        control = self._control
+        sequence = int(control[0]) + 1
+        index = sequence % 2
+        views = self._buffers[index]
+        # Odd while the buffer is written.
+        control[1 + index] += 1
+        views["bid_prices"][:] = store.bid_prices
+        views["bid_sizes"][:] = store.bid_sizes
+        views["ask_prices"][:] = store.ask_prices
+        views["ask_sizes"][:] = store.ask_sizes
+        views["bid_levels"][:] = store.bid_levels
+        views["ask_levels"][:] = store.ask_levels
+        views["mid_prices"][:] = mids
+        views["spreads"][:] = spreads
+        views["meta"][:] = (sequence, time.time_ns())
+        control[1 + index] += 1
+        control[0] = sequence
+
+    def close(self):
+        """
+        Detach and destroy the segment; attached readers keep their mapping until they close.
+        """
+        if self._shm is None:
+            return
+        self._control = self._buffers = None
+        self._shm.close()
+        # A reader sharing this process's resource tracker unregistered the segment when attaching (see
+        # _attach). Registering is idempotent, so unlink always finds the registration it removes.
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+        self._shm = None
+
+
+class SharedBookReader:
+    """
+    Attaches to the segment of a SharedBookWriter by name, e.g. from another process.
+    snapshot() gives zero-copy views of the current buffer and read() a consistent copy.
+    """
+    def __init__(self, name: str):
+        self._shm = _attach(name)
+        buffer = self._shm.buf
+        if bytes(buffer[:8]) != MAGIC:
+            self._shm.close()
+            raise ValueError(f"{name} is not a shared book segment")
+        header_length = int(np.frombuffer(buffer[8:16], dtype="<u8")[0])
+        header = json.loads(bytes(buffer[PREAMBLE_SIZE:PREAMBLE_SIZE + header_length]))
+        self.name = name
+        self.layout = _Layout(header)
+        self.currency_pairs = [CurrencyPair(base, quote) for base, quote in header["currency_pairs"]]
+        self.book_size = header["book_size"]
+        self._control = self.layout.control(buffer)
+        self._buffers = []
+        for index in (0, 1):
+            views = self.layout.views(buffer, index)
+            for view in views.values():
+                view.flags.writeable = False
+            self._buffers.append(views)
+
+    @property
+    def sequence(self) -> int:
+        """
+        Number of snapshots the writer has published.
+        """
+        return int(self._control[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _current(self):
+        """
+        (buffer index, its version) of the latest complete snapshot, None if the buffer is being rewritten.
+        """
+        index = int(self._control[0]) % 2
+        version = int(self._control[1 + index])
+        return None if version % 2 else (index, version)
+
+    def _snapshot(self, index: int, copy: bool) -> BookSnapshot:
+        views = self._buffers[index]
+        sequence, published_ns = (int(v) for v in views["meta"])
+        columns = [views[name].copy() if copy else views[name] for name in BookSnapshot._fields[2:]]
+        return BookSnapshot(sequence, published_ns, *columns)
+
+    def snapshot(self, timeout: float = 1.0) -> BookSnapshot:
+        """
+        Read-only views of the current buffer without copying. The writer rewrites this buffer two
+        publishes later, so check valid(snapshot) after using the arrays and retry if it returns False.
+        The views must be released before close().
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self._current()
+            if current is not None:
+                return self._snapshot(current[0], copy=False)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No complete snapshot of {self.name} within {timeout} s")
+
+    def valid(self, snapshot: BookSnapshot) -> bool:
+        """
+        Whether the buffer behind a snapshot() still holds it unchanged.
+        """
+        index = snapshot.sequence % 2
+        version = int(self._control[1 + index])
+        return version % 2 == 0 and int(self._buffers[index]["meta"][0]) == snapshot.sequence
+
+    def read(self, timeout: float = 1.0) -> BookSnapshot:
+        """
+        Consistent copy of the latest snapshot, retrying while the writer overwrites the buffer being copied.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self._current()
+            if current is not None:
+                index, version = current
+                snapshot = self._snapshot(index, copy=True)
+                if int(self._control[1 + index]) == version:
+                    return snapshot
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No consistent snapshot of {self.name} within {timeout} s")
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._control = self._buffers = None
+        self._shm.close()
+        self._shm = None
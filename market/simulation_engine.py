@@ -0,0 +1,83 @@
+from typing import Callable, List, NamedTuple, Optional
+
+import numpy as np
+
+from market.orderbook_store import OrderBookStore
+from price_construction.price_crossing import PriceCrossing
+from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler, profiled
+
+
+class StepResult(NamedTuple):
+    """
+    Outcome of one engine step, one entry per quoted pair (see SimulationEngine.currency_pairs).
+    """
+    mid_prices: np.ndarray
+    bid_prices: np.ndarray
+    ask_prices: np.ndarray
+    taker_buys: np.ndarray
+    taker_sizes: np.ndarray
+    executed_prices: np.ndarray
+    executed_sizes: np.ndarray
+
+
+class SimulationEngine:
+    """
+    Headless stepping of all pairs at once. Each step the market maker quotes every pair around the
+    PriceCrossing mid with a random skew, then one market taker per pair trades against the book.
+    All random draws and book updates are vectorized over pairs.
+    """
+    profiler: Profiler = NULL_PROFILER
+
+    def __init__(self, store: OrderBookStore, price_crossing: PriceCrossing, risk_factor: float = 1.0,
+                 rng: Optional[np.random.Generator] = None, quote_size: float = 10,
+                 skew_range=(0.0001, 0.001), taker_size_range=(1, 5)):
+        self.store = store
+        self.price_crossing = price_crossing
+        self.risk_factor = risk_factor
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.quote_size = quote_size
+        self.skew_range = skew_range
+        self.taker_size_range = taker_size_range
+        # Only targets that have a book are quoted.
+        self.currency_pairs: List[CurrencyPair] = [cp for cp in price_crossing.target_currency_pairs if cp in store]
+        self.target_rows = price_crossing.plan.target_rows.lookup(self.currency_pairs)
+        self.book_rows = store.get_indices(self.currency_pairs)
+        self.pair_ids = CurrencyPair.ids(self.currency_pairs)
+        self.quote_sizes = np.full(len(self.currency_pairs), float(quote_size))
+        # Writing all rows in store order takes the contiguous fast path.
+        self._update_rows = None if np.array_equal(self.book_rows, np.arange(len(store))) else self.book_rows
+
+    @profiled("engine.step")
+    def step(self) -> StepResult:
+        n = len(self.currency_pairs)
+        profiler = self.profiler
+        mids = self.price_crossing.generate_mid_prices()[self.target_rows]
+        with profiler.stage("engine.quote"):
+            # The market maker quotes one level per side.
+            skews = self.rng.uniform(self.skew_range[0], self.skew_range[1], n) * self.risk_factor
+            bid_prices = mids - skews
+            ask_prices = mids + skews
+            self.store.update_all(bid_prices, self.quote_sizes, ask_prices, self.quote_sizes,
+                                  rows=self._update_rows)
+        with profiler.stage("engine.taker"):
+            # One market taker per pair.
+            taker_buys = self.rng.integers(0, 2, n).astype(bool)
+            taker_sizes = self.rng.uniform(self.taker_size_range[0], self.taker_size_range[1], n)
+            executed_prices, executed_sizes = self.store.sweep(self.book_rows, taker_buys, taker_sizes)
+        if profiler.enabled:
+            profiler.add_pairs("taker.executed_size", self.pair_ids, executed_sizes)
+        # Books were written in bulk, bring the price production and its caches up to date.
+        self.price_crossing.price_production.update_rows(self.store, self.book_rows)
+        return StepResult(mids, bid_prices, ask_prices, taker_buys, taker_sizes, executed_prices, executed_sizes)
+
+    def run(self, steps: int, on_step: Optional[Callable[[int, StepResult], None]] = None) -> Optional[StepResult]:
+        """
+        Advance `steps` steps, passing every result to on_step if given. Returns the last result.
+        """
+        result = None
+        for step in range(steps):
+            result = self.step()
+            if on_step is not None:
+                on_step(step, result)
+        return result
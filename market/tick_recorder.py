@@ -0,0 +1,433 @@
+import errno
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from market.orderbook_store import OrderBookStore
+from market.simulation_engine import StepResult
+from price_construction.currency_graph import STRATEGIES
+from price_construction.price_crossing import PriceCrossing
+from price_construction.price_production import PriceProduction
+from util.currency_pair import CurrencyPair
+
+MAGIC = b"FXTICK02"
+# Magic, header length and recorded step count precede the JSON header.
+PREAMBLE_SIZE = 24
+ALIGNMENT = 4096
+# Every chunk starts with the number of levels its book columns hold.
+CHUNK_HEADER_SIZE = 8
+# Target size of one chunk when chunk_steps is not given.
+CHUNK_BYTES = 16 << 20
+BOOK_COLUMNS = ("bid_prices", "bid_sizes", "ask_prices", "ask_sizes")
+
+
+def _columns(n_pairs: int, width: int) -> List[tuple]:
+    """
+    (name, dtype, shape per step) of every recorded column. Rows follow the store's pair order.
+    The book columns come last and hold the first `width` levels of every book.
+    """
+    book = (n_pairs, width)
+    return [
+        ("bid_levels", "<i4", (n_pairs,)),
+        ("ask_levels", "<i4", (n_pairs,)),
+        # Mid the maker quoted around, NaN for pairs the engine does not quote, and the spread of the book
+        # from the price production, NaN where it does not price the pair.
+        ("mid_prices", "<f8", (n_pairs,)),
+        ("spreads", "<f8", (n_pairs,)),
+        # Index into price_construction.currency_graph.STRATEGIES, -1 if the pair is not priced.
+        ("strategies", "<i1", (n_pairs,)),
+        ("taker_buys", "<i1", (n_pairs,)),
+        ("executed_prices", "<f8", (n_pairs,)),
+        ("executed_sizes", "<f8", (n_pairs,)),
+        ("bid_prices", "<f8", book),
+        ("bid_sizes", "<f8", book),
+        ("ask_prices", "<f8", book),
+        ("ask_sizes", "<f8", book),
+    ]
+
+
+class _Layout:
+    """
+    Columnar layout shared by TickRecorder and TickReplay. The file holds a JSON header followed by chunks
+    of chunk_steps steps; inside a chunk every column is stored contiguously. The book columns of a chunk
+    hold as many levels as the deepest book populated during the chunk, its width.
+    """
+    def __init__(self, header: dict, data_offset: int):
+        self.header = header
+        self.chunk_steps = header["chunk_steps"]
+        self.data_offset = data_offset
+        self._widths: Dict[int, tuple] = {}
+
+    def columns(self, width: int) -> Tuple[Dict[str, tuple], int]:
+        """
+        (dtype, shape, offset) per column of a chunk of the given width, and the size of its columns in bytes.
+        """
+        columns = self._widths.get(width)
+        if columns is None:
+            columns, offset = {}, 0
+            for name, dtype, shape in _columns(len(self.header["currency_pairs"]), width):
+                columns[name] = (np.dtype(dtype), shape, offset)
+                offset += self.chunk_steps * int(np.prod(shape)) * np.dtype(dtype).itemsize
+            columns = self._widths[width] = columns, offset
+        return columns
+
+    def chunk_bytes(self, width: int) -> int:
+        """
+        Size in the file of a chunk of the given width. Chunks are padded to ALIGNMENT, so that every chunk
+        starts aligned and can be written with O_DIRECT.
+        """
+        return -(-(CHUNK_HEADER_SIZE + self.columns(width)[1]) // ALIGNMENT) * ALIGNMENT
+
+    def views(self, buffer, width: int, base: int = 0) -> Dict[str, np.ndarray]:
+        """
+        (chunk_steps, *shape) views of every column of a chunk of the given width whose columns start at
+        `base` in buffer.
+        """
+        return {name: np.ndarray((self.chunk_steps,) + shape, dtype=dtype, buffer=buffer, offset=base + offset)
+                for name, (dtype, shape, offset) in self.columns(width)[0].items()}
+
+
+def _rows(rows: np.ndarray, n: int):
+    """
+    rows as an index into n entries, a slice if they are 0..n-1 in order.
+    """
+    return slice(None) if np.array_equal(rows, np.arange(n)) else rows
+
+
+def _padded(levels: np.ndarray, book_size: int) -> np.ndarray:
+    """
+    Book levels recorded for fewer than book_size levels, padded with empty levels.
+    """
+    if levels.shape[-1] == book_size:
+        return levels
+    padded = np.zeros(levels.shape[:-1] + (book_size,))
+    padded[..., :levels.shape[-1]] = levels
+    return padded
+
+
+def _stacked(views: Dict[str, np.ndarray], names: Tuple[str, ...]) -> np.ndarray:
+    """
+    (steps, len(names), *shape) view of the columns `names`, which follow each other with the same dtype and
+    shape, so that one assignment fills a step of all of them.
+    """
+    first = views[names[0]]
+    return np.lib.stride_tricks.as_strided(first, (len(first), len(names)) + first.shape[1:],
+                                           (first.strides[0], first.nbytes) + first.strides[1:])
+
+
+def _aligned_buffer(size: int) -> np.ndarray:
+    raw = np.zeros(size + ALIGNMENT, dtype=np.uint8)
+    start = -raw.ctypes.data % ALIGNMENT
+    return raw[start:start + size]
+
+
+class TickRecorder:
+    """
+    Appends per-step book snapshots, derived mids and spreads, pricing strategies and taker fills to a
+    columnar binary file, which TickReplay memory-maps.
+
+    Steps are copied into one of two preallocated in-memory chunks of chunk_steps steps. A full chunk is
+    written by a background thread while the other one fills, through O_DIRECT where the platform and file
+    system support it, so that neither the write nor the copy into the page cache takes time from the
+    simulation. Only the levels populated by some book (OrderBookStore.max_levels) are recorded, usually far
+    fewer than book_size once the market maker requoted. Chunks are not memory-mapped: filling a shared map of
+    a fresh file region faults in every page on its first write, which was measured to make recording a step
+    several times slower than the copy and write.
+    """
+    # Recorded for the rows a step does not cover.
+    DEFAULTS = {"mid_prices": np.nan, "spreads": np.nan, "executed_prices": np.nan, "executed_sizes": np.nan,
+                "taker_buys": -1, "strategies": -1}
+
+    def __init__(self, path: str, currency_pairs: List[CurrencyPair], book_size: int,
+                 chunk_steps: Optional[int] = None):
+        """
+        chunk_steps: Steps per chunk, by default as many as fit in CHUNK_BYTES with every level populated.
+        """
+        self.path = path
+        if chunk_steps is None:
+            step = _Layout({"currency_pairs": currency_pairs, "book_size": book_size, "chunk_steps": 1}, 0)
+            chunk_steps = max(CHUNK_BYTES // step.columns(book_size)[1], 1)
+        header = {
+            "currency_pairs": [[cp.base, cp.quote] for cp in currency_pairs],
+            "book_size": book_size,
+            "chunk_steps": chunk_steps,
+        }
+        encoded = json.dumps(header).encode()
+        data_offset = -(-(PREAMBLE_SIZE + len(encoded)) // ALIGNMENT) * ALIGNMENT
+        self.layout = _Layout(header, data_offset)
+        self.steps = 0
+        self._n = len(currency_pairs)
+        self._file = open(path, "w+b")
+        self._file.write(MAGIC)
+        self._file.write(np.array([len(encoded), 0], dtype="<u8").tobytes())
+        self._file.write(encoded)
+        self._file.flush()
+        # Chunks are written through their own descriptor, only ever from the writer thread or after waiting
+        # for it.
+        self._direct = hasattr(os, "O_DIRECT")
+        try:
+            self._fd = os.open(path, os.O_WRONLY | (os.O_DIRECT if self._direct else 0))
+        except OSError:
+            if not self._direct:
+                raise
+            self._fd = os.open(path, os.O_WRONLY)
+            self._direct = False
+        # Each chunk is laid out for its width, which only grows while it fills, after its header.
+        self._chunks = [_aligned_buffer(self.layout.chunk_bytes(book_size)) for _ in range(2)]
+        self._chunk = self._chunks[0]
+        self._chunk_offset = data_offset
+        self._width = 0
+        self._views = self._books = self._levels = None
+        # (chunk, width) -> views of its columns, the chunks are laid out again for every chunk_steps steps.
+        self._laid_out: Dict[Tuple[int, int], tuple] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._writing: Optional[Future] = None
+        self._plan = None
+        self._priced = -1
+        self._result_rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, chunk: np.ndarray, offset: int):
+        written = 0
+        while written < len(chunk):
+            try:
+                written += os.pwrite(self._fd, chunk[written:], offset + written)
+            except OSError as e:
+                # Some file systems accept O_DIRECT when opening but not when writing.
+                if not self._direct or e.errno != errno.EINVAL:
+                    raise
+                os.close(self._fd)
+                self._fd = os.open(self.path, os.O_WRONLY)
+                self._direct = False
+
+    def _wait(self):
+        """
+        Wait for the chunk being written, raising what the write raised.
+        """
+        if self._writing is not None:
+            writing, self._writing = self._writing, None
+            writing.result()
+
+    def _write_chunk(self, background: bool):
+        """
+        Write the chunk being filled at its offset. A partly filled chunk is written whole so that readers can
+        map it; steps past `steps` are ignored, and it is written again once it fills further.
+        """
+        self._chunk[:CHUNK_HEADER_SIZE] = np.array([self._width], dtype="<u8").view(np.uint8)
+        chunk = self._chunk[:self.layout.chunk_bytes(self._width)]
+        # One write at a time, so that the other chunk is free to fill once this one is handed over.
+        self._wait()
+        if background:
+            self._writing = self._writer.submit(self._write, chunk, self._chunk_offset)
+        else:
+            self._write(chunk, self._chunk_offset)
+
+    def _lay_out(self, width: int):
+        """
+        Lay the chunk being filled out for `width` levels.
+        """
+        self._width = width
+        key = id(self._chunk), width
+        if key not in self._laid_out:
+            views = self.layout.views(self._chunk, width, CHUNK_HEADER_SIZE)
+            self._laid_out[key] = views, _stacked(views, BOOK_COLUMNS), _stacked(views, ("bid_levels", "ask_levels"))
+        self._views, self._books, self._levels = self._laid_out[key]
+
+    def _widen(self, width: int, steps: int):
+        """
+        Lay the book columns of the chunk being filled out for `width` levels, keeping its first `steps` steps.
+        The other columns precede them and stay in place.
+        """
+        recorded = self._books[:steps].copy()
+        self._lay_out(width)
+        self._books[:steps, ..., :recorded.shape[-1]] = recorded
+        self._books[:steps, ..., recorded.shape[-1]:] = 0.0
+
+    def _spreads(self, store: OrderBookStore, price_crossing: PriceCrossing) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Store rows priced by the crossing's price production and their spreads.
+        """
+        production = price_crossing.price_production
+        _, spreads = production.calculate_all_pair_prices()
+        if self._priced != len(spreads):
+            # Price index of every store row, looked up again only when the production registered new pairs.
+            indices = production.get_pair_indices(store.currency_pairs)
+            self._priced = len(spreads)
+            rows = np.flatnonzero(indices >= 0)
+            self._priced_indices = _rows(indices[rows], len(spreads))
+            self._priced_rows = _rows(rows, len(store))
+        return self._priced_rows, spreads[self._priced_indices]
+
+    def _set_rows(self, name: str, i: int, rows, values=None):
+        """
+        Record values for the given store rows of column `name` at step i, and the default for the others.
+        """
+        if isinstance(rows, slice):
+            # Every row, see _rows.
+            self._views[name][i] = values
+            return
+        step = self._views[name][i]
+        step[:] = self.DEFAULTS[name]
+        if values is not None:
+            step[rows] = values
+
+    def record(self, store: OrderBookStore, price_crossing: Optional[PriceCrossing] = None,
+               result: Optional[StepResult] = None, result_rows: Optional[np.ndarray] = None):
+        """
+        Append one step. result_rows maps the entries of result to store rows (SimulationEngine.book_rows).
+        """
+        if len(store) != self._n:
+            raise ValueError(f"The recording holds {self._n} pairs but the store now has {len(store)}")
+        i = self.steps % self.layout.chunk_steps
+        if i == 0:
+            self._lay_out(store.max_levels())
+        # The level columns precede the book columns, so widening keeps them in place.
+        self._levels[i] = store.levels
+        if self._width < store.book_size:
+            # Same as store.max_levels(), but reducing the contiguous copy is cheaper.
+            width = max(int(self._levels[i].max()), 1)
+            if width > self._width:
+                self._widen(width, i)
+        self._books[i] = store.books[:, :, :self._width]
+        if price_crossing is not None:
+            plan = price_crossing.plan
+            if plan is not self._plan:
+                # Store rows of the plan's targets, looked up again only when the plan is recompiled.
+                rows = store.get_indices(plan.targets)
+                known = rows >= 0
+                self._plan, self._plan_rows = plan, _rows(rows[known], len(store))
+                self._plan_known = slice(None) if known.all() else known
+            codes = plan.strategy_codes
+            if price_crossing.cache.consensus_users:
+                codes = np.where(price_crossing.cache.uses_consensus, STRATEGIES.index("consensus"), codes)
+            self._set_rows("strategies", i, self._plan_rows, codes[self._plan_known])
+            self._set_rows("spreads", i, *self._spreads(store, price_crossing))
+        else:
+            self._set_rows("strategies", i, None)
+            self._set_rows("spreads", i, None)
+        if result is not None:
+            if result_rows is not self._result_rows:
+                self._result_rows, self._result_index = result_rows, _rows(result_rows, len(store))
+            rows = self._result_index
+            if isinstance(rows, slice):
+                # Every row, as in the step of SimulationEngine, written without calls to _set_rows.
+                views = self._views
+                views["mid_prices"][i] = result.mid_prices
+                views["taker_buys"][i] = result.taker_buys
+                views["executed_prices"][i] = result.executed_prices
+                views["executed_sizes"][i] = result.executed_sizes
+            else:
+                for name in ("mid_prices", "taker_buys", "executed_prices", "executed_sizes"):
+                    self._set_rows(name, i, rows, getattr(result, name))
+        else:
+            for name in ("mid_prices", "taker_buys", "executed_prices", "executed_sizes"):
+                self._set_rows(name, i, None)
+        self.steps += 1
+        if i == self.layout.chunk_steps - 1:
+            self._write_chunk(background=True)
+            self._chunk_offset += self.layout.chunk_bytes(self._width)
+            self._chunk = self._chunks[1] if self._chunk is self._chunks[0] else self._chunks[0]
+
+    def flush(self):
+        """
+        Write every recorded step, including those of the chunk being filled, and the step count.
+        """
+        if self.steps % self.layout.chunk_steps:
+            self._write_chunk(background=False)
+        else:
+            self._wait()
+        self._file.seek(16)
+        self._file.write(np.array([self.steps], dtype="<u8").tobytes())
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._writer.shutdown()
+            os.close(self._fd)
+            self._file.close()
+
+
+class TickReplay:
+    """
+    Read-only access to a file written by TickRecorder, and replay of the recorded books into a
+    price production without re-simulating.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            preamble = f.read(PREAMBLE_SIZE)
+            if preamble[:8] != MAGIC:
+                raise ValueError(f"{path} is not a tick recording")
+            header_length, self.steps = (int(v) for v in np.frombuffer(preamble[8:], dtype="<u8"))
+            header = json.loads(f.read(header_length))
+        data_offset = -(-(PREAMBLE_SIZE + header_length) // ALIGNMENT) * ALIGNMENT
+        self.layout = _Layout(header, data_offset)
+        self.currency_pairs = [CurrencyPair(base, quote) for base, quote in header["currency_pairs"]]
+        self.book_size = header["book_size"]
+        self._map = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) > 0 else None
+        # (offset of the columns, width) of every chunk.
+        self._chunks: List[Tuple[int, int]] = []
+        offset = data_offset
+        for _ in range(-(-self.steps // self.layout.chunk_steps)):
+            width = int(np.frombuffer(self._map, dtype="<u8", count=1, offset=offset)[0])
+            self._chunks.append((offset + CHUNK_HEADER_SIZE, width))
+            offset += self.layout.chunk_bytes(width)
+
+    def __len__(self):
+        return self.steps
+
+    def _views(self, chunk: int) -> Dict[str, np.ndarray]:
+        offset, width = self._chunks[chunk]
+        return self.layout.views(self._map, width, offset)
+
+    def step(self, step: int) -> Dict[str, np.ndarray]:
+        """
+        Every column at one step, as zero-copy views. Book columns hold book_size levels, copied where the
+        step's chunk recorded fewer.
+        """
+        if not 0 <= step < self.steps:
+            raise IndexError(f"Step {step} outside recording of {self.steps} steps")
+        chunk, i = divmod(step, self.layout.chunk_steps)
+        views = {name: view[i] for name, view in self._views(chunk).items()}
+        for name in BOOK_COLUMNS:
+            views[name] = _padded(views[name], self.book_size)
+        return views
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        One column over all recorded steps, as a (steps, *shape) array.
+        """
+        parts = [self._views(c)[name] for c in range(len(self._chunks))]
+        if name in BOOK_COLUMNS:
+            parts = [_padded(part, self.book_size) for part in parts]
+        return np.concatenate(parts)[:self.steps] if parts else np.empty(0)
+
+    def load_step(self, step: int, store: OrderBookStore):
+        """
+        Write the books recorded at `step` into store, which must hold the recorded pairs in the same order.
+        """
+        views = self.step(step)
+        store.load_snapshot(views["bid_prices"], views["bid_sizes"], views["ask_prices"], views["ask_sizes"],
+                            views["bid_levels"], views["ask_levels"])
+
+    def replay(self, store: OrderBookStore, price_production: PriceProduction) -> Iterator[int]:
+        """
+        Load every recorded step into store and resync price_production (and so any PriceCrossing built
+        on it); yields the step number once prices can be queried.
+        """
+        for step in range(self.steps):
+            self.load_step(step, store)
+            price_production.resync()
+            yield step
@@ -0,0 +1,186 @@
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from market.orderbook_store import OrderBookStore
+from price_construction.currency_graph import CurrencyGraph
+from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler, profiled
+
+# Edges per block of the triangle scan, bounding its temporary to block * currencies values.
+TRIANGLE_BLOCK = 4096
+
+
+class ArbitrageCycle(NamedTuple):
+    """
+    A profitable conversion cycle. currencies lists the currencies visited, starting and ending with the
+    same one; legs are (pair, inverted) as in PricingPlan routes: a leg sells the pair's base at its bid,
+    an inverted leg buys it at its ask. profit is the relative gain of one round trip at top of book.
+    """
+    currencies: List[str]
+    legs: List[Tuple[CurrencyPair, bool]]
+    profit: float
+
+
+class ArbitrageReport(NamedTuple):
+    """
+    Result of one scan: every profitable triangle, and the cycles of any length found by the negative
+    cycle search, most profitable first.
+    """
+    triangles: List[ArbitrageCycle]
+    cycles: List[ArbitrageCycle]
+
+
+class ArbitrageScanner:
+    """
+    Finds quotes that are inconsistent across the pair universe.
+
+    Converting A to B through pair A/B earns its bid and through B/A costs its ask, so with edge weights
+    -log(bid) and log(ask) on the currency graph (see CurrencyGraph) a round trip is profitable exactly
+    when its weights sum to less than zero. All triangles are evaluated on the dense matrix of the best
+    log rate between every two currencies, closing every edge with each third currency in one pass, so
+    the cost grows with edges times currencies rather than currencies cubed. Cycles of any length are
+    found by a Bellman-Ford negative cycle search relaxing all edges at once per round.
+    """
+    profiler: Profiler = NULL_PROFILER
+
+    def __init__(self, currency_pairs: Sequence[CurrencyPair], min_profit: float = 0.0):
+        """
+        min_profit: Relative profit a cycle must exceed to be reported, e.g. to cover fees.
+        """
+        self.currency_pairs = list(currency_pairs)
+        self.graph = CurrencyGraph(self.currency_pairs)
+        self.currencies = self.graph.currencies
+        self.min_profit = min_profit
+        self.max_log_cost = -np.log1p(min_profit)
+        n = len(self.currencies)
+        # Cell of every edge in the flattened rate matrix.
+        self._cells = self.graph.edge_src * n + self.graph.edge_dst
+        # Edges grouped by destination, for the per currency minimum of the relaxation.
+        self._by_dst = np.argsort(self.graph.edge_dst, kind="stable")
+        self._store_rows = None
+        self._store_size = -1
+
+    def edge_weights(self, bids: np.ndarray, asks: np.ndarray) -> np.ndarray:
+        """
+        Weight of every graph edge for pair bids and asks aligned with currency_pairs; inf for missing quotes.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weights = np.concatenate([-np.log(bids), np.log(asks)])
+        return np.where(np.isfinite(weights), weights, np.inf)
+
+    def log_rate_matrix(self, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (currencies x currencies) matrix of the lowest edge weight from each currency to each other one, inf
+        without an edge, and the edge providing it (-1 without one).
+        """
+        n = len(self.currencies)
+        matrix = np.full(n * n, np.inf)
+        edges = np.full(n * n, -1, dtype=np.int64)
+        finite = np.flatnonzero(np.isfinite(weights))
+        order = finite[np.lexsort((weights[finite], self._cells[finite]))]
+        cells, first = np.unique(self._cells[order], return_index=True)
+        matrix[cells] = weights[order[first]]
+        edges[cells] = order[first]
+        return matrix.reshape(n, n), edges.reshape(n, n)
+
+    @profiled("arbitrage.scan")
+    def scan(self, bids: np.ndarray, asks: np.ndarray) -> ArbitrageReport:
+        weights = self.edge_weights(np.asarray(bids, dtype=float), np.asarray(asks, dtype=float))
+        matrix, edges = self.log_rate_matrix(weights)
+        triangles = [self._cycle(edges[path, np.roll(path, -1)], weights) for path in self.triangles(matrix)]
+        cycles = [self._cycle(cycle, weights) for cycle in self.negative_cycles(weights)]
+        triangles.sort(key=lambda cycle: -cycle.profit)
+        cycles.sort(key=lambda cycle: -cycle.profit)
+        return ArbitrageReport(triangles, cycles)
+
+    def scan_store(self, store: OrderBookStore) -> ArbitrageReport:
+        """
+        scan() on the top of book of every pair in the store, pairs without a book or quote being skipped.
+        """
+        if self._store_size != len(store):
+            self._store_rows = store.get_indices(self.currency_pairs)
+            self._store_size = len(store)
+        rows = self._store_rows
+        known = rows >= 0
+        bids = np.full(len(rows), np.nan)
+        asks = np.full(len(rows), np.nan)
+        bids[known] = np.where(store.bid_levels[rows[known]] > 0, store.bid_prices[rows[known], 0], np.nan)
+        asks[known] = np.where(store.ask_levels[rows[known]] > 0, store.ask_prices[rows[known], 0], np.nan)
+        return self.scan(bids, asks)
+
+    def triangles(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Profitable triangles i -> j -> k -> i as rows (i, j, k), each reported once, starting at its
+        lowest currency index.
+        """
+        # Triangles start at their smallest currency, so only edges i -> j with i < j open one.
+        i_all, j_all = np.nonzero(np.isfinite(matrix) & np.triu(np.ones(matrix.shape, dtype=bool), 1))
+        found = [np.zeros((0, 3), dtype=np.int64)]
+        for start in range(0, len(i_all), TRIANGLE_BLOCK):
+            i, j = i_all[start:start + TRIANGLE_BLOCK], j_all[start:start + TRIANGLE_BLOCK]
+            # cost[e, k] = w(i, j) + w(j, k) + w(k, i) for edge e = (i, j).
+            cost = matrix[i, j][:, None] + matrix[j, :] + matrix[:, i].T
+            e, k = np.nonzero(cost < self.max_log_cost)
+            canonical = (i[e] < k) & (j[e] != k)
+            found.append(np.column_stack([i[e][canonical], j[e][canonical], k[canonical]]))
+        return np.concatenate(found)
+
+    def negative_cycles(self, weights: np.ndarray) -> List[List[int]]:
+        """
+        Edge lists of distinct negative cycles found by Bellman-Ford from a virtual source linked to every
+        currency. Every round relaxes all edges at once; edges still improving after one round per
+        currency lead back into a negative cycle.
+        """
+        n = len(self.currencies)
+        usable = self._by_dst[np.isfinite(weights[self._by_dst])]
+        if len(usable) == 0:
+            return []
+        src, dst, w = self.graph.edge_src[usable], self.graph.edge_dst[usable], weights[usable]
+        starts = np.flatnonzero(np.r_[True, dst[1:] != dst[:-1]])
+        targets = dst[starts]
+        dist = np.zeros(n)
+        pred = np.full(n, -1, dtype=np.int64)
+        improved = np.zeros(n, dtype=bool)
+        for _ in range(n):
+            candidate = dist[src] + w
+            best = dist.copy()
+            best[targets] = np.minimum(dist[targets], np.minimum.reduceat(candidate, starts))
+            improved = best < dist
+            if not improved.any():
+                return []
+            winners = np.flatnonzero((candidate == best[dst]) & improved[dst])
+            pred[dst[winners]] = usable[winners]
+            dist = best
+        # Walking back n predecessors from a node still improving ends inside a cycle. Nodes reached
+        # straight from the virtual source have no predecessor and lead to no cycle.
+        nodes = np.flatnonzero(improved)
+        for _ in range(n):
+            nodes = nodes[pred[nodes] >= 0]
+            nodes = self.graph.edge_src[pred[nodes]]
+        cycles, seen = [], set()
+        for node in np.unique(nodes).tolist():
+            if node in seen:
+                continue
+            cycle, current = [], node
+            while len(cycle) < n:
+                edge = int(pred[current])
+                if edge < 0:
+                    break
+                cycle.append(edge)
+                seen.add(current)
+                current = int(self.graph.edge_src[edge])
+                if current == node:
+                    cycle.reverse()
+                    if weights[cycle].sum() < self.max_log_cost:
+                        cycles.append(cycle)
+                    break
+        return cycles
+
+    def _cycle(self, edges: Sequence[int], weights: np.ndarray) -> ArbitrageCycle:
+        edges = np.asarray(edges)
+        graph = self.graph
+        currencies = [self.currencies[c] for c in graph.edge_src[edges].tolist()]
+        legs = [(self.currency_pairs[p], inverted)
+                for p, inverted in zip(graph.edge_pair[edges].tolist(), graph.edge_inverted[edges].tolist())]
+        return ArbitrageCycle(currencies + currencies[:1], legs, float(np.expm1(-weights[edges].sum())))
@@ -0,0 +1,236 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from util.currency_pair import CurrencyPair
+from util.pair_index import PairIndex
+
+# Cost of a leg whose book has no price yet, large compared to any relative spread.
+UNPRICED_LEG_COST = 1.0
+# Added per leg so that equally priced routes prefer fewer hops.
+HOP_COST = 1e-9
+# Pricing strategies by code, as stored in PricingPlan.strategy_codes. Targets without a route are -1;
+# "consensus" marks targets that fell back to the consensus price.
+STRATEGIES = ("direct", "inverse", "cross", "consensus")
+
+
+class PricingPlan:
+    """
+    Compiled pricing routes for a list of target pairs.
+    Route legs are stored as integer index arrays into the pair arrays of a PriceProduction
+    (see PriceProduction.get_pair_index), so all targets are priced by one gather and one product.
+    `pairs` is that pair universe in index order. Plans can be saved with save() and loaded back by
+    load() without compiling the routes again.
+    """
+    def __init__(self, targets: List[CurrencyPair], legs: List[List[Tuple[CurrencyPair, bool]]],
+                 pair_index: Dict[CurrencyPair, int], max_hops: int):
+        n = len(targets)
+        width = max([len(route) for route in legs] + [1])
+        # Padding legs point at index -1, which is the sentinel 1.0 appended to the pair mids.
+        leg_index = np.full((n, width), -1, dtype=np.int64)
+        leg_inverted = np.zeros((n, width), dtype=bool)
+        for i, route in enumerate(legs):
+            for j, (cp, inverted) in enumerate(route):
+                leg_index[i, j] = pair_index[cp]
+                leg_inverted[i, j] = inverted
+        pairs = [None] * len(pair_index)
+        for cp, i in pair_index.items():
+            pairs[i] = cp
+        self._set_arrays(list(targets), pairs, leg_index, leg_inverted, max_hops)
+        self._legs = legs
+
+    @classmethod
+    def from_arrays(cls, targets: List[CurrencyPair], pairs: List[CurrencyPair], leg_index: np.ndarray,
+                    leg_inverted: np.ndarray, max_hops: int) -> "PricingPlan":
+        """
+        Plan from its compiled index arrays over the pair universe `pairs`; routes are not recompiled.
+        """
+        plan = cls.__new__(cls)
+        plan._set_arrays(targets, pairs, leg_index, leg_inverted, max_hops)
+        plan._legs = None
+        return plan
+
+    def _set_arrays(self, targets, pairs, leg_index, leg_inverted, max_hops):
+        self.targets = targets
+        self.pairs = pairs
+        self.target_index: Dict[CurrencyPair, int] = dict(zip(targets, range(len(targets))))
+        self.target_ids = CurrencyPair.ids(targets)
+        self.target_rows = PairIndex()
+        self.target_rows.set_many(targets, np.arange(len(targets)))
+        self.leg_index = leg_index
+        self.leg_inverted = leg_inverted
+        self.hops = np.count_nonzero(leg_index >= 0, axis=1)
+        pair_rows = PairIndex()
+        pair_rows.set_many(pairs, np.arange(len(pairs)))
+        self.direct_index = pair_rows.lookup_ids(self.target_ids)
+        self.max_hops = max_hops
+        # One leg is direct or inverse, more legs are a cross.
+        self.strategy_codes = np.where(self.hops == 0, -1, np.where(
+            self.hops > 1, STRATEGIES.index("cross"),
+            np.where(leg_inverted[:, 0], STRATEGIES.index("inverse"), STRATEGIES.index("direct")))).astype(np.int8)
+
+    @property
+    def legs(self) -> List[List[Tuple[CurrencyPair, bool]]]:
+        """
+        Route of every target as (pair, inverted) legs, built on first use for loaded plans.
+        """
+        if self._legs is None:
+            pairs = self.pairs
+            self._legs = [[(pairs[k], bool(inverted)) for k, inverted in zip(index[:hops], inverted_row[:hops])]
+                          for index, inverted_row, hops in zip(self.leg_index.tolist(), self.leg_inverted.tolist(),
+                                                               self.hops.tolist())]
+        return self._legs
+
+    def __len__(self):
+        return len(self.targets)
+
+    def save(self, path: str):
+        """
+        Write the targets, the pair universe and the compiled routes to an .npz file.
+        """
+        np.savez(path, target_bases=[cp.base for cp in self.targets], target_quotes=[cp.quote for cp in self.targets],
+                 pair_bases=[cp.base for cp in self.pairs], pair_quotes=[cp.quote for cp in self.pairs],
+                 leg_index=self.leg_index, leg_inverted=self.leg_inverted, max_hops=self.max_hops)
+
+    @classmethod
+    def load(cls, path: str) -> "PricingPlan":
+        with np.load(path) as data:
+            targets = list(map(CurrencyPair, data["target_bases"].tolist(), data["target_quotes"].tolist()))
+            pairs = list(map(CurrencyPair, data["pair_bases"].tolist(), data["pair_quotes"].tolist()))
+            return cls.from_arrays(targets, pairs, data["leg_index"], data["leg_inverted"], int(data["max_hops"]))
+
+    def route_mid_prices(self, pair_mids: np.ndarray, rows=None) -> np.ndarray:
+        """
+        Mid of every target (or of the targets in `rows`) priced along its route, NaN where a leg is unpriced
+        or the target has no route.
+        """
+        leg_index = self.leg_index if rows is None else self.leg_index[rows]
+        leg_inverted = self.leg_inverted if rows is None else self.leg_inverted[rows]
+        hops = self.hops if rows is None else self.hops[rows]
+        leg_mids = np.append(pair_mids, 1.0)[leg_index]
+        with np.errstate(divide="ignore"):
+            leg_mids = np.where(leg_inverted, 1.0 / leg_mids, leg_mids)
+        mids = np.prod(leg_mids, axis=1)
+        mids[hops == 0] = np.nan
+        return mids
+
+    def direct_mid_prices(self, pair_mids: np.ndarray, rows=None) -> np.ndarray:
+        direct_index = self.direct_index if rows is None else self.direct_index[rows]
+        return np.where(direct_index >= 0, np.append(pair_mids, np.nan)[direct_index], np.nan)
+
+    def get_strategy(self, target: CurrencyPair) -> dict:
+        i = self.target_index.get(target)
+        if i is None or not self.hops[i]:
+            return {"strategy": "direct"}
+        route = self.legs[i]
+        if len(route) == 1:
+            cp, inverted = route[0]
+            return {"strategy": "inverse" if inverted else "direct", "route": route}
+        # Currencies visited between the target's base and quote.
+        pivots = [cp.base if inverted else cp.quote for cp, inverted in route[:-1]]
+        strategy = {"strategy": "cross", "pivots": pivots, "route": route}
+        if len(pivots) == 1:
+            strategy["pivot"] = pivots[0]
+        return strategy
+
+
+class CurrencyGraph:
+    """
+    Graph with one node per currency and two edges per available pair:
+    A/B gives A -> B at the pair's rate and B -> A at the inverted rate.
+    """
+    def __init__(self, currency_pairs: Sequence[CurrencyPair]):
+        self.currency_pairs = list(currency_pairs)
+        n = len(self.currency_pairs)
+        # Nodes are the currencies in use, numbered in order of their global currency ids.
+        currency_ids = np.concatenate([np.fromiter((cp.base_id for cp in self.currency_pairs), np.int64, n),
+                                       np.fromiter((cp.quote_id for cp in self.currency_pairs), np.int64, n)])
+        used_ids, nodes = np.unique(currency_ids, return_inverse=True)
+        self.currencies: List[str] = [CurrencyPair.currency(i) for i in used_ids.tolist()]
+        self.currency_index: Dict[str, int] = dict(zip(self.currencies, range(len(self.currencies))))
+        base, quote = nodes[:n], nodes[n:]
+        # Edge e < n walks pair e forwards, edge n + e walks it inverted.
+        self.edge_src = np.concatenate([base, quote])
+        self.edge_dst = np.concatenate([quote, base])
+        self.edge_pair = np.concatenate([np.arange(n), np.arange(n)])
+        self.edge_inverted = np.concatenate([np.zeros(n, dtype=bool), np.ones(n, dtype=bool)])
+
+    def compile(self, targets: Sequence[CurrencyPair], pair_index: Dict[CurrencyPair, int],
+                pair_mids: Optional[np.ndarray] = None, pair_spreads: Optional[np.ndarray] = None,
+                max_hops: int = 3) -> PricingPlan:
+        """
+        Select for every target the route of at most max_hops legs with the lowest summed relative spread.
+        pair_mids/pair_spreads are indexed by pair_index; legs without a price cost UNPRICED_LEG_COST,
+        so before any book is quoted routes are chosen by the number of hops.
+        """
+        edge_cost = self._edge_costs(pair_index, pair_mids, pair_spreads)
+        sources = sorted({self.currency_index[cp.base] for cp in targets if cp.base in self.currency_index})
+        source_row = {src: i for i, src in enumerate(sources)}
+        preds = self._shortest_walks(np.array(sources, dtype=np.int64), edge_cost, max_hops)
+        legs = []
+        for cp in targets:
+            src = self.currency_index.get(cp.base)
+            dst = self.currency_index.get(cp.quote)
+            if src is None or dst is None:
+                legs.append([])
+                continue
+            legs.append(self._route(preds, source_row[src], dst))
+        return PricingPlan(list(targets), legs, pair_index, max_hops)
+
+    def _edge_costs(self, pair_index, pair_mids, pair_spreads) -> np.ndarray:
+        cost = np.full(len(self.currency_pairs), UNPRICED_LEG_COST)
+        if pair_mids is not None and pair_spreads is not None:
+            rows = np.array([pair_index[cp] for cp in self.currency_pairs], dtype=np.int64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                relative_spread = np.asarray(pair_spreads)[rows] / np.asarray(pair_mids)[rows]
+            priced = np.isfinite(relative_spread) & (relative_spread >= 0)
+            cost[priced] = relative_spread[priced]
+        return np.concatenate([cost, cost]) + HOP_COST
+
+    def _shortest_walks(self, sources: np.ndarray, edge_cost: np.ndarray, max_hops: int) -> List[np.ndarray]:
+        """
+        Hop-limited shortest walks from all sources at once, relaxing every edge per hop.
+        Returns per hop the edge that improved each (source, currency), -1 if it was not improved.
+        """
+        n_currencies = len(self.currencies)
+        dist = np.full((len(sources), n_currencies), np.inf)
+        dist[np.arange(len(sources)), sources] = 0.0
+        order = np.argsort(self.edge_dst, kind="stable")
+        dst_sorted = self.edge_dst[order]
+        starts = np.flatnonzero(np.r_[True, dst_sorted[1:] != dst_sorted[:-1]]) if len(order) else order
+        preds = []
+        for _ in range(max_hops):
+            pred = np.full(dist.shape, -1, dtype=np.int64)
+            if len(order) == 0:
+                preds.append(pred)
+                continue
+            candidate = dist[:, self.edge_src[order]] + edge_cost[order]
+            best = np.minimum.reduceat(candidate, starts, axis=1)
+            dsts = dst_sorted[starts]
+            improved = best < dist[:, dsts]
+            # Position of the cheapest edge within each destination's segment.
+            counts = np.diff(np.r_[starts, len(order)])
+            is_best = candidate == np.repeat(best, counts, axis=1)
+            rows, cols = np.nonzero(is_best & np.repeat(improved, counts, axis=1))
+            pred[rows, dst_sorted[cols]] = order[cols]
+            new_dist = dist.copy()
+            new_dist[:, dsts] = np.where(improved, best, dist[:, dsts])
+            dist = new_dist
+            preds.append(pred)
+        return preds
+
+    def _route(self, preds: List[np.ndarray], source_row: int, dst: int) -> List[Tuple[CurrencyPair, bool]]:
+        hop = len(preds)
+        # Walk back from the last hop at which the destination was improved.
+        while hop > 0 and preds[hop - 1][source_row, dst] < 0:
+            hop -= 1
+        route = []
+        node = dst
+        while hop > 0:
+            edge = preds[hop - 1][source_row, node]
+            if edge >= 0:
+                route.append((self.currency_pairs[self.edge_pair[edge]], bool(self.edge_inverted[edge])))
+                node = self.edge_src[edge]
+            hop -= 1
+        route.reverse()
+        return route
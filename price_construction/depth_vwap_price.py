@@ -0,0 +1,36 @@
+from typing import Tuple
+
+import numpy as np
+
+from price_construction.vwap_price import VWAPPrice
+
+
+class DepthVWAPPrice(VWAPPrice):
+    """
+    Prices books by the VWAP of their first `levels` levels on each side, whatever their sizes.
+    The mid is the average of the bid and ask VWAPs and the spread their difference.
+    The consensus price is the size-limited VWAP of VWAPPrice.
+    """
+    def __init__(self, levels: int = 3, vwap_mid_price: int = 3, vwap_spread: int = 3):
+        super().__init__(vwap_mid_price, vwap_spread)
+        self.levels = levels
+
+    def _price(self, bid_prices, bid_sizes, ask_prices, ask_sizes) -> Tuple[np.ndarray, np.ndarray]:
+        sides = []
+        for prices, sizes in ((bid_prices, bid_sizes), (ask_prices, ask_sizes)):
+            prices, sizes = prices[..., :self.levels], sizes[..., :self.levels]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                sides.append(np.sum(prices * sizes, axis=-1) / np.sum(sizes, axis=-1))
+        bid, ask = sides
+        return (bid + ask) / 2, ask - bid
+
+    def _pair_price(self, bid_prices, bid_sizes, ask_prices, ask_sizes) -> Tuple[float, float]:
+        sides = []
+        for prices, sizes in ((bid_prices, bid_sizes), (ask_prices, ask_sizes)):
+            prices, sizes = prices[:self.levels], sizes[:self.levels]
+            total = sum(sizes)
+            if not total:
+                return None, None
+            sides.append(sum(p * s for p, s in zip(prices, sizes)) / total)
+        bid, ask = sides
+        return (bid + ask) / 2, ask - bid
@@ -0,0 +1,77 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from market.orderbook import OrderBook
+from price_construction.vwap_price import VWAPPrice
+from util.currency_pair import CurrencyPair
+
+
+class EWMAPrice(VWAPPrice):
+    """
+    Prices books by an exponentially weighted moving average of their VWAP mid, smoothing out quote
+    noise. Every update of a book moves its average by `alpha` towards the book's current mid and
+    records its current spread. Both are read off the book's consensus contribution, so an update is
+    O(1) on top of VWAPPrice.update and pricing is a gather. The consensus price is the one of VWAPPrice.
+    """
+    def __init__(self, alpha: float = 0.2, vwap_mid_price: int = 3, vwap_spread: int = 3):
+        super().__init__(vwap_mid_price, vwap_spread)
+        self.alpha = alpha
+        # Averaged mid and last observed spread per pair index. The mid is NaN until a book was seen with
+        # both sides quoted, the spread is NaN while a side is empty.
+        self._ewma = np.full(len(self._contributions), np.nan)
+        self._spreads = np.full(len(self._contributions), np.nan)
+
+    def update(self, order_book: OrderBook):
+        super().update(order_book)
+        self._observe(np.array([self.pair_index[order_book.get_currency_pair()]]))
+
+    def _books_changed(self, indices: np.ndarray):
+        super()._books_changed(indices)
+        self._observe(indices)
+
+    def resync(self):
+        """
+        Recompute the consensus aggregates and observe the current mid of every book once.
+        """
+        super().resync()
+        self._observe(np.arange(len(self.currency_pairs)))
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        n = len(self.currency_pairs)
+        return {**super().get_state(), "ewma": self._ewma[:n], "spreads": self._spreads[:n]}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        super().set_state(state)
+        n = len(self.currency_pairs)
+        self._ewma = np.full(len(self._contributions), np.nan)
+        self._spreads = np.full(len(self._contributions), np.nan)
+        self._ewma[:n] = state["ewma"]
+        self._spreads[:n] = state["spreads"]
+
+    def _observe(self, indices: np.ndarray):
+        if len(self._ewma) < len(self._contributions):
+            grow = np.full(len(self._contributions) - len(self._ewma), np.nan)
+            self._ewma = np.concatenate([self._ewma, grow])
+            self._spreads = np.concatenate([self._spreads, grow])
+        bid_pw_mid, bid_w_mid, ask_pw_mid, ask_w_mid, bid_pw_spread, bid_w_spread, ask_pw_spread, ask_w_spread = \
+            self._contributions[indices].T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mids = (bid_pw_mid / bid_w_mid + ask_pw_mid / ask_w_mid) / 2
+            self._spreads[indices] = ask_pw_spread / ask_w_spread - bid_pw_spread / bid_w_spread
+        ewma = self._ewma[indices]
+        stepped = np.where(np.isnan(ewma), mids, ewma + self.alpha * (mids - ewma))
+        # Books with an empty side keep their average.
+        self._ewma[indices] = np.where(np.isnan(mids), ewma, stepped)
+
+    def calculate_pair_price(self, currency_pair: CurrencyPair) -> Tuple[float, float]:
+        index = self.pair_index.get(currency_pair)
+        if index is None or np.isnan(self._spreads[index]):
+            return None, None
+        return float(self._ewma[index]), float(self._spreads[index])
+
+    def calculate_all_pair_prices(self, indices: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if indices is None:
+            indices = slice(0, len(self.currency_pairs))
+        spreads = self._spreads[indices]
+        return np.where(np.isnan(spreads), np.nan, self._ewma[indices]), spreads
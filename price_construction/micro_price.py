@@ -0,0 +1,26 @@
+from typing import Tuple
+
+import numpy as np
+
+from price_construction.vwap_price import VWAPPrice
+
+
+class MicroPrice(VWAPPrice):
+    """
+    Prices books by the top of book microprice, the best bid and ask weighted by the size on the
+    opposite side: (bid * ask_size + ask * bid_size) / (bid_size + ask_size). The spread is the
+    top of book spread. The consensus price is the depth-limited VWAP of VWAPPrice.
+    """
+    def _price(self, bid_prices, bid_sizes, ask_prices, ask_sizes) -> Tuple[np.ndarray, np.ndarray]:
+        bid, bid_size = bid_prices[..., 0], bid_sizes[..., 0]
+        ask, ask_size = ask_prices[..., 0], ask_sizes[..., 0]
+        quoted = (bid_size > 0) & (ask_size > 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mid = (bid * ask_size + ask * bid_size) / (bid_size + ask_size)
+        return np.where(quoted, mid, np.nan), np.where(quoted, ask - bid, np.nan)
+
+    def _pair_price(self, bid_prices, bid_sizes, ask_prices, ask_sizes) -> Tuple[float, float]:
+        bid, bid_size, ask, ask_size = bid_prices[0], bid_sizes[0], ask_prices[0], ask_sizes[0]
+        if bid_size <= 0 or ask_size <= 0:
+            return None, None
+        return (bid * ask_size + ask * bid_size) / (bid_size + ask_size), ask - bid
@@ -1,66 +1,155 @@
-import random
-from typing import Dict, List
+from typing import Dict, List, Optional
 
+import numpy as np
+
+from price_construction.currency_graph import STRATEGIES, CurrencyGraph, PricingPlan
 from price_construction.price_production import PriceProduction
+from price_construction.pricing_cache import PricingCache
 from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler, profiled
 
 
 class PriceCrossing:
     """
     Encapsulates the pricing strategy for each target CurrencyPair.
-    For each target pair, it decides if pricing is "direct" (use its own order book)
-    or "cross" (price via two other pairs using a pivot).
+    For each target pair, it decides if pricing is "direct" (use its own order book),
+    "inverse" (invert the book of the opposite pair) or "cross" (chain the books of other pairs
+    through one or more pivot currencies). Routes are compiled into a PricingPlan over the pairs
+    known to the price production. Derived mids are cached and only recomputed once one of the
+    books they depend on has been updated.
     """
-    def __init__(self, target_currency_pairs: List[CurrencyPair], price_production: PriceProduction):
-        self.target_currency_pairs = target_currency_pairs
+    profiler: Profiler = NULL_PROFILER
+
+    def __init__(self, target_currency_pairs: List[CurrencyPair], price_production: PriceProduction,
+                 max_hops: int = 3, plan: Optional[PricingPlan] = None):
+        """
+        plan: A previously compiled plan (see PricingPlan.load) to use instead of compiling the routes.
+              Its targets replace target_currency_pairs and its pair universe must be the pairs of the
+              price production, in the same order.
+        """
+        self.target_currency_pairs = target_currency_pairs if plan is None else plan.targets
         self.price_production = price_production
-        self.strategy_map: Dict[CurrencyPair, dict] = {}
-        # Candidate pivots (common currencies)
-        self.candidate_pivots = ["USD", "EUR", "GBP"]
-        self.initialize_strategy()
-
-    def initialize_strategy(self):
-        for cp in self.target_currency_pairs:
-            # 50% chance for direct pricing.
-            if random.random() < 0.5:
-                self.strategy_map[cp] = {"strategy": "direct"}
-            else:
-                # Choose a pivot that is not in the pair.
-                possible_pivots = [p for p in self.candidate_pivots if p != cp.base and p != cp.quote]
-                if possible_pivots:
-                    pivot = random.choice(possible_pivots)
-                    # For cross pricing of A/B using pivot X, require that A/X and X/B are available.
-                    pair1 = CurrencyPair(cp.base, pivot)
-                    pair2 = CurrencyPair(pivot, cp.quote)
-                    if pair1 in self.target_currency_pairs and pair2 in self.target_currency_pairs:
-                        self.strategy_map[cp] = {"strategy": "cross", "pivot": pivot}
-                    else:
-                        self.strategy_map[cp] = {"strategy": "direct"}
-                else:
-                    self.strategy_map[cp] = {"strategy": "direct"}
+        self.max_hops = max_hops if plan is None else plan.max_hops
+        self.plan: PricingPlan = None
+        self.cache = PricingCache()
+        self.price_production.add_pricing_cache(self.cache)
+        if plan is None:
+            self.initialize_strategy()
+        else:
+            self._use_plan(plan)
+
+    def initialize_strategy(self, use_spreads: bool = False):
+        """
+        Compile the pricing plan from the pairs registered with the price production.
+        With use_spreads, routes are chosen by the current spreads instead of the number of hops.
+        """
+        available = list(self.price_production.order_books)
+        pair_index = dict(zip(available, self.price_production.get_pair_indices(available).tolist()))
+        pair_mids = pair_spreads = None
+        if use_spreads:
+            pair_mids, pair_spreads = self.price_production.calculate_all_pair_prices()
+        graph = CurrencyGraph(available)
+        self._use_plan(graph.compile(self.target_currency_pairs, pair_index, pair_mids, pair_spreads,
+                                     max_hops=self.max_hops))
+
+    def _use_plan(self, plan: PricingPlan):
+        known = self.price_production.get_pair_indices(plan.pairs)
+        if not np.array_equal(known, np.arange(len(plan.pairs))):
+            raise ValueError("The plan's pair universe does not match the pairs of the price production")
+        self.plan = plan
+        # A target depends on its route legs and, through the fallback, on its own book.
+        dependencies = np.column_stack([plan.leg_index, plan.direct_index])
+        self.cache.reset_indexed(plan.targets, dependencies, plan.pairs)
+
+    @property
+    def strategy_map(self) -> Dict[CurrencyPair, dict]:
+        """
+        Pricing strategy of every target, see get_pricing_strategy.
+        """
+        return {cp: self.plan.get_strategy(cp) for cp in self.target_currency_pairs}
+
+    def recompile(self):
+        """
+        Reselect every target's route by the lowest summed relative spread of the current books.
+        """
+        self.initialize_strategy(use_spreads=True)
 
     def get_pricing_strategy(self, target: CurrencyPair) -> dict:
-        return self.strategy_map.get(target, {"strategy": "direct"})
+        return self.plan.get_strategy(target)
 
-    def generate_mid_price(self, target: CurrencyPair) -> float:
-        strat = self.get_pricing_strategy(target)
-        if strat["strategy"] == "direct":
-            mid, _ = self.price_production.calculate_pair_price(target)
-            if mid is None:
-                mid, _ = self.price_production.calculate_consensus_price()
-            return mid
+    @profiled("price_crossing.generate_mid_prices")
+    def generate_mid_prices(self) -> np.ndarray:
+        """
+        Mid prices of all targets, ordered like target_currency_pairs.
+        Targets whose route cannot be priced fall back to their own book, then to the consensus price.
+        """
+        self.refresh_dirty()
+        return self.cache.values.copy()
+
+    def refresh_dirty(self) -> np.ndarray:
+        """
+        Reprice only the targets whose books changed since they were last priced. Returns their rows.
+        """
+        rows = self.cache.dirty_rows()
+        self._refresh(rows)
+        return rows
+
+    @profiled("price_crossing.refresh")
+    def _refresh(self, rows: np.ndarray):
+        """
+        Recompute the cached mids of the targets in rows, pricing only the books they read.
+        """
+        if len(rows) == 0:
+            return
+        if len(rows) == len(self.cache):
+            pair_mids, _ = self.price_production.calculate_all_pair_prices()
         else:
-            # Cross pricing: for target A/B using pivot X, require A/X and X/B.
-            pivot = strat["pivot"]
-            pair1 = CurrencyPair(target.base, pivot)
-            pair2 = CurrencyPair(pivot, target.quote)
-            mid1, _ = self.price_production.calculate_pair_price(pair1)
-            mid2, _ = self.price_production.calculate_pair_price(pair2)
-            if mid1 is None or mid2 is None:
-                mid, _ = self.price_production.calculate_pair_price(target)
-                if mid is None:
-                    mid, _ = self.price_production.calculate_consensus_price()
-                return mid
-            else:
-                # For crossing, assume A/B = (A/X) * (X/B)
-                return mid1 * mid2
+            needed = np.unique(np.concatenate([self.plan.leg_index[rows].ravel(), self.plan.direct_index[rows]]))
+            needed = needed[needed >= 0]
+            pair_mids = np.full(len(self.price_production.order_books), np.nan)
+            pair_mids[needed], _ = self.price_production.calculate_all_pair_prices(needed)
+        mids = self.plan.route_mid_prices(pair_mids, rows)
+        mids, uses_consensus = self._fill_fallbacks(mids, pair_mids, rows)
+        self.cache.store(rows, mids, uses_consensus)
+        if self.profiler.enabled:
+            self._profile_strategies(rows, uses_consensus)
+
+    def _fill_fallbacks(self, mids: np.ndarray, pair_mids: np.ndarray, rows=None):
+        missing = np.isnan(mids)
+        if missing.any():
+            direct = self.plan.direct_mid_prices(pair_mids, rows)
+            mids[missing] = direct[missing]
+            if self.profiler.enabled:
+                self.profiler.count("price_crossing.fallback.direct", int(np.count_nonzero(~np.isnan(direct[missing]))))
+            missing = np.isnan(mids)
+            if missing.any():
+                mids[missing], _ = self.price_production.calculate_consensus_price()
+        return mids, missing
+
+    def _profile_strategies(self, rows: np.ndarray, uses_consensus: np.ndarray):
+        # Targets repriced per compiled strategy and per pair; consensus fallbacks are counted on their own.
+        codes = self.plan.strategy_codes[rows]
+        counts = np.bincount(codes[codes >= 0], minlength=len(STRATEGIES))
+        for strategy, n in zip(STRATEGIES, counts):
+            if n:
+                self.profiler.count(f"price_crossing.strategy.{strategy}", int(n))
+        ids = self.plan.target_ids[rows]
+        self.profiler.add_pairs("price_crossing.repriced", ids)
+        if uses_consensus.any():
+            self.profiler.count("price_crossing.fallback.consensus", int(np.count_nonzero(uses_consensus)))
+            self.profiler.add_pairs("price_crossing.fallback.consensus", ids[uses_consensus])
+
+    @profiled("price_crossing.generate_mid_price")
+    def generate_mid_price(self, target: CurrencyPair) -> float:
+        mid = self.cache.get(target)
+        if mid is not None:
+            return float(mid)
+        i = self.cache.index.get(target)
+        if i is not None:
+            self._refresh(np.array([i]))
+            return float(self.cache.values[i])
+        # Not a compiled target: price it from its own book if there is one.
+        mid, _ = self.price_production.calculate_pair_price(target)
+        if mid is None:
+            mid, _ = self.price_production.calculate_consensus_price()
+        return mid
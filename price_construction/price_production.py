@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Dict, Optional, Sequence, Tuple
 
-from market.orderbook import OrderBook
+import numpy as np
+
+from market.orderbook import LazyOrderBooks, OrderBook
+from market.orderbook_store import OrderBookStore
+from price_construction.pricing_cache import PricingCache
 from util.currency_pair import CurrencyPair
 
 
@@ -10,6 +14,48 @@ class PriceProduction(ABC):
     def update(self, order_book: OrderBook):
         pass
 
+    def update_many(self, order_books: Sequence[OrderBook]):
+        """
+        Notify that several books have changed; implementations may batch the work.
+        """
+        for order_book in order_books:
+            self.update(order_book)
+
+    def update_rows(self, store: OrderBookStore, rows: np.ndarray):
+        """
+        Notify that the books at `rows` of store were written in bulk through the store, without
+        creating their views. Recomputes everything by default.
+        """
+        self.resync()
+
+    def register_store(self, order_books: LazyOrderBooks):
+        """
+        Register all books of a store at once. Implementations that price from the store's arrays can do
+        so without creating the book views; by default every book is created and passed to update_many.
+        """
+        self.update_many(list(order_books.values()))
+
+    @abstractmethod
+    def resync(self):
+        """
+        Recompute all state derived from the books, after they were changed without calling update().
+        """
+        pass
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """
+        State that is not derived from the current books, e.g. running aggregates, to be restored by
+        set_state on a production over the same books. Empty by default.
+        """
+        return {}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        """
+        Restore the state returned by get_state once the books hold the values they had when it was taken.
+        By default everything is recomputed from the books.
+        """
+        self.resync()
+
     @abstractmethod
     def calculate_consensus_price(self) -> Tuple[float, float]:
         """
@@ -25,3 +71,32 @@ class PriceProduction(ABC):
         Returns (mid_price, spread)
         """
         pass
+
+    @abstractmethod
+    def calculate_all_pair_prices(self, indices: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculate the mid price and spread of every registered pair (or of the given pair indices) in one pass.
+        Returns (mid_prices, spreads) arrays indexed by get_pair_index, NaN where a pair cannot be priced.
+        """
+        pass
+
+    @abstractmethod
+    def get_pair_index(self, currency_pair: CurrencyPair) -> Optional[int]:
+        """
+        Position of the currency pair in the arrays returned by calculate_all_pair_prices, None if unknown.
+        """
+        pass
+
+    def get_pair_indices(self, currency_pairs: Sequence[CurrencyPair]) -> np.ndarray:
+        """
+        get_pair_index of many pairs at once, -1 for unknown pairs.
+        """
+        indices = (self.get_pair_index(cp) for cp in currency_pairs)
+        return np.array([-1 if i is None else i for i in indices], dtype=np.int64)
+
+    @abstractmethod
+    def add_pricing_cache(self, cache: PricingCache):
+        """
+        Register a cache of derived prices to be invalidated whenever update() changes a book.
+        """
+        pass
@@ -0,0 +1,117 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from util.currency_pair import CurrencyPair
+
+
+class PricingCache:
+    """
+    Cached derived prices keyed by CurrencyPair, together with the books each price depends on.
+    A PriceProduction notifies the cache when a book changes and only the prices depending on that
+    book (or on the consensus price, which depends on every book) are marked dirty.
+    """
+    def __init__(self):
+        self.keys: List[CurrencyPair] = []
+        self.index: Dict[CurrencyPair, int] = {}
+        self.values = np.empty(0)
+        self.dirty = np.empty(0, dtype=bool)
+        self.uses_consensus = np.empty(0, dtype=bool)
+        self._consensus_users = 0
+        # Book pair -> rows of the cached prices derived from it.
+        self.dependents: Dict[CurrencyPair, np.ndarray] = {}
+        self.recomputed = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def consensus_users(self) -> int:
+        """
+        Number of keys whose cached price fell back to the consensus price.
+        """
+        return self._consensus_users
+
+    def reset(self, keys: Sequence[CurrencyPair], dependencies: Sequence[Sequence[CurrencyPair]]):
+        """
+        Replace the cached keys; dependencies[i] lists the books the price of keys[i] is derived from.
+        All prices start dirty.
+        """
+        self._reset_keys(keys)
+        dependents: Dict[CurrencyPair, List[int]] = {}
+        for i, books in enumerate(dependencies):
+            for book in set(books):
+                dependents.setdefault(book, []).append(i)
+        self.dependents = {book: np.array(rows, dtype=np.int64) for book, rows in dependents.items()}
+
+    def reset_indexed(self, keys: Sequence[CurrencyPair], dependency_index: np.ndarray,
+                      book_pairs: Sequence[CurrencyPair]):
+        """
+        reset() with the dependencies given as a (keys x k) array of indices into book_pairs, -1 for padding.
+        """
+        self._reset_keys(keys)
+        rows, columns = np.nonzero(dependency_index >= 0)
+        # Unique (book, row) combinations, sorted by book and then row.
+        combined = np.unique(dependency_index[rows, columns] * max(len(self.keys), 1) + rows)
+        books, rows = np.divmod(combined, max(len(self.keys), 1))
+        starts = np.flatnonzero(np.r_[True, books[1:] != books[:-1]]) if len(books) else books
+        ends = np.r_[starts[1:], len(books)].tolist()
+        self.dependents = {book_pairs[book]: rows[start:end]
+                           for book, start, end in zip(books[starts].tolist(), starts.tolist(), ends)}
+
+    def _reset_keys(self, keys: Sequence[CurrencyPair]):
+        self.keys = list(keys)
+        self.index = dict(zip(self.keys, range(len(self.keys))))
+        self.values = np.full(len(self.keys), np.nan)
+        self.dirty = np.ones(len(self.keys), dtype=bool)
+        self.uses_consensus = np.zeros(len(self.keys), dtype=bool)
+        self._consensus_users = 0
+
+    def invalidate(self, book_pair: CurrencyPair):
+        rows = self.dependents.get(book_pair)
+        if rows is not None:
+            self.dirty[rows] = True
+        # Any book change moves the consensus price.
+        if self._consensus_users:
+            self.dirty |= self.uses_consensus
+
+    def invalidate_many(self, book_pairs: Sequence[CurrencyPair]):
+        """
+        invalidate() for several changed books at once.
+        """
+        rows = [self.dependents[bp] for bp in book_pairs if bp in self.dependents]
+        if rows:
+            self.dirty[np.concatenate(rows)] = True
+        if self._consensus_users and len(book_pairs):
+            self.dirty |= self.uses_consensus
+
+    def invalidate_all(self):
+        self.dirty[:] = True
+
+    def dirty_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.dirty)
+
+    def get(self, key: CurrencyPair) -> Optional[float]:
+        """
+        The cached value, or None if the key is unknown or its price is dirty.
+        """
+        i = self.index.get(key)
+        if i is None or self.dirty[i]:
+            return None
+        return self.values[i]
+
+    def restore(self, values: np.ndarray, dirty: np.ndarray, uses_consensus: np.ndarray):
+        """
+        Set the cached values and flags of all keys, e.g. from a checkpoint of a cache with the same keys.
+        """
+        self.values[:] = values
+        self.dirty[:] = dirty
+        self.uses_consensus[:] = uses_consensus
+        self._consensus_users = int(np.count_nonzero(self.uses_consensus))
+
+    def store(self, rows: np.ndarray, values: np.ndarray, uses_consensus: np.ndarray):
+        self.values[rows] = values
+        self.uses_consensus[rows] = uses_consensus
+        self._consensus_users = int(np.count_nonzero(self.uses_consensus))
+        self.dirty[rows] = False
+        self.recomputed += len(rows)
@@ -1,5 +1,41 @@
 from enum import Enum
+from typing import Dict, Type
+
+from price_construction.depth_vwap_price import DepthVWAPPrice
+from price_construction.ewma_price import EWMAPrice
+from price_construction.micro_price import MicroPrice
+from price_construction.price_production import PriceProduction
+from price_construction.vwap_price import VWAPPrice
 
 
 class PricingEngine(Enum):
     VWAP_PRICE = 0
+    MICROPRICE = 1
+    DEPTH_VWAP = 2
+    EWMA_MID = 3
+
+    @property
+    def production_class(self) -> Type[PriceProduction]:
+        return ENGINES[self]
+
+    def create(self, **kwargs) -> PriceProduction:
+        """
+        New instance of the engine's PriceProduction, kwargs are passed to its constructor.
+        """
+        return ENGINES[self](**kwargs)
+
+
+# PriceProduction implementation behind each engine.
+ENGINES: Dict[PricingEngine, Type[PriceProduction]] = {
+    PricingEngine.VWAP_PRICE: VWAPPrice,
+    PricingEngine.MICROPRICE: MicroPrice,
+    PricingEngine.DEPTH_VWAP: DepthVWAPPrice,
+    PricingEngine.EWMA_MID: EWMAPrice,
+}
+
+
+def register_engine(engine: PricingEngine, production_class: Type[PriceProduction]):
+    """
+    Select a different PriceProduction implementation for an engine.
+    """
+    ENGINES[engine] = production_class
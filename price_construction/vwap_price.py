@@ -1,59 +1,673 @@
+import heapq
 import numpy as np
-from typing import Dict, Tuple
+from typing import Dict, List, MutableMapping, Optional, Sequence, Tuple
 
-from market.orderbook import OrderBook
+from market.orderbook import LazyOrderBooks, OrderBook
+from market.orderbook_store import OrderBookStore
 from price_construction.price_production import PriceProduction
+from price_construction.pricing_cache import PricingCache
 from util.currency_pair import CurrencyPair
+from util.pair_index import PairIndex
+from util.profiling import NULL_PROFILER, Profiler, profiled
+
+# Number of incremental consensus updates after which the merged book is rebuilt from scratch.
+RESYNC_INTERVAL = 100_000
+# Vectorized updates of more than this fraction of the books rebuild the merged book on its next use
+# instead of applying their deltas one book at a time.
+BULK_FRACTION = 0.125
+
+
+def depth_weights(sizes: np.ndarray, depth: float) -> np.ndarray:
+    """
+    Sizes taken from each level when filling `depth` units, walking levels best-first along the last axis.
+    """
+    filled_before = np.cumsum(sizes, axis=-1) - sizes
+    return np.minimum(sizes, np.maximum(depth - filled_before, 0.0))
+
+
+def depth_vwap(prices: np.ndarray, sizes: np.ndarray, depth: float) -> np.ndarray:
+    """
+    VWAP of the first `depth` units along the last axis. NaN where a book side is empty.
+    """
+    weights = depth_weights(sizes, depth)
+    total = np.sum(weights, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sum(prices * weights, axis=-1) / total
+
+
+def depth_levels(prices: Sequence[float], sizes: Sequence[float], depth: float) -> Tuple[list, list]:
+    """
+    depth_weights of one book side given as lists: the levels holding its first `depth` units, best-first,
+    with the size taken from each. Levels nothing is taken from are left out.
+    """
+    taken_prices, taken_sizes = [], []
+    filled = 0.0
+    for price, size in zip(prices, sizes):
+        take = depth - filled
+        if take <= 0:
+            break
+        if size < take:
+            take = size
+        if take > 0:
+            taken_prices.append(price)
+            taken_sizes.append(take)
+            filled += take
+    return taken_prices, taken_sizes
+
+
+def depth_sums(prices: Sequence[float], sizes: Sequence[float], depth: float) -> Tuple[float, float]:
+    """
+    sum(price * size) and sum(size) over the first `depth` units of levels given best-first as lists.
+    """
+    weighted = filled = 0.0
+    for price, size in zip(prices, sizes):
+        take = depth - filled
+        if take <= 0:
+            break
+        if size < take:
+            take = size
+        weighted += price * take
+        filled += take
+    return weighted, filled
+
+
+def best_levels(prices: np.ndarray, sizes: np.ndarray, depth: float, bids: bool) -> Tuple[list, list]:
+    """
+    The best of many (price, size) levels holding `depth` units, best-first, selected without sorting
+    them all: the best k are partitioned off, k doubling until they hold enough.
+    """
+    if not len(prices):
+        return [], []
+    keys = -prices if bids else prices
+    k = min(len(keys), 64)
+    while True:
+        part = np.argpartition(keys, k - 1)[:k] if k < len(keys) else np.arange(len(keys))
+        part = part[np.argsort(keys[part], kind="stable")]
+        end = int(np.searchsorted(np.cumsum(sizes[part]), depth))
+        # Levels outside the partition are no better than its worst one, so they only matter at that price.
+        if k == len(keys) or (end < k and keys[part[end]] < keys[part[-1]]):
+            part = part[:end + 1]
+            return prices[part].tolist(), sizes[part].tolist()
+        k = min(2 * k, len(keys))
+
+
+class RegisteredBooks(MutableMapping):
+    """
+    The books a price production registered from a LazyOrderBooks: the shared views of the store's pairs,
+    plus the books registered with the production alone, which are kept here rather than assigned to the
+    shared mapping. Like LazyOrderBooks, iterating keys, len and `in` never create views.
+    """
+    def __init__(self, shared: LazyOrderBooks):
+        self.shared = shared
+        self.store = shared.store
+        # Books registered through update(): pairs without a store row, or another book for a store pair.
+        self.own: Dict[CurrencyPair, OrderBook] = {}
+        self._extra = 0
+
+    def __getitem__(self, currency_pair: CurrencyPair) -> OrderBook:
+        book = self.own.get(currency_pair)
+        if book is not None:
+            return book
+        if currency_pair not in self.store:
+            raise KeyError(currency_pair)
+        return self.shared[currency_pair]
+
+    def get(self, currency_pair: CurrencyPair, default=None):
+        book = self.own.get(currency_pair)
+        if book is not None:
+            return book
+        return self.shared[currency_pair] if currency_pair in self.store else default
+
+    def __setitem__(self, currency_pair: CurrencyPair, order_book: OrderBook):
+        if currency_pair not in self.own and currency_pair not in self.store:
+            self._extra += 1
+        self.own[currency_pair] = order_book
+
+    def __delitem__(self, currency_pair: CurrencyPair):
+        raise TypeError("Registered books cannot be removed")
+
+    def __contains__(self, currency_pair) -> bool:
+        return currency_pair in self.own or currency_pair in self.store
+
+    def __iter__(self):
+        yield from self.store.currency_pairs
+        yield from (cp for cp in self.own if cp not in self.store)
+
+    def __len__(self) -> int:
+        return len(self.store) + self._extra
+
+
+class MergedBookSide:
+    """
+    One side of all books merged by price, each book contributing the levels of its first units (see
+    VWAPPrice). Adding or removing a level is O(1), plus O(log n) when it brings in a new price. The best
+    prices are read off a heap of the prices; prices no book quotes any more are dropped from it lazily.
+    """
+    def __init__(self, bids: bool):
+        self.bids = bids
+        self.sign = -1.0 if bids else 1.0
+        # Price -> total size and number of contributing levels; a price is removed with its last level,
+        # so rounding in the running sizes never leaves an empty price behind.
+        self.sizes: Dict[float, float] = {}
+        self.counts: Dict[float, int] = {}
+        # sign * price, smallest (best) first; may hold removed prices and duplicates.
+        self.heap: List[float] = []
+
+    def load(self, prices: np.ndarray, sizes: np.ndarray, counts: np.ndarray):
+        """
+        Replace the contents by levels given as arrays sorted by price, one entry per price.
+        """
+        keys = prices.tolist()
+        self.sizes = dict(zip(keys, sizes.tolist()))
+        self.counts = dict(zip(keys, counts.tolist()))
+        # A sorted list is a heap.
+        self.heap = [-price for price in reversed(keys)] if self.bids else keys
+
+    def rebuild(self, prices: np.ndarray, sizes: np.ndarray):
+        """
+        Replace the contents by the given levels of all books, zero sizes being ignored.
+        """
+        quoted = sizes > 0
+        unique, inverse = np.unique(prices[quoted], return_inverse=True)
+        self.load(unique, np.bincount(inverse, sizes[quoted], len(unique)),
+                  np.bincount(inverse, minlength=len(unique)))
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (prices, sizes, counts) sorted by price, as taken by load().
+        """
+        prices = sorted(self.sizes)
+        return (np.array(prices, dtype=float), np.array([self.sizes[p] for p in prices], dtype=float),
+                np.array([self.counts[p] for p in prices], dtype=np.int64))
+
+    def add(self, prices: Sequence[float], sizes: Sequence[float]):
+        for price, size in zip(prices, sizes):
+            count = self.counts.get(price)
+            if count is None:
+                self.counts[price] = 1
+                self.sizes[price] = size
+                heapq.heappush(self.heap, self.sign * price)
+            else:
+                self.counts[price] = count + 1
+                self.sizes[price] += size
+
+    def remove(self, prices: Sequence[float], sizes: Sequence[float]):
+        for price, size in zip(prices, sizes):
+            count = self.counts[price] - 1
+            if count:
+                self.counts[price] = count
+                self.sizes[price] -= size
+            else:
+                del self.counts[price]
+                del self.sizes[price]
+        if len(self.heap) > 2 * len(self.sizes) + 64:
+            self.heap = [self.sign * price for price in self.sizes]
+            heapq.heapify(self.heap)
+
+    def best(self, depth: float) -> Tuple[list, list]:
+        """
+        The best levels holding `depth` units (all of them if there are fewer), best-first.
+        """
+        heap, sign = self.heap, self.sign
+        keys, prices, sizes = [], [], []
+        filled = 0.0
+        while heap and filled < depth:
+            key = heapq.heappop(heap)
+            price = sign * key
+            size = self.sizes.get(price)
+            # Removed prices and duplicates pushed when a price came back are dropped.
+            if size is None or (keys and keys[-1] == key):
+                continue
+            keys.append(key)
+            prices.append(price)
+            sizes.append(size)
+            filled += size
+        for key in keys:
+            heapq.heappush(heap, key)
+        return prices, sizes
 
 
 class VWAPPrice(PriceProduction):
-    def __init__(self, vwap_mid_price: int, vwap_spread: int):
+    """
+    Prices books by the volume weighted average price of the first `vwap_mid_price` units on each side
+    for the mid, and of the first `vwap_spread` units for the spread.
+
+    The consensus price applies the same to all books merged into one. Only a book's own first units can
+    be among the first units of the merged book, so each book contributes just those levels to a merged
+    book (see MergedBookSide) that is adjusted by the difference when the book changes.
+    """
+    profiler: Profiler = NULL_PROFILER
+
+    def __init__(self, vwap_mid_price: int = 3, vwap_spread: int = 3):
         self.vwap_mid_price = vwap_mid_price
         self.vwap_spread = vwap_spread
-        # order_books is a dict keyed by CurrencyPair
-        self.order_books: Dict[CurrencyPair, OrderBook] = {}
+        # order_books is a dict keyed by CurrencyPair, or RegisteredBooks over the LazyOrderBooks given
+        # to register_store
+        self.order_books: MutableMapping[CurrencyPair, OrderBook] = {}
+        # Registration order defines the row of each pair in the batched results.
+        self.currency_pairs: List[CurrencyPair] = []
+        self.pair_index: Dict[CurrencyPair, int] = {}
+        self._pair_indices = PairIndex()
+        # Store shared by all registered books (False once they live in different stores) and the
+        # store row of each pair index; _contiguous caches whether those rows are 0..n-1 and _row_index
+        # the pair index of every store row.
+        self._store = None
+        self._book_rows = np.zeros(16, dtype=np.int64)
+        self._contiguous = self._row_index = None
+        # Per pair index: the book's depth-limited sum(price * size) and sum(size) per side, for the mid
+        # and the spread cutoff, and the levels it contributes to the merged book as (bid prices, bid sizes,
+        # ask prices, ask sizes) x pairs x levels, zero sizes marking unused levels.
+        self._contributions = np.zeros((16, 8))
+        self._consensus_levels = np.zeros((4, 16, 1))
+        # Levels set since they were last written to _consensus_levels, as (bid, ask) (prices, sizes) lists.
+        self._pending_levels: Dict[int, tuple] = {}
+        self._merged = (MergedBookSide(bids=True), MergedBookSide(bids=False))
+        # Whether the merged book lags _consensus_levels after a vectorized update; it is then rebuilt
+        # before the next incremental one, and the consensus is computed from _consensus_levels.
+        self._merged_stale = False
+        self._consensus: Optional[Tuple[float, float]] = None
+        self._all_pair_prices: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._updates_since_resync = 0
+        # Caches of prices derived from these books, invalidated on every update.
+        self.pricing_caches: List[PricingCache] = []
+
+    def add_pricing_cache(self, cache: PricingCache):
+        self.pricing_caches.append(cache)
 
+    @profiled("vwap.update")
     def update(self, order_book: OrderBook):
+        """
+        Register a book or notify that it has changed. Must be called after every change to a book.
+        The book's levels in the merged consensus book are swapped for its current ones.
+        """
         cp = order_book.get_currency_pair()
-        self.order_books[cp] = order_book
+        index = self.pair_index.get(cp)
+        if index is None:
+            index = len(self.currency_pairs)
+            self.order_books[cp] = order_book
+            self.pair_index[cp] = index
+            self._pair_indices[cp] = index
+            self.currency_pairs.append(cp)
+            self._reserve(index + 1, order_book.book_size)
+            self._track_book(index, order_book)
+        elif self.order_books.get(cp) is not order_book:
+            self.order_books[cp] = order_book
+            self._track_book(index, order_book)
+        if self._merged_stale:
+            self._rebuild_merged()
+        self._set_levels(index, order_book.get_bid_prices().tolist(), order_book.get_bid_sizes().tolist(),
+                         order_book.get_ask_prices().tolist(), order_book.get_ask_sizes().tolist())
+        for cache in self.pricing_caches:
+            cache.invalidate(cp)
+        self._count_updates(1)
+
+    def _reserve(self, n: int, width: int = 1):
+        if n > len(self._contributions):
+            size = max(2 * len(self._contributions), n)
+            self._contributions = np.concatenate([self._contributions, np.zeros((size - len(self._contributions), 8))])
+            self._book_rows = np.concatenate([self._book_rows, np.zeros(size - len(self._book_rows), dtype=np.int64)])
+        levels = self._consensus_levels
+        if n > levels.shape[1] or width > levels.shape[2]:
+            grown = np.zeros((4, len(self._contributions), max(width, levels.shape[2])))
+            grown[:, :levels.shape[1], :levels.shape[2]] = levels
+            self._consensus_levels = grown
+
+    def _track_book(self, index: int, order_book: OrderBook):
+        if self._store is None:
+            self._store = order_book.store
+        elif order_book.store is not self._store:
+            self._store = False
+        self._book_rows[index] = order_book.row
+        self._contiguous = self._row_index = None
+
+    def register_store(self, order_books: LazyOrderBooks):
+        """
+        Register every book of order_books.store without creating their views. Only possible before
+        any book was registered; otherwise the books are registered one by one. Books registered later
+        through update() are kept by the production, order_books itself is never written.
+        """
+        if self.order_books:
+            super().register_store(order_books)
+            return
+        store = order_books.store
+        pairs = list(store.currency_pairs)
+        n = len(pairs)
+        self.order_books = RegisteredBooks(order_books)
+        self.currency_pairs = pairs
+        self.pair_index = dict(zip(pairs, range(n)))
+        self._pair_indices.set_many(pairs, np.arange(n))
+        self._reserve(n, store.book_size)
+        self._store = store if n else None
+        self._book_rows[:n] = np.arange(n)
+        self._contiguous = self._row_index = None
+        self.resync()
+
+    @profiled("vwap.update_many")
+    def update_many(self, order_books: Sequence[OrderBook]):
+        """
+        update() for several distinct changed books. The contributions of books that are already
+        registered are recomputed in one vectorized pass.
+        """
+        known = []
+        for ob in order_books:
+            if self.order_books.get(ob.get_currency_pair()) is ob:
+                known.append(ob)
+            else:
+                self.update(ob)
+        if not known:
+            return
+        self._books_changed(self._pair_indices.lookup([ob.get_currency_pair() for ob in known]))
+
+    @profiled("vwap.update_rows")
+    def update_rows(self, store: OrderBookStore, rows: np.ndarray):
+        """
+        update_many for the books at distinct `rows` of store, written in bulk through the store. Only those
+        books are recomputed and only the prices depending on them invalidated. Rows of books that
+        were never registered are ignored.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if store is self._store:
+            if self._row_index is None or len(self._row_index) != len(store):
+                n = len(self.currency_pairs)
+                self._row_index = np.full(len(store), -1, dtype=np.int64)
+                self._row_index[self._book_rows[:n]] = np.arange(n)
+            indices = self._row_index[rows]
+        else:
+            pairs = store.currency_pairs
+            indices = self._pair_indices.lookup([pairs[row] for row in rows.tolist()])
+        indices = indices[indices >= 0]
+        if len(indices):
+            self._books_changed(indices)
+
+    def _books_changed(self, indices: np.ndarray):
+        """
+        Recompute the registered books at the given pair indices and invalidate the prices derived from them.
+        """
+        self._update_indices(indices)
+        if len(indices) >= len(self.currency_pairs):
+            for cache in self.pricing_caches:
+                cache.invalidate_all()
+        else:
+            pairs = [self.currency_pairs[i] for i in indices.tolist()]
+            for cache in self.pricing_caches:
+                cache.invalidate_many(pairs)
+
+    @profiled("vwap.resync")
+    def resync(self):
+        """
+        Recompute the contributions of all books in one pass.
+        Needed after books were changed in bulk through the OrderBookStore without calling update.
+        """
+        self._update_indices(None)
+        for cache in self.pricing_caches:
+            cache.invalidate_all()
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """
+        The book contributions and the merged book, whose sizes drift from a fresh resync() by floating
+        point rounding.
+        """
+        self._flush_levels()
+        n = len(self.currency_pairs)
+        state = {"contributions": self._contributions[:n], "consensus_levels": self._consensus_levels[:, :n],
+                 "merged_stale": np.array(self._merged_stale),
+                 "updates_since_resync": np.array(self._updates_since_resync)}
+        if not self._merged_stale:
+            for name, merged in zip(("bid", "ask"), self._merged):
+                prices, sizes, counts = merged.arrays()
+                state[f"{name}_merged"] = np.stack([prices, sizes])
+                state[f"{name}_merged_counts"] = counts
+        return state
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        n = len(self.currency_pairs)
+        if len(state["contributions"]) != n:
+            raise ValueError(f"State of {len(state['contributions'])} books for a production of {n}")
+        levels = state["consensus_levels"]
+        self._reserve(n, levels.shape[2])
+        self._contributions[:n] = state["contributions"]
+        self._contributions[n:] = 0.0
+        self._consensus_levels[:] = 0.0
+        self._consensus_levels[:, :n, :levels.shape[2]] = levels
+        self._pending_levels = {}
+        self._merged_stale = bool(state["merged_stale"])
+        if not self._merged_stale:
+            for name, merged in zip(("bid", "ask"), self._merged):
+                prices, sizes = state[f"{name}_merged"]
+                merged.load(prices, sizes, state[f"{name}_merged_counts"])
+        self._consensus = None
+        self._all_pair_prices = None
+        self._updates_since_resync = int(state["updates_since_resync"])
+        for cache in self.pricing_caches:
+            cache.invalidate_all()
+
+    def _count_updates(self, count: int):
+        self._consensus = None
+        self._all_pair_prices = None
+        self._updates_since_resync += count
+        if self._updates_since_resync >= RESYNC_INTERVAL:
+            # Rebuilt from the book contributions, dropping the rounding of the running sizes.
+            self._merged_stale = True
+            self._updates_since_resync = 0
+
+    def _set_levels(self, index: int, bid_prices: list, bid_sizes: list, ask_prices: list, ask_sizes: list):
+        """
+        Replace the contribution of the book at a pair index by the one of the levels given as lists.
+        The levels are kept as lists until _consensus_levels is next needed (see _flush_levels).
+        """
+        depth = max(self.vwap_mid_price, self.vwap_spread)
+        bid_levels = depth_levels(bid_prices, bid_sizes, depth)
+        ask_levels = depth_levels(ask_prices, ask_sizes, depth)
+        if not self._merged_stale:
+            previous = self._pending_levels.get(index)
+            if previous is None:
+                previous = []
+                for side in (0, 1):
+                    prices = self._consensus_levels[2 * side, index].tolist()
+                    sizes = self._consensus_levels[2 * side + 1, index].tolist()
+                    previous.append(([p for p, s in zip(prices, sizes) if s > 0], [s for s in sizes if s > 0]))
+            for merged, old, new in zip(self._merged, previous, (bid_levels, ask_levels)):
+                merged.remove(*old)
+                merged.add(*new)
+        self._pending_levels[index] = (bid_levels, ask_levels)
+        self._contributions[index] = (depth_sums(*bid_levels, self.vwap_mid_price) +
+                                      depth_sums(*ask_levels, self.vwap_mid_price) +
+                                      depth_sums(*bid_levels, self.vwap_spread) +
+                                      depth_sums(*ask_levels, self.vwap_spread))
+
+    def _flush_levels(self):
+        """
+        Write the levels set by _set_levels into _consensus_levels.
+        """
+        levels = self._consensus_levels
+        for index, sides in self._pending_levels.items():
+            for side, (prices, sizes) in enumerate(sides):
+                levels[2 * side + 1, index] = 0.0
+                if prices:
+                    levels[2 * side, index, :len(prices)] = prices
+                    levels[2 * side + 1, index, :len(sizes)] = sizes
+        self._pending_levels = {}
+
+    def _update_indices(self, indices: Optional[np.ndarray]):
+        """
+        Recompute the contributions of the books at the given pair indices (all books for None) from
+        their current levels.
+        """
+        n = len(self.currency_pairs)
+        if indices is not None and len(indices) == n:
+            # Distinct indices of every book, taking the contiguous path of _stacked_books.
+            indices = None
+        count = n if indices is None else len(indices)
+        if not count:
+            return
+        stacked = self._stacked_books(indices)
+        if not self._merged_stale and count <= BULK_FRACTION * n:
+            for i, index in enumerate(indices.tolist()):
+                self._set_levels(index, *(values[i].tolist() for values in stacked))
+            self._count_updates(count)
+            return
+        depth = max(self.vwap_mid_price, self.vwap_spread)
+        rows = slice(0, n) if indices is None else indices
+        width = stacked[0].shape[1]
+        self._reserve(n, width)
+        self._flush_levels()
+        levels = self._consensus_levels
+        columns = []
+        for side in (0, 1):
+            prices, weights = stacked[2 * side], depth_weights(stacked[2 * side + 1], depth)
+            levels[2 * side, rows, :width] = prices
+            levels[2 * side + 1, rows, :width] = weights
+            levels[2 * side + 1, rows, width:] = 0.0
+            for cutoff in (self.vwap_mid_price, self.vwap_spread):
+                cut = weights if cutoff == depth else depth_weights(weights, cutoff)
+                columns.append(np.sum(prices * cut, axis=-1))
+                columns.append(np.sum(cut, axis=-1))
+        # columns hold bid (mid, spread) then ask (mid, spread); contributions group by cutoff.
+        self._contributions[rows] = np.stack([columns[i] for i in (0, 1, 4, 5, 2, 3, 6, 7)], axis=-1)
+        self._merged_stale = True
+        self._count_updates(count)
+
+    def _rebuild_merged(self):
+        self._flush_levels()
+        n = len(self.currency_pairs)
+        for side, merged in enumerate(self._merged):
+            merged.rebuild(self._consensus_levels[2 * side, :n].ravel(),
+                           self._consensus_levels[2 * side + 1, :n].ravel())
+        self._merged_stale = False
+        self._updates_since_resync = 0
+
+    def get_pair_index(self, currency_pair: CurrencyPair) -> Optional[int]:
+        return self.pair_index.get(currency_pair)
+
+    def get_pair_indices(self, currency_pairs: Sequence[CurrencyPair]) -> np.ndarray:
+        """
+        get_pair_index of many pairs at once, -1 for unknown pairs.
+        """
+        return self._pair_indices.lookup(currency_pairs)
+
+    def _stacked_books(self, indices: Optional[np.ndarray] = None) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Bid/ask prices and sizes of the registered books (or of the pair indices given) as (pairs x levels)
+        arrays in registration order. Books sharing one OrderBookStore are gathered with a single indexing
+        operation per array.
+        """
+        n = len(self.currency_pairs)
+        store = self._store
+        if store:
+            # Levels past the deepest populated one are empty everywhere and skipped.
+            width = store.max_levels()
+            if indices is not None:
+                rows = self._book_rows[indices]
+            else:
+                rows = self._book_rows[:n]
+                if self._contiguous is None:
+                    self._contiguous = n == len(store) and np.array_equal(rows, np.arange(n))
+                if self._contiguous:
+                    return (store.bid_prices[:, :width], store.bid_sizes[:, :width],
+                            store.ask_prices[:, :width], store.ask_sizes[:, :width])
+            return (store.bid_prices[rows, :width], store.bid_sizes[rows, :width],
+                    store.ask_prices[rows, :width], store.ask_sizes[rows, :width])
+        # Books from different stores: pad every book to the deepest one.
+        pairs = self.currency_pairs if indices is None else [self.currency_pairs[i] for i in indices]
+        books = [self.order_books[cp] for cp in pairs]
+        levels = max([ob.book_size for ob in books] + [1])
+        stacked = np.zeros((4, len(books), levels))
+        for i, ob in enumerate(books):
+            for side, values in enumerate((ob.get_bid_prices(), ob.get_bid_sizes(),
+                                           ob.get_ask_prices(), ob.get_ask_sizes())):
+                stacked[side, i, :len(values)] = values
+        return stacked[0], stacked[1], stacked[2], stacked[3]
+
+    def _price(self, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        mid = (depth_vwap(bid_prices, bid_sizes, self.vwap_mid_price) +
+               depth_vwap(ask_prices, ask_sizes, self.vwap_mid_price)) / 2
+        spread = (depth_vwap(ask_prices, ask_sizes, self.vwap_spread) -
+                  depth_vwap(bid_prices, bid_sizes, self.vwap_spread))
+        return mid, spread
+
+    def _pair_price(self, bid_prices: list, bid_sizes: list, ask_prices: list, ask_sizes: list) \
+            -> Tuple[float, float]:
+        """
+        _price of a single book whose sides are given as lists, both holding some size. Subclasses
+        overriding _price override this too, returning (None, None) where their levels hold no size.
+        """
+        bid_mid, bid_mid_size = depth_sums(bid_prices, bid_sizes, self.vwap_mid_price)
+        ask_mid, ask_mid_size = depth_sums(ask_prices, ask_sizes, self.vwap_mid_price)
+        bid_spread, bid_spread_size = depth_sums(bid_prices, bid_sizes, self.vwap_spread)
+        ask_spread, ask_spread_size = depth_sums(ask_prices, ask_sizes, self.vwap_spread)
+        return ((bid_mid / bid_mid_size + ask_mid / ask_mid_size) / 2,
+                ask_spread / ask_spread_size - bid_spread / bid_spread_size)
 
     def calculate_consensus_price(self) -> Tuple[float, float]:
-        # Global consensus: compute weighted averages across all order books.
-        combined_bid_prices = []
-        combined_bid_sizes = []
-        combined_ask_prices = []
-        combined_ask_sizes = []
-        for ob in self.order_books.values():
-            combined_bid_prices.extend(ob.get_bid_prices())
-            combined_bid_sizes.extend(ob.get_bid_sizes())
-            combined_ask_prices.extend(ob.get_ask_prices())
-            combined_ask_sizes.extend(ob.get_ask_sizes())
-        combined_bid_prices = np.array(combined_bid_prices)
-        combined_bid_sizes = np.array(combined_bid_sizes)
-        combined_ask_prices = np.array(combined_ask_prices)
-        combined_ask_sizes = np.array(combined_ask_sizes)
-        bid_weighted_avg = np.sum(combined_bid_prices * combined_bid_sizes) / np.sum(combined_bid_sizes)
-        ask_weighted_avg = np.sum(combined_ask_prices * combined_ask_sizes) / np.sum(combined_ask_sizes)
-        consensus_mid_price = (bid_weighted_avg + ask_weighted_avg) / 2
-        consensus_spread = ask_weighted_avg - bid_weighted_avg
-        return consensus_mid_price, consensus_spread
+        """
+        Global consensus: the VWAPs of the first vwap_mid_price and vwap_spread units of all books merged
+        into one. Returns NaN when no book has liquidity on a side.
+        """
+        if self._consensus is None:
+            depth = max(self.vwap_mid_price, self.vwap_spread)
+            n = len(self.currency_pairs)
+            sides = []
+            for side, merged in enumerate(self._merged):
+                if self._merged_stale:
+                    self._flush_levels()
+                    sizes = self._consensus_levels[2 * side + 1, :n].ravel()
+                    quoted = sizes > 0
+                    levels = best_levels(self._consensus_levels[2 * side, :n].ravel()[quoted], sizes[quoted],
+                                         depth, merged.bids)
+                else:
+                    levels = merged.best(depth)
+                sides.append((depth_sums(*levels, self.vwap_mid_price), depth_sums(*levels, self.vwap_spread)))
+            ((bid_pw_mid, bid_w_mid), (bid_pw_spread, bid_w_spread)), \
+                ((ask_pw_mid, ask_w_mid), (ask_pw_spread, ask_w_spread)) = sides
+            if bid_w_mid <= 0 or ask_w_mid <= 0:
+                self._consensus = np.nan, np.nan
+            else:
+                self._consensus = ((bid_pw_mid / bid_w_mid + ask_pw_mid / ask_w_mid) / 2,
+                                   ask_pw_spread / ask_w_spread - bid_pw_spread / bid_w_spread)
+        return self._consensus
 
+    @profiled("vwap.calculate_pair_price")
     def calculate_pair_price(self, currency_pair: CurrencyPair) -> Tuple[float, float]:
         ob = self.order_books.get(currency_pair)
         if ob is None:
             return None, None
 
-        bid_prices = ob.get_bid_prices()
-        bid_sizes = ob.get_bid_sizes()
-        ask_prices = ob.get_ask_prices()
-        ask_sizes = ob.get_ask_sizes()
+        bid_sizes = ob.get_bid_sizes().tolist()
+        ask_sizes = ob.get_ask_sizes().tolist()
 
-        if np.sum(bid_sizes) == 0 or np.sum(ask_sizes) == 0:
+        if sum(bid_sizes) == 0 or sum(ask_sizes) == 0:
             return None, None
 
-        bid_weighted_avg = np.sum(bid_prices * bid_sizes) / np.sum(bid_sizes)
-        ask_weighted_avg = np.sum(ask_prices * ask_sizes) / np.sum(ask_sizes)
-        mid = (bid_weighted_avg + ask_weighted_avg) / 2
-        spread = ask_weighted_avg - bid_weighted_avg
+        return self._pair_price(ob.get_bid_prices().tolist(), bid_sizes, ob.get_ask_prices().tolist(), ask_sizes)
 
-        return mid, spread
+    @profiled("vwap.calculate_all_pair_prices")
+    def calculate_all_pair_prices(self, indices: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Mid and spread of every registered pair in one vectorized pass, in registration order
+        (see get_pair_index), or only of the given pair indices. Pairs with an empty book side are NaN.
+        The prices of all pairs are kept until the next update and returned as read-only arrays.
+        """
+        if not self.order_books or (indices is not None and len(indices) == 0):
+            return np.empty(0), np.empty(0)
+        if indices is not None:
+            return self._pair_prices(indices)
+        if self._all_pair_prices is None:
+            # Shared until the next update by every caller pricing all pairs, e.g. the PriceCrossing
+            # refreshing all targets and a TickRecorder recording the spreads of the same books.
+            self._all_pair_prices = self._pair_prices(None)
+            for prices in self._all_pair_prices:
+                prices.setflags(write=False)
+        return self._all_pair_prices
+
+    def _pair_prices(self, indices: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        if type(self)._price is not VWAPPrice._price:
+            return self._price(*self._stacked_books(indices))
+        # The depth-limited VWAPs follow from the book contributions, which every update keeps current.
+        if indices is None:
+            indices = slice(0, len(self.currency_pairs))
+        bid_pw_mid, bid_w_mid, ask_pw_mid, ask_w_mid, bid_pw_spread, bid_w_spread, ask_pw_spread, ask_w_spread = \
+            self._contributions[indices].T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return ((bid_pw_mid / bid_w_mid + ask_pw_mid / ask_w_mid) / 2,
+                    ask_pw_spread / ask_w_spread - bid_pw_spread / bid_w_spread)
@@ -0,0 +1,160 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.orderbook_store import OrderBookStore
+from price_construction.arbitrage import ArbitrageScanner
+from util.currency_pair import CurrencyPair
+
+
+def consistent_quotes(pairs, values, half_spread=0.0005):
+    mids = np.array([values[cp.base] / values[cp.quote] for cp in pairs])
+    return mids * (1 - half_spread), mids * (1 + half_spread)
+
+
+class TestArbitrageScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD"), CurrencyPair("EUR", "GBP"),
+                      CurrencyPair("USD", "JPY"), CurrencyPair("EUR", "JPY")]
+        self.values = {"EUR": 1.1, "GBP": 1.3, "USD": 1.0, "JPY": 0.007}
+        self.scanner = ArbitrageScanner(self.pairs)
+
+    def test_consistent_quotes_have_no_arbitrage(self):
+        report = self.scanner.scan(*consistent_quotes(self.pairs, self.values))
+
+        self.assertEqual([], report.triangles)
+        self.assertEqual([], report.cycles)
+
+    def test_mispriced_cross_is_found(self):
+        bids, asks = consistent_quotes(self.pairs, self.values)
+        # EUR/GBP bid far above EUR/USD / GBP/USD: sell EUR for GBP, GBP for USD, buy EUR back with USD.
+        bids[2] *= 1.01
+        asks[2] *= 1.01
+
+        report = self.scanner.scan(bids, asks)
+
+        self.assertEqual(1, len(report.triangles))
+        triangle = report.triangles[0]
+        self.assertEqual({"EUR", "GBP", "USD"}, set(triangle.currencies))
+        self.assertEqual(triangle.currencies[0], triangle.currencies[-1])
+        self.assertEqual({(self.pairs[2], False), (self.pairs[1], False), (self.pairs[0], True)},
+                         set(triangle.legs))
+        self.assertAlmostEqual(bids[2] * bids[1] / asks[0] - 1, triangle.profit)
+        self.assertEqual(1, len(report.cycles))
+        self.assertEqual(set(triangle.legs), set(report.cycles[0].legs))
+        self.assertAlmostEqual(triangle.profit, report.cycles[0].profit)
+
+    def test_min_profit_filters_small_cycles(self):
+        bids, asks = consistent_quotes(self.pairs, self.values)
+        bids[2] *= 1.003
+        asks[2] *= 1.003
+
+        self.assertEqual(1, len(self.scanner.scan(bids, asks).triangles))
+        strict = ArbitrageScanner(self.pairs, min_profit=0.01)
+        report = strict.scan(bids, asks)
+        self.assertEqual([], report.triangles)
+        self.assertEqual([], report.cycles)
+
+    def test_missing_quotes_are_skipped(self):
+        bids, asks = consistent_quotes(self.pairs, self.values)
+        bids[2] *= 1.01
+        asks[2] *= 1.01
+        bids[1] = np.nan
+
+        report = self.scanner.scan(bids, asks)
+
+        self.assertEqual([], report.triangles)
+        self.assertEqual([], report.cycles)
+
+    def test_longer_cycles_are_found(self):
+        pairs = [CurrencyPair("A", "B"), CurrencyPair("B", "C"), CurrencyPair("C", "D"), CurrencyPair("D", "A")]
+        scanner = ArbitrageScanner(pairs)
+        bids = np.array([1.0, 1.0, 1.0, 1.02])
+
+        report = scanner.scan(bids, bids * 1.001)
+
+        self.assertEqual([], report.triangles)
+        self.assertEqual(1, len(report.cycles))
+        self.assertEqual(5, len(report.cycles[0].currencies))
+        self.assertAlmostEqual(0.02, report.cycles[0].profit)
+
+    def test_negative_chain_beside_cycle(self):
+        # A/B/C is a chain whose edges all pay more than they cost but that closes no cycle, next to a
+        # mispriced D/E/F triangle.
+        pairs = [CurrencyPair("A", "B"), CurrencyPair("B", "C"),
+                 CurrencyPair("D", "E"), CurrencyPair("E", "F"), CurrencyPair("D", "F")]
+        scanner = ArbitrageScanner(pairs)
+        bids = np.array([100.0, 50.0, 2.0, 3.0, 6.3])
+
+        report = scanner.scan(bids, bids * 1.001)
+
+        self.assertEqual(1, len(report.cycles))
+        self.assertEqual({"D", "E", "F"}, set(report.cycles[0].currencies))
+        self.assertAlmostEqual(6.3 / (2.0 * 3.0 * 1.001 ** 2) - 1, report.cycles[0].profit)
+        # The chain alone.
+        bids[2:] = np.nan
+        self.assertEqual([], scanner.scan(bids, bids * 1.001).cycles)
+
+    def test_triangles_match_brute_force(self):
+        rng = np.random.default_rng(3)
+        currencies = [f"C{i}" for i in range(8)]
+        pairs = [CurrencyPair(a, b) for a, b in itertools.combinations(currencies, 2) if rng.random() < 0.7]
+        values = dict(zip(currencies, rng.lognormal(0.0, 1.0, len(currencies))))
+        bids, asks = consistent_quotes(pairs, values)
+        noise = rng.lognormal(0.0, 0.003, len(pairs))
+        bids, asks = bids * noise, asks * noise
+        scanner = ArbitrageScanner(pairs)
+
+        report = scanner.scan(bids, asks)
+
+        rates = {}
+        for cp, bid, ask in zip(pairs, bids, asks):
+            rates[cp.base, cp.quote] = max(rates.get((cp.base, cp.quote), 0.0), bid)
+            rates[cp.quote, cp.base] = max(rates.get((cp.quote, cp.base), 0.0), 1 / ask)
+        expected = set()
+        for a, b, c in itertools.permutations(currencies, 3):
+            if a < b and a < c and (a, b) in rates and (b, c) in rates and (c, a) in rates:
+                if rates[a, b] * rates[b, c] * rates[c, a] > 1:
+                    expected.add((a, b, c))
+        self.assertGreater(len(expected), 0)
+        # Triangles may start at any of their currencies.
+        found = set()
+        for triangle in report.triangles:
+            path = triangle.currencies[:3]
+            start = path.index(min(path))
+            found.add(tuple(path[start:] + path[:start]))
+        self.assertEqual(len(expected), len(report.triangles))
+        self.assertEqual(expected, found)
+
+    def test_scan_store_reads_top_of_book(self):
+        store = OrderBookStore(book_size=2)
+        store.add_pairs(self.pairs[:3])
+        bids, asks = consistent_quotes(self.pairs[:3], self.values)
+        bids[2] *= 1.01
+        asks[2] *= 1.01
+        sizes = np.ones((3, 2))
+        store.update_all(np.column_stack([bids, bids * 0.99]), sizes, np.column_stack([asks, asks * 1.01]), sizes)
+
+        report = self.scanner.scan_store(store)
+
+        self.assertEqual(1, len(report.triangles))
+        self.assertAlmostEqual(bids[2] * bids[1] / asks[0] - 1, report.triangles[0].profit)
+
+
+class TestSimulationArbitrage(unittest.TestCase):
+
+    def test_seeded_books_have_no_arbitrage(self):
+        pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD"), CurrencyPair("EUR", "GBP")]
+        simulation = FXMarketSimulation(pairs, seed=1, risk_factor=1.0)
+
+        report = simulation.scan_arbitrage()
+
+        self.assertEqual([], report.triangles)
+        self.assertEqual([], report.cycles)
+
+
+if __name__ == '__main__':
+    unittest.main()
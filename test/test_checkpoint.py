@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from market.checkpoint import POINTER_FILE, read_checkpoint, write_checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "checkpoint")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_rewriting_keeps_only_the_current_version(self):
+        write_checkpoint(self.path, {"values": np.arange(3)}, {"step": 1})
+        write_checkpoint(self.path, {"values": np.arange(4)}, {"step": 2})
+
+        arrays, state = read_checkpoint(self.path)
+        self.assertEqual({"step": 2}, state)
+        np.testing.assert_array_equal(np.arange(4), arrays["values"])
+        self.assertEqual(sorted([POINTER_FILE, "v2"]), sorted(os.listdir(self.path)))
+
+    def test_rewriting_keeps_foreign_entries(self):
+        os.makedirs(os.path.join(self.path, "results"))
+        with open(os.path.join(self.path, "notes.txt"), "w") as f:
+            f.write("notes")
+
+        write_checkpoint(self.path, {"values": np.arange(3)}, {"step": 1})
+        write_checkpoint(self.path, {"values": np.arange(4)}, {"step": 2})
+
+        self.assertEqual(sorted([POINTER_FILE, "notes.txt", "results", "v2"]), sorted(os.listdir(self.path)))
+        with open(os.path.join(self.path, "notes.txt")) as f:
+            self.assertEqual("notes", f.read())
+
+    def test_interrupted_write_leaves_previous_checkpoint(self):
+        write_checkpoint(self.path, {"values": np.arange(3)}, {"step": 1})
+        # A write that stopped before replacing the pointer leaves an unreferenced version behind.
+        os.makedirs(os.path.join(self.path, "v2"))
+        with open(os.path.join(self.path, "v2", "values.npy"), "wb") as f:
+            f.write(b"partial")
+
+        arrays, state = read_checkpoint(self.path)
+        self.assertEqual({"step": 1}, state)
+        np.testing.assert_array_equal(np.arange(3), arrays["values"])
+
+        write_checkpoint(self.path, {"values": np.arange(5)}, {"step": 3})
+        self.assertEqual({"step": 3}, read_checkpoint(self.path)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from util.currency_pair import CurrencyPair
+from util.pair_index import PairIndex
+
+
+class TestCurrencyPair(unittest.TestCase):
+
+    def test_pairs_are_interned(self):
+        eur_usd = CurrencyPair("EUR", "USD")
+
+        self.assertIs(eur_usd, CurrencyPair("EUR", "USD"))
+        self.assertEqual(eur_usd.id, CurrencyPair("EUR", "USD").id)
+        self.assertIs(eur_usd, CurrencyPair.from_id(eur_usd.id))
+        self.assertNotEqual(eur_usd, CurrencyPair("USD", "EUR"))
+
+    def test_currency_ids_are_shared(self):
+        eur_usd = CurrencyPair("EUR", "USD")
+        eur_sek = CurrencyPair("EUR", "SEK")
+
+        self.assertEqual(eur_usd.base_id, eur_sek.base_id)
+        self.assertEqual("SEK", CurrencyPair.currency(eur_sek.quote_id))
+
+    def test_inverse(self):
+        eur_usd = CurrencyPair("EUR", "USD")
+
+        self.assertIs(CurrencyPair("USD", "EUR"), eur_usd.inverse)
+        self.assertIs(eur_usd, eur_usd.inverse.inverse)
+
+    def test_pickle_returns_interned_instance(self):
+        eur_usd = CurrencyPair("EUR", "USD")
+
+        self.assertIs(eur_usd, pickle.loads(pickle.dumps(eur_usd)))
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            CurrencyPair("EUR", "USD").base = "GBP"
+
+    def test_pair_index_lookup(self):
+        pairs = [CurrencyPair(f"X{i}", "USD") for i in range(40)]
+        index = PairIndex()
+        for row, cp in enumerate(pairs[::2]):
+            index[cp] = row
+
+        np.testing.assert_array_equal([0, -1, 19], index.lookup([pairs[0], pairs[1], pairs[38]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from price_construction.pricing_engine import PricingEngine
+from util.currency_pair import CurrencyPair
+from util.side import Side
+
+
+class TestFXMarketSimulation(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("USD", "SEK"), CurrencyPair("GBP", "USD"),
+                      CurrencyPair("EUR", "SEK"), CurrencyPair("NOK", "SEK")]
+
+    def test_books_are_created_lazily(self):
+        simulation = FXMarketSimulation(self.pairs, seed=1)
+        simulation.run_batch(3)
+
+        self.assertEqual(0, simulation.order_books.created())
+        self.assertEqual(len(self.pairs), len(simulation.order_books))
+        book = simulation.order_books[self.pairs[0]]
+        mid, _ = simulation.price_production.calculate_pair_price(self.pairs[0])
+        self.assertEqual(1, simulation.order_books.created())
+        self.assertAlmostEqual(mid, (book.get_bid_prices()[0] + book.get_ask_prices()[0]) / 2)
+
+    def test_run_prints_derived_mids_unless_quiet(self):
+        simulation = FXMarketSimulation(self.pairs, seed=1)
+        steps = []
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            simulation.run(2, log=False, on_step=steps.append)
+        self.assertEqual("", output.getvalue())
+        self.assertEqual([0, 1], steps)
+
+        with contextlib.redirect_stdout(output):
+            simulation.run(1)
+        # The same quotes on a second simulation, priced before the takers trade.
+        expected = FXMarketSimulation(self.pairs, seed=1)
+        expected.run(2, log=False)
+        expected.market_maker.place_orders(expected.order_books)
+        mid = expected.price_crossing.generate_mid_price(self.pairs[3])
+        self.assertIn(f"{self.pairs[3]}: Mid = {mid:.4f},", output.getvalue())
+
+    def test_orders_on_books_reprice_them(self):
+        simulation = FXMarketSimulation(self.pairs, seed=1)
+        book = simulation.order_books[self.pairs[0]]
+        ask = book.get_ask_prices()[0]
+
+        simulation.order_books[self.pairs[0]].submit_market_order(Side.BUY, 10)
+        simulation.order_books[self.pairs[0]].submit_limit_order(Side.SELL, ask * 1.01, 10)
+
+        mid, _ = simulation.price_production.calculate_pair_price(self.pairs[0])
+        self.assertAlmostEqual((book.get_bid_prices()[0] + ask * 1.01) / 2, mid)
+        self.assertAlmostEqual(mid, simulation.price_crossing.generate_mid_price(self.pairs[0]))
+
+    def test_load_reproduces_saved_simulation(self):
+        simulation = FXMarketSimulation(self.pairs, seed=7)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "universe.npz")
+            simulation.save(path)
+            loaded = FXMarketSimulation.load(path, seed=7)
+
+        self.assertEqual(self.pairs, loaded.currency_pairs)
+        self.assertEqual(simulation.price_crossing.strategy_map, loaded.price_crossing.strategy_map)
+        for expected, actual in zip(simulation.run_batch(5), loaded.run_batch(5)):
+            np.testing.assert_array_equal(expected, actual)
+
+    def test_resume_continues_bit_exactly(self):
+        for engine in (PricingEngine.VWAP_PRICE, PricingEngine.EWMA_MID):
+            with self.subTest(engine=engine):
+                simulation = FXMarketSimulation(self.pairs, seed=4, pricing_engine=engine)
+                simulation.run_batch(3)
+                simulation.run_population(2, n_makers=20, n_takers=20)
+                book = simulation.order_books[self.pairs[0]]
+                book.submit_limit_order(Side.SELL, book.get_ask_prices()[0] * 1.0001, 2)
+                simulation.market_takers[self.pairs[1]].place_order(simulation.order_books[self.pairs[1]],
+                                                                    Side.BUY, 1.5)
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, "checkpoint")
+                    simulation.checkpoint(path)
+                    # Checkpointing again replaces the previous checkpoint.
+                    simulation.checkpoint(path)
+                    resumed = FXMarketSimulation.resume(path)
+
+                self.assertEqual(simulation.price_crossing.strategy_map, resumed.price_crossing.strategy_map)
+                self.assertEqual(simulation.market_takers[self.pairs[1]].inventory,
+                                 resumed.market_takers[self.pairs[1]].inventory)
+                for expected, actual in zip(simulation.run_population(3), resumed.run_population(3)):
+                    np.testing.assert_array_equal(expected, actual)
+                np.testing.assert_array_equal(simulation.population_engine.makers.cash,
+                                              resumed.population_engine.makers.cash)
+                for expected, actual in zip(simulation.run_batch(3), resumed.run_batch(3)):
+                    np.testing.assert_array_equal(expected, actual)
+                for side in (Side.BUY, Side.SELL):
+                    expected = simulation.order_books[self.pairs[0]].submit_limit_order(side, 1.0, 3)
+                    actual = resumed.order_books[self.pairs[0]].submit_limit_order(side, 1.0, 3)
+                    self.assertEqual(expected, actual)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.historical_data import QuoteCalibrator, QuoteChunk, merge_quotes, read_quotes, write_quotes
+from util.currency_pair import CurrencyPair
+
+
+def random_quotes(rng, n, mid, start=0):
+    timestamps = start + np.cumsum(rng.integers(1, 1000, n))
+    mids = mid * np.exp(np.cumsum(rng.normal(0.0, 1e-4, n)))
+    spreads = mids * rng.uniform(1e-4, 3e-4, n)
+    return timestamps, mids - spreads / 2, mids + spreads / 2, np.full(n, 5.0), np.full(n, 7.0)
+
+
+class TestHistoricalData(unittest.TestCase):
+
+    def setUp(self):
+        self.eur_usd = CurrencyPair("EUR", "USD")
+        self.usd_sek = CurrencyPair("USD", "SEK")
+        self.rng = np.random.default_rng(5)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_calibration_is_independent_of_chunking(self):
+        quotes = random_quotes(self.rng, 1000, 1.1)
+        write_quotes(self.path("eur_usd.npy"), *quotes)
+        timestamps, bids, asks = quotes[:3]
+        mids = (bids + asks) / 2
+
+        for chunk_rows in (1000, 64, 7):
+            calibrator = QuoteCalibrator()
+            for chunk in read_quotes(self.path("eur_usd.npy"), self.eur_usd, chunk_rows):
+                self.assertLessEqual(len(chunk), chunk_rows)
+                calibrator.update(chunk)
+            calibration = calibrator.calibration()
+
+            self.assertEqual([self.eur_usd], calibration.currency_pairs)
+            self.assertEqual(1000, calibration.counts[0])
+            self.assertEqual(mids[-1], calibration.mids[0])
+            self.assertAlmostEqual(mids.mean(), calibration.mean_mids[0])
+            self.assertAlmostEqual(mids.std(ddof=1), calibration.mid_stds[0])
+            self.assertAlmostEqual((asks - bids).mean(), calibration.mean_spreads[0])
+            self.assertAlmostEqual(np.diff(np.log(mids)).std(ddof=1), calibration.volatilities[0])
+            self.assertAlmostEqual(999 / ((timestamps[-1] - timestamps[0]) / 1e9), calibration.update_rates[0])
+
+    def test_csv_with_pair_column(self):
+        with open(self.path("quotes.csv"), "w") as f:
+            f.write("timestamp,pair,bid,ask,bid_size,ask_size\n")
+            f.write("1,EUR/USD,1.0999,1.1001,1,2\n")
+            f.write("2,USD/SEK,10.49,10.51,3,4\n")
+            f.write("3,EUR/USD,1.1009,1.1011,1,2\n")
+
+        chunks = list(read_quotes(self.path("quotes.csv"), chunk_rows=2))
+
+        self.assertEqual([2, 1], [len(chunk) for chunk in chunks])
+        np.testing.assert_array_equal([self.eur_usd.id, self.usd_sek.id], chunks[0].pair_ids)
+        np.testing.assert_array_equal([1.1009], chunks[1].bids)
+        np.testing.assert_array_equal([3], chunks[1].timestamps)
+
+    def test_csv_without_columns_is_rejected(self):
+        with open(self.path("quotes.csv"), "w") as f:
+            f.write("timestamp,bid,ask\n1,1.0,1.1\n")
+
+        with self.assertRaises(ValueError):
+            next(read_quotes(self.path("quotes.csv"), self.eur_usd))
+
+    def test_merge_orders_quotes_by_time(self):
+        eur_usd = random_quotes(self.rng, 500, 1.1)
+        usd_sek = random_quotes(self.rng, 300, 10.5)
+        write_quotes(self.path("eur_usd.npy"), *eur_usd)
+        write_quotes(self.path("usd_sek.npy"), *usd_sek)
+        # Equal timestamps keep source order.
+        ties = QuoteChunk(np.array([self.usd_sek.id]), eur_usd[0][:1].copy(), *(np.ones(1) for _ in range(4)))
+
+        merged = list(merge_quotes([read_quotes(self.path("eur_usd.npy"), self.eur_usd, 64),
+                                    read_quotes(self.path("usd_sek.npy"), self.usd_sek, 50), [ties]],
+                                   chunk_rows=100))
+
+        self.assertTrue(all(len(chunk) <= 100 for chunk in merged))
+        timestamps = np.concatenate([chunk.timestamps for chunk in merged])
+        pair_ids = np.concatenate([chunk.pair_ids for chunk in merged])
+        self.assertEqual(801, len(timestamps))
+        self.assertTrue(np.all(np.diff(timestamps) >= 0))
+        np.testing.assert_array_equal(eur_usd[0], timestamps[pair_ids == self.eur_usd.id])
+        first = np.flatnonzero(timestamps == eur_usd[0][0])
+        self.assertEqual(self.eur_usd.id, pair_ids[first[0]])
+        self.assertEqual(self.usd_sek.id, pair_ids[first[-1]])
+
+    def test_simulation_starts_from_calibrated_books(self):
+        eur_usd = random_quotes(self.rng, 200, 1.1)
+        usd_sek = random_quotes(self.rng, 200, 10.5)
+        write_quotes(self.path("eur_usd.npy"), *eur_usd)
+        write_quotes(self.path("usd_sek.npy"), *usd_sek)
+        simulation = FXMarketSimulation([self.eur_usd, self.usd_sek, CurrencyPair("EUR", "SEK")], seed=1)
+
+        calibration = simulation.calibrate([(self.path("eur_usd.npy"), self.eur_usd),
+                                            (self.path("usd_sek.npy"), self.usd_sek)], chunk_rows=32)
+
+        self.assertEqual(2, len(calibration.currency_pairs))
+        book = simulation.order_books[self.usd_sek]
+        np.testing.assert_array_equal([usd_sek[1][-1]], book.get_bid_prices())
+        np.testing.assert_array_equal([usd_sek[4][-1]], book.get_ask_sizes())
+        mid, _ = simulation.price_production.calculate_pair_price(self.eur_usd)
+        self.assertAlmostEqual((eur_usd[1][-1] + eur_usd[2][-1]) / 2, mid)
+        self.assertAlmostEqual(mid, simulation.price_crossing.generate_mid_price(self.eur_usd))
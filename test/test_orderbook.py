@@ -0,0 +1,133 @@
+import unittest
+
+import numpy as np
+
+from market.orderbook import OrderBook
+from util.currency_pair import CurrencyPair
+from util.side import Side
+
+
+class TestOrderBookMatching(unittest.TestCase):
+
+    def setUp(self):
+        self.orderbook = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=5)
+        self.orderbook.update_bid(new_prices=[1.0905, 1.0900, 1.0895], new_sizes=[1, 1, 5])
+        self.orderbook.update_ask(new_prices=[1.1005, 1.1010, 1.1015], new_sizes=[1, 1, 5])
+
+    def test_market_order_walks_levels(self):
+        report = self.orderbook.submit_market_order(Side.BUY, 3)
+
+        self.assertEqual(3, report.executed_size)
+        self.assertAlmostEqual((1.1005 + 1.1010 + 1.1015) / 3, report.average_price)
+        self.assertEqual([1.1005, 1.1010, 1.1015], [fill.price for fill in report.fills])
+        np.testing.assert_array_equal(self.orderbook.get_ask_prices(), [1.1015])
+        np.testing.assert_array_equal(self.orderbook.get_ask_sizes(), [4])
+
+    def test_market_order_skips_empty_level(self):
+        self.orderbook.update_ask(new_prices=[1.0, 1.1, 1.2], new_sizes=[5, 0, 5])
+
+        report = self.orderbook.submit_market_order(Side.BUY, 8)
+
+        self.assertEqual(8, report.executed_size)
+        self.assertAlmostEqual((1.0 * 5 + 1.2 * 3) / 8, report.average_price)
+        self.assertEqual([(1.0, 5), (1.2, 3)], [(fill.price, fill.size) for fill in report.fills])
+        np.testing.assert_array_equal(self.orderbook.get_ask_prices(), [1.2])
+        np.testing.assert_array_equal(self.orderbook.get_ask_sizes(), [2])
+
+    def test_market_order_partially_filled_when_side_runs_out(self):
+        report = self.orderbook.submit_market_order(Side.SELL, 10)
+
+        self.assertEqual(7, report.executed_size)
+        self.assertEqual(3, report.remaining_size)
+        self.assertIsNone(report.order_id)
+        self.assertEqual(0, len(self.orderbook.get_bid_prices()))
+
+    def test_limit_order_matches_marketable_levels_and_rests_remainder(self):
+        report = self.orderbook.submit_limit_order(Side.BUY, 1.1010, 4)
+
+        self.assertEqual(2, report.executed_size)
+        self.assertIsNotNone(report.order_id)
+        np.testing.assert_array_equal(self.orderbook.get_bid_prices(), [1.1010, 1.0905, 1.0900, 1.0895])
+        np.testing.assert_array_equal(self.orderbook.get_bid_sizes(), [2, 1, 1, 5])
+        np.testing.assert_array_equal(self.orderbook.get_ask_prices(), [1.1015])
+
+    def test_price_time_priority_within_level(self):
+        first = self.orderbook.submit_limit_order(Side.SELL, 1.1010, 2).order_id
+        second = self.orderbook.submit_limit_order(Side.SELL, 1.1010, 2).order_id
+
+        report = self.orderbook.submit_market_order(Side.BUY, 4)
+
+        # The snapshot liquidity at 1.1010 came first, then the orders in arrival order.
+        self.assertEqual([(1.1005, 1, None), (1.1010, 1, None), (1.1010, 2, first)],
+                         [tuple(fill) for fill in report.fills])
+        np.testing.assert_array_equal(self.orderbook.get_ask_prices(), [1.1010, 1.1015])
+        np.testing.assert_array_equal(self.orderbook.get_ask_sizes(), [2, 5])
+
+        report = self.orderbook.submit_market_order(Side.BUY, 1)
+        self.assertEqual(second, report.fills[0].resting_order_id)
+
+    def test_restored_orders_keep_time_priority(self):
+        first = self.orderbook.submit_limit_order(Side.SELL, 1.1010, 2).order_id
+        second = self.orderbook.submit_limit_order(Side.SELL, 1.1010, 2).order_id
+        self.orderbook.submit_limit_order(Side.BUY, 1.0950, 1)
+        restored = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=5)
+        restored.update_bid(self.orderbook.get_bid_prices(), self.orderbook.get_bid_sizes())
+        restored.update_ask(self.orderbook.get_ask_prices(), self.orderbook.get_ask_sizes())
+
+        restored.restore_orders(*self.orderbook.resting_orders(), next_order_id=self.orderbook.next_order_id)
+
+        report = restored.submit_market_order(Side.BUY, 5)
+        self.assertEqual([(1.1005, 1, None), (1.1010, 1, None), (1.1010, 2, first), (1.1010, 1, second)],
+                         [tuple(fill) for fill in report.fills])
+        self.assertEqual(self.orderbook.next_order_id, restored.submit_limit_order(Side.BUY, 1.09, 1).order_id)
+
+    def test_cancel_order(self):
+        order_id = self.orderbook.submit_limit_order(Side.BUY, 1.0950, 3).order_id
+        np.testing.assert_array_equal(self.orderbook.get_bid_prices(), [1.0950, 1.0905, 1.0900, 1.0895])
+
+        self.assertTrue(self.orderbook.cancel_order(order_id))
+        self.assertFalse(self.orderbook.cancel_order(order_id))
+        np.testing.assert_array_equal(self.orderbook.get_bid_prices(), [1.0905, 1.0900, 1.0895])
+
+        # Cancelling part of a shared level only removes the order's size.
+        order_id = self.orderbook.submit_limit_order(Side.BUY, 1.0900, 3).order_id
+        self.orderbook.cancel_order(order_id)
+        np.testing.assert_array_equal(self.orderbook.get_bid_sizes(), [1, 1, 5])
+
+    def test_snapshot_update_replaces_resting_orders(self):
+        order_id = self.orderbook.submit_limit_order(Side.SELL, 1.1020, 3).order_id
+
+        self.orderbook.update_ask(new_prices=[1.1000], new_sizes=[2])
+
+        self.assertFalse(self.orderbook.cancel_order(order_id))
+        report = self.orderbook.submit_market_order(Side.BUY, 5)
+        self.assertEqual([(1.1000, 2, None)], [tuple(fill) for fill in report.fills])
+
+    def test_full_book_does_not_rest_new_level(self):
+        for price in (1.0890, 1.0885):
+            self.orderbook.submit_limit_order(Side.BUY, price, 1)
+
+        report = self.orderbook.submit_limit_order(Side.BUY, 1.0880, 1)
+
+        self.assertIsNone(report.order_id)
+        self.assertEqual(1, report.unrested_size)
+        self.assertEqual(5, len(self.orderbook.get_bid_prices()))
+
+    def test_orders_bump_versions_and_notify(self):
+        changed = []
+        self.orderbook.on_change = changed.append
+        store, row = self.orderbook.store, self.orderbook.row
+        bid_version, ask_version = store.bid_versions[row], store.ask_versions[row]
+
+        order_id = self.orderbook.submit_limit_order(Side.BUY, 1.0950, 2).order_id
+        self.assertEqual(bid_version + 1, store.bid_versions[row])
+        self.orderbook.submit_market_order(Side.BUY, 1)
+        self.assertEqual(ask_version + 1, store.ask_versions[row])
+        self.orderbook.submit_market_order(Side.SELL, 1)
+        self.assertTrue(self.orderbook.cancel_order(order_id))
+
+        self.assertEqual(bid_version + 3, store.bid_versions[row])
+        self.assertEqual([self.orderbook] * 4, changed)
+        # Nothing matched or rested.
+        self.orderbook.submit_limit_order(Side.BUY, 1.0, 0)
+        self.assertEqual(4, len(changed))
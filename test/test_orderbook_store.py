@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+
+from market.orderbook import LazyOrderBooks, OrderBook
+from market.orderbook_store import OrderBookStore
+from util.currency_pair import CurrencyPair
+
+
+class TestOrderBookStore(unittest.TestCase):
+
+    def test_order_book_is_view_onto_store_row(self):
+        store = OrderBookStore(book_size=5, capacity=2)
+        eur_usd = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), store=store)
+        gbp_usd = OrderBook(currency_pair=CurrencyPair("GBP", "USD"), store=store)
+
+        eur_usd.update_bid([1.0905, 1.0900], [1, 2])
+        gbp_usd.update_ask([1.2705], [3])
+
+        np.testing.assert_array_equal(store.bid_prices[0, :2], [1.0905, 1.0900])
+        np.testing.assert_array_equal(eur_usd.get_bid_sizes(), [1, 2])
+        np.testing.assert_array_equal(gbp_usd.get_ask_prices(), [1.2705])
+        self.assertEqual(len(gbp_usd.get_bid_prices()), 0)
+
+    def test_update_writes_in_place(self):
+        store = OrderBookStore(book_size=5, capacity=1)
+        ob = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), store=store)
+        bid_prices = store.bid_prices
+
+        ob.update_bid([1.0905, 1.0900, 1.0895], [1, 1, 5])
+        ob.update_bid([1.0910], [2])
+
+        self.assertIs(bid_prices.base, store.bid_prices.base)
+        np.testing.assert_array_equal(store.bid_prices[0], [1.0910, 0, 0, 0, 0])
+        np.testing.assert_array_equal(ob.get_bid_sizes(), [2])
+
+    def test_store_grows_without_invalidating_books(self):
+        store = OrderBookStore(book_size=2, capacity=1)
+        books = [OrderBook(currency_pair=CurrencyPair("EUR", str(i)), store=store) for i in range(5)]
+        books[0].update_ask([1.1], [1])
+        books[4].update_ask([1.5], [1])
+
+        self.assertGreaterEqual(store.capacity, 5)
+        np.testing.assert_array_equal(books[0].get_ask_prices(), [1.1])
+        np.testing.assert_array_equal(books[4].get_ask_prices(), [1.5])
+
+    def test_update_all(self):
+        store = OrderBookStore(book_size=3, capacity=4)
+        books = [OrderBook(currency_pair=CurrencyPair("EUR", str(i)), store=store) for i in range(4)]
+
+        store.update_all(np.arange(4.0), np.ones(4), np.arange(4.0) + 0.5, np.full(4, 2.0))
+        np.testing.assert_array_equal(store.bid_levels, [1, 1, 1, 1])
+        np.testing.assert_array_equal(books[3].get_ask_prices(), [3.5])
+
+        store.update_all(np.ones((2, 2)), np.ones((2, 2)), np.full((2, 2), 2.0), np.ones((2, 2)), rows=[1, 3])
+        np.testing.assert_array_equal(books[1].get_bid_prices(), [1.0, 1.0])
+        np.testing.assert_array_equal(books[2].get_bid_prices(), [2.0])
+
+    def test_too_many_levels_raises(self):
+        ob = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=2)
+        with self.assertRaises(ValueError):
+            ob.update_bid([1.0, 0.9, 0.8], [1, 1, 1])
+
+    def test_sweep_walks_levels_and_compacts_books(self):
+        store = OrderBookStore(book_size=4, capacity=2)
+        eur_usd = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), store=store)
+        gbp_usd = OrderBook(currency_pair=CurrencyPair("GBP", "USD"), store=store)
+        eur_usd.update_ask([1.1005, 1.1010, 1.1015], [1, 2, 5])
+        gbp_usd.update_bid([1.2705, 1.2700], [2, 2])
+
+        prices, sizes = store.sweep([0, 1], [True, False], [2.0, 10.0])
+
+        self.assertAlmostEqual((1.1005 + 1.1010) / 2, prices[0])
+        np.testing.assert_array_equal(sizes, [2.0, 4.0])
+        np.testing.assert_array_equal(eur_usd.get_ask_prices(), [1.1010, 1.1015])
+        np.testing.assert_array_equal(eur_usd.get_ask_sizes(), [1, 5])
+        self.assertEqual(0, len(gbp_usd.get_bid_prices()))
+
+        prices, sizes = store.sweep([1], [False], [1.0])
+        self.assertTrue(np.isnan(prices[0]))
+        self.assertEqual(0.0, sizes[0])
+
+    def test_lazy_order_books_create_views_on_first_lookup(self):
+        store = OrderBookStore(book_size=5, capacity=1)
+        eur_usd, gbp_usd = CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD")
+        np.testing.assert_array_equal([0, 1, 0], store.add_pairs([eur_usd, gbp_usd, eur_usd]))
+        books = LazyOrderBooks(store)
+
+        self.assertEqual([eur_usd, gbp_usd], list(books))
+        self.assertIn(gbp_usd, books)
+        self.assertEqual(0, books.created())
+        self.assertIsNone(books.get(CurrencyPair("USD", "JPY")))
+
+        gbp_book = books[gbp_usd]
+        gbp_book.update_bid([1.27], [1])
+
+        self.assertIs(gbp_book, books[gbp_usd])
+        self.assertEqual(1, gbp_book.row)
+        self.assertEqual(1, books.created())
+        np.testing.assert_array_equal([0, 1.27], store.bid_prices[:, 0])
@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+
+from market.agent_population import MakerPopulation, TakerPopulation
+from market.fx_market_simulation import FXMarketSimulation
+from market.orderbook import LazyOrderBooks
+from market.orderbook_store import OrderBookStore
+from market.population_engine import PopulationEngine
+from price_construction.price_crossing import PriceCrossing
+from price_construction.vwap_price import VWAPPrice
+from util.currency_pair import CurrencyPair
+
+
+class TestAgentPopulation(unittest.TestCase):
+
+    def test_quotes_are_skewed_by_inventory_and_capped_by_limits(self):
+        makers = MakerPopulation([0, 0, 0], risk_factors=1.0, half_spreads=0.001, inventory_skews=0.01,
+                                 max_inventories=100, quote_sizes=10)
+        makers.inventory[:] = [0, 50, 95]
+
+        bid_prices, bid_sizes, ask_prices, ask_sizes = makers.quotes(np.array([1.0]))
+
+        np.testing.assert_allclose([0.999, 0.994, 0.9895], bid_prices)
+        np.testing.assert_allclose(ask_prices - bid_prices, 0.002)
+        np.testing.assert_array_equal([10, 10, 5], bid_sizes)
+        np.testing.assert_array_equal([10, 10, 10], ask_sizes)
+
+    def test_takers_at_their_limit_only_reduce(self):
+        takers = TakerPopulation([0, 0], activity=1.0, buy_bias=1.0, min_sizes=5, max_sizes=5, max_inventories=10)
+        takers.inventory[:] = [10, 8]
+
+        buy, sizes = takers.orders(np.random.default_rng(0))
+
+        np.testing.assert_array_equal([False, True], buy)
+        np.testing.assert_array_equal([5, 2], sizes)
+
+
+class TestPopulationEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.eur_usd = CurrencyPair("EUR", "USD")
+        store = OrderBookStore(book_size=3, capacity=1)
+        store.add_pairs([self.eur_usd])
+        store.update_all([1.0999], [10], [1.1001], [10])
+        production = VWAPPrice()
+        production.register_store(LazyOrderBooks(store))
+        self.store = store
+        self.crossing = PriceCrossing([self.eur_usd], production)
+
+    def test_orders_fill_best_quotes_first(self):
+        # Three makers offering 1.1005, 1.1010 and 1.1020, only two of them inside the book.
+        makers = MakerPopulation([0, 0, 0, 0], risk_factors=1.0, half_spreads=[0.0005, 0.001, 0.002, 0.003],
+                                 inventory_skews=0.0, max_inventories=100, quote_sizes=[3, 3, 3, 3])
+        takers = TakerPopulation([0, 0], activity=1.0, buy_bias=1.0, min_sizes=[2, 2], max_sizes=[2, 2],
+                                 max_inventories=100)
+        engine = PopulationEngine(self.store, self.crossing, makers, takers, rng=np.random.default_rng(1))
+
+        result = engine.step()
+
+        mid = result.mid_prices[0]
+        self.assertEqual(4, result.executed_buy_sizes[0])
+        self.assertAlmostEqual(mid * (1 + (3 * 0.0005 + 1 * 0.001) / 4), result.buy_prices[0])
+        np.testing.assert_allclose([-3, -1, 0, 0], makers.inventory)
+        np.testing.assert_allclose([2, 2], takers.inventory)
+        # The best ask is used up; the rest of the book shifts forward.
+        self.assertEqual(2, self.store.ask_levels[0])
+        np.testing.assert_allclose([2, 3, 0], self.store.ask_sizes[0])
+        self.assertEqual(3, self.store.bid_levels[0])
+
+    def test_population_conserves_inventory_and_cash(self):
+        pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("USD", "SEK"), CurrencyPair("GBP", "USD")]
+        simulation = FXMarketSimulation(pairs, seed=3)
+
+        result = simulation.run_population(20, n_makers=30, n_takers=200)
+
+        makers, takers = simulation.population_engine.makers, simulation.population_engine.takers
+        self.assertAlmostEqual(0.0, makers.inventory.sum() + takers.inventory.sum())
+        self.assertAlmostEqual(0.0, makers.cash.sum() + takers.cash.sum())
+        self.assertTrue(np.all(np.abs(makers.inventory) <= makers.max_inventories + 1e-9))
+        self.assertTrue(np.all(np.abs(takers.inventory) <= takers.max_inventories + 1e-9))
+        self.assertTrue(np.all(result.executed_buy_sizes <= result.buy_sizes + 1e-9))
+
+    def test_agents_must_trade_known_pairs(self):
+        makers = MakerPopulation([1], 1.0, 0.001, 0.0, 100, 10)
+        takers = TakerPopulation([0], 1.0, 0.5, 1, 2, 10)
+
+        with self.assertRaises(ValueError):
+            PopulationEngine(self.store, self.crossing, makers, takers)
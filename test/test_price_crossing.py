@@ -0,0 +1,157 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from market.orderbook import OrderBook
+from market.orderbook_store import OrderBookStore
+from price_construction.currency_graph import PricingPlan
+from price_construction.price_crossing import PriceCrossing
+from price_construction.vwap_price import VWAPPrice
+from util.currency_pair import CurrencyPair
+
+
+def build_books(quotes, book_size=10):
+    """
+    quotes maps a CurrencyPair to (mid, half_spread). Returns a VWAPPrice holding one quoted book per pair.
+    """
+    vwap_price_constructor = VWAPPrice(vwap_mid_price=3, vwap_spread=3)
+    store = OrderBookStore(book_size=book_size, capacity=len(quotes))
+    for cp, (mid, half_spread) in quotes.items():
+        orderbook = OrderBook(currency_pair=cp, store=store)
+        orderbook.update_bid(new_prices=[mid - half_spread], new_sizes=[5])
+        orderbook.update_ask(new_prices=[mid + half_spread], new_sizes=[5])
+        vwap_price_constructor.update(order_book=orderbook)
+    return vwap_price_constructor
+
+
+class TestPriceCrossing(unittest.TestCase):
+
+    def setUp(self):
+        self.eur_usd = CurrencyPair("EUR", "USD")
+        self.gbp_usd = CurrencyPair("GBP", "USD")
+        self.usd_sek = CurrencyPair("USD", "SEK")
+        self.usd_nok = CurrencyPair("USD", "NOK")
+        self.nok_dkk = CurrencyPair("NOK", "DKK")
+        self.quotes = {
+            self.eur_usd: (1.10, 0.0001),
+            self.gbp_usd: (1.27, 0.0001),
+            self.usd_sek: (10.50, 0.001),
+            self.usd_nok: (10.80, 0.001),
+            self.nok_dkk: (0.64, 0.0001),
+        }
+
+    def test_routes_include_inverted_and_multi_hop_pairs(self):
+        gbp_sek = CurrencyPair("GBP", "SEK")
+        sek_usd = CurrencyPair("SEK", "USD")
+        eur_dkk = CurrencyPair("EUR", "DKK")
+        targets = [self.eur_usd, gbp_sek, sek_usd, eur_dkk]
+        price_crossing = PriceCrossing(targets, build_books(self.quotes))
+
+        self.assertEqual("direct", price_crossing.get_pricing_strategy(self.eur_usd)["strategy"])
+        self.assertEqual("inverse", price_crossing.get_pricing_strategy(sek_usd)["strategy"])
+        self.assertEqual("USD", price_crossing.get_pricing_strategy(gbp_sek)["pivot"])
+        self.assertEqual(["USD", "NOK"], price_crossing.get_pricing_strategy(eur_dkk)["pivots"])
+
+        self.assertAlmostEqual(1.27 * 10.50, price_crossing.generate_mid_price(gbp_sek))
+        self.assertAlmostEqual(1 / 10.50, price_crossing.generate_mid_price(sek_usd))
+        self.assertAlmostEqual(1.10 * 10.80 * 0.64, price_crossing.generate_mid_price(eur_dkk))
+
+    def test_generate_mid_prices_matches_single_target_pricing(self):
+        targets = [self.eur_usd, CurrencyPair("GBP", "SEK"), CurrencyPair("NOK", "SEK"),
+                   CurrencyPair("DKK", "GBP"), CurrencyPair("JPY", "USD")]
+        price_crossing = PriceCrossing(targets, build_books(self.quotes))
+
+        mids = price_crossing.generate_mid_prices()
+
+        for target, mid in zip(targets, mids):
+            self.assertAlmostEqual(price_crossing.generate_mid_price(target), mid)
+        # Without any route the consensus price is used.
+        consensus_mid, _ = price_crossing.price_production.calculate_consensus_price()
+        self.assertAlmostEqual(consensus_mid, mids[-1])
+
+    def test_recompile_selects_lowest_spread_route(self):
+        eur_sek = CurrencyPair("EUR", "SEK")
+        # The direct EUR/SEK book is far wider than crossing through USD.
+        self.quotes[eur_sek] = (11.55, 0.5)
+        price_crossing = PriceCrossing([eur_sek], build_books(self.quotes))
+        self.assertEqual("direct", price_crossing.get_pricing_strategy(eur_sek)["strategy"])
+
+        price_crossing.recompile()
+
+        self.assertEqual("cross", price_crossing.get_pricing_strategy(eur_sek)["strategy"])
+        self.assertAlmostEqual(1.10 * 10.50, price_crossing.generate_mid_prices()[0])
+
+    def test_unpriced_route_falls_back_to_direct_book(self):
+        gbp_sek = CurrencyPair("GBP", "SEK")
+        self.quotes[gbp_sek] = (13.3, 0.5)
+        vwap_price_constructor = build_books(self.quotes)
+        price_crossing = PriceCrossing([gbp_sek], vwap_price_constructor)
+        price_crossing.recompile()
+        self.assertEqual("cross", price_crossing.get_pricing_strategy(gbp_sek)["strategy"])
+
+        orderbook = vwap_price_constructor.order_books[self.usd_sek]
+        orderbook.update_bid(new_prices=[], new_sizes=[])
+        vwap_price_constructor.update(order_book=orderbook)
+
+        self.assertAlmostEqual(13.3, price_crossing.generate_mid_prices()[0])
+        self.assertAlmostEqual(13.3, price_crossing.generate_mid_price(gbp_sek))
+
+    def test_only_dependents_of_updated_books_are_recomputed(self):
+        gbp_sek = CurrencyPair("GBP", "SEK")
+        eur_nok = CurrencyPair("EUR", "NOK")
+        targets = [self.eur_usd, self.gbp_usd, gbp_sek, eur_nok]
+        vwap_price_constructor = build_books(self.quotes)
+        price_crossing = PriceCrossing(targets, vwap_price_constructor)
+        price_crossing.generate_mid_prices()
+        self.assertEqual(4, price_crossing.cache.recomputed)
+
+        # Nothing changed: everything is served from the cache.
+        price_crossing.generate_mid_prices()
+        self.assertEqual(4, price_crossing.cache.recomputed)
+
+        # GBP/USD feeds GBP/USD and GBP/SEK only.
+        orderbook = vwap_price_constructor.order_books[self.gbp_usd]
+        orderbook.update_bid(new_prices=[1.2800], new_sizes=[5])
+        orderbook.update_ask(new_prices=[1.2802], new_sizes=[5])
+        vwap_price_constructor.update(order_book=orderbook)
+
+        self.assertEqual([1, 2], list(price_crossing.cache.dirty_rows()))
+        mids = price_crossing.generate_mid_prices()
+        self.assertEqual(6, price_crossing.cache.recomputed)
+        self.assertAlmostEqual(1.2801 * 10.50, mids[2])
+        self.assertAlmostEqual(1.10 * 10.80, mids[3])
+
+    def test_consensus_fallback_depends_on_every_book(self):
+        jpy_usd = CurrencyPair("JPY", "USD")
+        vwap_price_constructor = build_books(self.quotes)
+        price_crossing = PriceCrossing([self.eur_usd, jpy_usd], vwap_price_constructor)
+        price_crossing.generate_mid_prices()
+
+        vwap_price_constructor.update(order_book=vwap_price_constructor.order_books[self.usd_nok])
+
+        self.assertEqual([1], list(price_crossing.cache.dirty_rows()))
+
+    def test_saved_plan_prices_like_compiled_plan(self):
+        targets = [self.eur_usd, CurrencyPair("GBP", "SEK"), CurrencyPair("USD", "GBP"),
+                   CurrencyPair("EUR", "DKK"), CurrencyPair("JPY", "USD")]
+        compiled = PriceCrossing(targets, build_books(self.quotes))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "plan.npz")
+            compiled.plan.save(path)
+            plan = PricingPlan.load(path)
+        loaded = PriceCrossing([], build_books(self.quotes), plan=plan)
+
+        self.assertEqual(targets, loaded.target_currency_pairs)
+        self.assertEqual(compiled.strategy_map, loaded.strategy_map)
+        np.testing.assert_array_equal(compiled.plan.strategy_codes, loaded.plan.strategy_codes)
+        np.testing.assert_array_equal(compiled.generate_mid_prices(), loaded.generate_mid_prices())
+
+    def test_plan_over_other_universe_is_rejected(self):
+        plan = PriceCrossing([self.eur_usd], build_books(self.quotes)).plan
+        quotes = dict(reversed(list(self.quotes.items())))
+
+        with self.assertRaises(ValueError):
+            PriceCrossing([], build_books(quotes), plan=plan)
@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.orderbook import LazyOrderBooks, OrderBook
+from market.orderbook_store import OrderBookStore
+from price_construction.depth_vwap_price import DepthVWAPPrice
+from price_construction.ewma_price import EWMAPrice
+from price_construction.micro_price import MicroPrice
+from price_construction.price_crossing import PriceCrossing
+from price_construction.pricing_engine import PricingEngine
+from price_construction.vwap_price import VWAPPrice
+from util.currency_pair import CurrencyPair
+
+
+class TestPricingEngines(unittest.TestCase):
+
+    def setUp(self):
+        self.currency_pair = CurrencyPair("EUR", "USD")
+        self.orderbook = OrderBook(currency_pair=self.currency_pair, book_size=5)
+        self.orderbook.update_bid(new_prices=[1.0900, 1.0890, 1.0880], new_sizes=[1, 2, 3])
+        self.orderbook.update_ask(new_prices=[1.1000, 1.1010, 1.1020], new_sizes=[3, 2, 1])
+
+    def test_registry_selects_implementation(self):
+        self.assertIs(VWAPPrice, PricingEngine.VWAP_PRICE.production_class)
+        self.assertIsInstance(PricingEngine.MICROPRICE.create(), MicroPrice)
+        self.assertIsInstance(PricingEngine.DEPTH_VWAP.create(levels=2), DepthVWAPPrice)
+        self.assertEqual(0.5, PricingEngine.EWMA_MID.create(alpha=0.5).alpha)
+
+    def test_microprice(self):
+        production = MicroPrice()
+        production.update(self.orderbook)
+
+        mid, spread = production.calculate_pair_price(self.currency_pair)
+
+        self.assertAlmostEqual((1.0900 * 3 + 1.1000 * 1) / 4, mid)
+        self.assertAlmostEqual(0.0100, spread)
+        mids, _ = production.calculate_all_pair_prices()
+        self.assertAlmostEqual(mid, mids[0])
+
+    def test_empty_top_of_book_falls_back_to_consensus(self):
+        usd_sek = CurrencyPair("USD", "SEK")
+        quoted = OrderBook(currency_pair=usd_sek, book_size=5)
+        quoted.update_bid(new_prices=[10.49], new_sizes=[1])
+        quoted.update_ask(new_prices=[10.51], new_sizes=[1])
+        # Size only behind an empty best bid, and beyond the levels DepthVWAPPrice counts.
+        self.orderbook.update_bid(new_prices=[1.0900, 1.0890, 1.0880], new_sizes=[0, 0, 3])
+        for production in (MicroPrice(), DepthVWAPPrice(levels=2)):
+            production.update(self.orderbook)
+            production.update(quoted)
+            crossing = PriceCrossing([usd_sek], production)
+
+            self.assertEqual((None, None), production.calculate_pair_price(self.currency_pair))
+            self.assertEqual(production.calculate_consensus_price()[0],
+                             crossing.generate_mid_price(self.currency_pair))
+
+    def test_depth_vwap_counts_levels(self):
+        production = DepthVWAPPrice(levels=2)
+        production.update(self.orderbook)
+
+        mid, spread = production.calculate_pair_price(self.currency_pair)
+
+        bid = (1.0900 * 1 + 1.0890 * 2) / 3
+        ask = (1.1000 * 3 + 1.1010 * 2) / 5
+        self.assertAlmostEqual((bid + ask) / 2, mid)
+        self.assertAlmostEqual(ask - bid, spread)
+
+    def test_ewma_moves_towards_new_mid(self):
+        production = EWMAPrice(alpha=0.25, vwap_mid_price=1, vwap_spread=1)
+        self.orderbook.update_bid(new_prices=[1.0], new_sizes=[1])
+        self.orderbook.update_ask(new_prices=[1.2], new_sizes=[1])
+        production.update(self.orderbook)
+        self.assertAlmostEqual(1.1, production.calculate_pair_price(self.currency_pair)[0])
+
+        self.orderbook.update_bid(new_prices=[1.4], new_sizes=[1])
+        self.orderbook.update_ask(new_prices=[1.6], new_sizes=[1])
+        production.update(self.orderbook)
+
+        mid, spread = production.calculate_pair_price(self.currency_pair)
+        self.assertAlmostEqual(1.1 + 0.25 * (1.5 - 1.1), mid)
+        self.assertAlmostEqual(0.2, spread)
+
+        self.orderbook.update_bid(new_prices=[], new_sizes=[])
+        production.update(self.orderbook)
+        self.assertEqual((None, None), production.calculate_pair_price(self.currency_pair))
+
+    def test_ewma_observes_only_rows_written_in_bulk(self):
+        production = EWMAPrice(alpha=0.5, vwap_mid_price=1, vwap_spread=1)
+        store = OrderBookStore(book_size=2)
+        pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD")]
+        store.add_pairs(pairs)
+        store.update_all(np.array([1.0, 2.0]), np.ones(2), np.array([1.2, 2.2]), np.ones(2))
+        production.register_store(LazyOrderBooks(store))
+
+        store.update_all(np.array([1.4, 3.0]), np.ones(2), np.array([1.6, 3.2]), np.ones(2))
+        production.update_rows(store, np.array([0]))
+
+        mids, _ = production.calculate_all_pair_prices()
+        np.testing.assert_allclose([1.1 + 0.5 * (1.5 - 1.1), 2.1], mids)
+
+    def test_simulation_runs_with_every_engine(self):
+        pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD"), CurrencyPair("EUR", "GBP")]
+        for engine in PricingEngine:
+            simulation = FXMarketSimulation(pairs, seed=2, pricing_engine=engine)
+            self.assertIsInstance(simulation.price_production, engine.production_class)
+
+            result = simulation.run_batch(3)
+
+            self.assertTrue(np.all(np.isfinite(result.mid_prices)), engine)
+
+
+if __name__ == '__main__':
+    unittest.main()
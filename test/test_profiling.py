@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from util.currency_pair import CurrencyPair
+from util.profiling import NULL_PROFILER, Profiler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("USD", "SEK"), CurrencyPair("EUR", "GBP")]
+
+    def test_stage_statistics(self):
+        profiler = Profiler()
+        for duration_ns in (1_000, 2_000, 4_000, 1_000_000):
+            profiler.record("stage", duration_ns)
+        with profiler.stage("timed"):
+            pass
+        profiler.count("events", 3)
+
+        summary = profiler.summary()
+        stage = summary["stages"]["stage"]
+        self.assertEqual(4, stage["count"])
+        self.assertAlmostEqual(1.007, stage["total_ms"])
+        self.assertEqual(1.0, stage["min_us"])
+        self.assertEqual(1000.0, stage["max_us"])
+        self.assertLessEqual(stage["p50_us"], 2.4)
+        self.assertEqual(1000.0, stage["p99_us"])
+        self.assertEqual(1, summary["stages"]["timed"]["count"])
+        self.assertEqual({"events": 3}, summary["counters"])
+        self.assertEqual(4, sum(profiler.histograms()["stage"]["counts"]))
+
+    def test_pair_metrics(self):
+        profiler = Profiler()
+        ids = CurrencyPair.ids(self.pairs)
+        profiler.add_pairs("size", ids, np.array([1.0, 5.0, 2.0]))
+        profiler.add_pairs("size", ids[:1], 10.0)
+
+        self.assertEqual({"EUR/USD": 11.0, "USD/SEK": 5.0}, profiler.summary(top=2)["pairs"]["size"])
+
+    def test_null_profiler_records_nothing(self):
+        simulation = FXMarketSimulation(self.pairs, seed=1)
+        simulation.run_batch(3)
+
+        self.assertIs(NULL_PROFILER, simulation.engine.profiler)
+        self.assertEqual({"stages": {}, "counters": {}, "pairs": {}}, NULL_PROFILER.summary())
+
+    def test_simulation_stages(self):
+        profiler = Profiler()
+        simulation = FXMarketSimulation(self.pairs, seed=1, profiler=profiler)
+        simulation.run_batch(5)
+
+        summary = profiler.summary()
+        for stage in ("engine.step", "engine.quote", "engine.taker", "price_crossing.refresh", "vwap.update_rows"):
+            self.assertEqual(5, summary["stages"][stage]["count"], stage)
+        self.assertEqual(5 * len(self.pairs), summary["counters"]["price_crossing.strategy.direct"])
+        self.assertEqual(set(map(str, self.pairs)), set(summary["pairs"]["price_crossing.repriced"]))
+        self.assertEqual(set(map(str, self.pairs)), set(summary["pairs"]["taker.executed_size"]))
+
+    def test_to_json(self):
+        profiler = Profiler()
+        simulation = FXMarketSimulation(self.pairs, seed=1, profiler=profiler)
+        simulation.run_batch(2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "profile.json")
+            text = profiler.to_json(path)
+            with open(path) as f:
+                self.assertEqual(json.loads(text), json.load(f))
+        self.assertIn("engine.step", json.loads(text)["histograms"])
@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.market_maker import MarketMaker
+from market.quote_stream import BookUpdate, QuoteStream
+from price_construction.price_crossing import PriceCrossing
+from test.test_price_crossing import build_books
+from util.currency_pair import CurrencyPair
+
+
+def book_update(cp, mid, received_ns=0):
+    return BookUpdate(cp, np.array([mid - 0.001]), np.array([5.0]), np.array([mid + 0.001]), np.array([5.0]),
+                      received_ns)
+
+
+class TestQuoteStream(unittest.TestCase):
+
+    def setUp(self):
+        self.eur_usd = CurrencyPair("EUR", "USD")
+        self.gbp_usd = CurrencyPair("GBP", "USD")
+        self.usd_sek = CurrencyPair("USD", "SEK")
+        self.eur_sek = CurrencyPair("EUR", "SEK")
+        production = build_books({self.eur_usd: (1.10, 0.0001), self.gbp_usd: (1.27, 0.0001),
+                                  self.usd_sek: (10.50, 0.001)})
+        self.targets = [self.eur_usd, self.gbp_usd, self.usd_sek, self.eur_sek]
+        self.crossing = PriceCrossing(self.targets, production)
+        self.crossing.generate_mid_prices()
+        self.maker = MarketMaker(self.targets, self.crossing, rng=np.random.default_rng(0))
+        self.quoted = []
+        self.stream = QuoteStream(production.order_books, self.maker,
+                                  on_quote=lambda rows, bids, asks: self.quoted.append(rows.tolist()))
+
+    def run_stream(self):
+        self.stream.close()
+        asyncio.run(self.stream.run())
+
+    def test_bursts_coalesce_to_newest_update(self):
+        for mid in (1.11, 1.12, 1.13):
+            self.stream.publish(book_update(self.eur_usd, mid))
+
+        self.run_stream()
+
+        self.assertEqual((3, 2, 1), (self.stream.received, self.stream.coalesced, self.stream.processed))
+        np.testing.assert_array_equal(self.stream.order_books[self.eur_usd].get_bid_prices(), [1.129])
+        self.assertAlmostEqual(1.13, self.crossing.generate_mid_price(self.eur_usd))
+
+    def test_only_targets_of_changed_books_are_requoted(self):
+        self.stream.publish(book_update(self.usd_sek, 10.6))
+
+        self.run_stream()
+
+        # USD/SEK itself and EUR/SEK, which crosses through it.
+        self.assertEqual([[2, 3]], self.quoted)
+        self.assertTrue(np.isnan(self.stream.bid_prices[0]))
+        self.assertLess(self.stream.bid_prices[3], 1.10 * 10.6)
+        self.assertGreater(self.stream.ask_prices[3], 1.10 * 10.6)
+
+    def test_updates_after_close_are_dropped(self):
+        self.stream.publish(book_update(self.eur_usd, 1.11))
+        self.stream.close()
+        self.stream.publish(book_update(self.gbp_usd, 1.28))
+        self.stream.close()
+
+        asyncio.run(asyncio.wait_for(self.stream.run(), timeout=1.0))
+
+        self.assertEqual((1, 1), (self.stream.received, self.stream.processed))
+        self.assertEqual([[0, 3]], self.quoted)
+
+    def test_latency_stats(self):
+        self.stream.publish(book_update(self.eur_usd, 1.11))
+        self.stream.publish(book_update(self.gbp_usd, 1.28))
+
+        self.run_stream()
+
+        stats = self.stream.latency_stats()
+        self.assertEqual(2, stats["processed"])
+        self.assertGreater(stats["p50_us"], 0)
+
+    def test_simulated_feed(self):
+        pairs = [self.eur_usd, self.gbp_usd, self.usd_sek, CurrencyPair("GBP", "SEK")]
+        simulation = FXMarketSimulation(pairs, seed=1)
+
+        stats = simulation.run_streaming(duration=0.05, mean_rate=200.0)
+
+        self.assertGreater(stats["received"], 0)
+        self.assertEqual(stats["received"], stats["processed"] + stats["coalesced"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import numpy as np
+
+from market.scenario_runner import SUMMARY_FIELDS, ScenarioRunner
+from util.currency_pair import CurrencyPair
+
+
+class TestScenarioRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.currency_pairs = [
+            CurrencyPair("EUR", "USD"),
+            CurrencyPair("GBP", "USD"),
+            CurrencyPair("USD", "SEK"),
+            CurrencyPair("GBP", "SEK"),
+        ]
+        self.risk_factors = [0.5, 0.75, 1.0, 1.25, 1.5]
+
+    def test_results_do_not_depend_on_worker_count(self):
+        serial = ScenarioRunner(self.currency_pairs, steps=20, workers=1).run(self.risk_factors, seed=3)
+        parallel = ScenarioRunner(self.currency_pairs, steps=20, workers=2).run(self.risk_factors, seed=3)
+
+        self.assertEqual((len(self.risk_factors), len(SUMMARY_FIELDS)), serial.shape)
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_seed_changes_results(self):
+        runner = ScenarioRunner(self.currency_pairs, steps=20, workers=1)
+
+        np.testing.assert_array_equal(runner.run(self.risk_factors, seed=3), runner.run(self.risk_factors, seed=3))
+        self.assertFalse(np.array_equal(runner.run(self.risk_factors, seed=3), runner.run(self.risk_factors, seed=4)))
+
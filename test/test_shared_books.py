@@ -0,0 +1,118 @@
+import multiprocessing
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.shared_books import SharedBookReader
+from util.currency_pair import CurrencyPair
+
+
+def _read_in_child(name, queue):
+    with SharedBookReader(name) as reader:
+        snapshot = reader.read()
+        queue.put((snapshot.sequence, snapshot.ask_prices, snapshot.mid_prices))
+
+
+class TestSharedBooks(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD"), CurrencyPair("USD", "SEK"),
+                      CurrencyPair("EUR", "GBP")]
+        self.simulation = FXMarketSimulation(self.pairs, seed=2, risk_factor=1.0)
+        self.addCleanup(self.simulation.stop_publishing)
+
+    def test_reader_sees_every_published_step(self):
+        publisher = self.simulation.start_publishing()
+        reader = SharedBookReader(publisher.name)
+        self.addCleanup(reader.close)
+        self.assertEqual(self.pairs, reader.currency_pairs)
+        self.assertEqual(1, reader.sequence)
+
+        self.simulation.run_batch(3)
+
+        snapshot = reader.read()
+        store = self.simulation.order_book_store
+        self.assertEqual(4, snapshot.sequence)
+        np.testing.assert_array_equal(store.bid_prices, snapshot.bid_prices)
+        np.testing.assert_array_equal(store.ask_sizes, snapshot.ask_sizes)
+        np.testing.assert_array_equal(store.ask_levels, snapshot.ask_levels)
+        mids, spreads = self.simulation.price_production.calculate_all_pair_prices()
+        np.testing.assert_array_equal(mids, snapshot.mid_prices)
+        np.testing.assert_array_equal(spreads, snapshot.spreads)
+
+    def test_zero_copy_snapshot_is_invalidated_when_its_buffer_is_rewritten(self):
+        publisher = self.simulation.start_publishing()
+        reader = SharedBookReader(publisher.name)
+        self.addCleanup(reader.close)
+        snapshot = reader.snapshot()
+        before = snapshot.ask_prices.copy()
+        self.assertFalse(snapshot.ask_prices.flags.writeable)
+
+        # The next publish goes to the other buffer.
+        self.simulation.run_batch(1)
+        self.assertTrue(reader.valid(snapshot))
+        np.testing.assert_array_equal(before, snapshot.ask_prices)
+        self.simulation.run_batch(1)
+        self.assertFalse(reader.valid(snapshot))
+        del snapshot
+
+    def test_population_steps_are_published(self):
+        publisher = self.simulation.start_publishing()
+        reader = SharedBookReader(publisher.name)
+        self.addCleanup(reader.close)
+
+        self.simulation.run_population(2, n_makers=8, n_takers=8)
+
+        self.assertEqual(3, reader.sequence)
+        np.testing.assert_array_equal(self.simulation.order_book_store.bid_sizes, reader.read().bid_sizes)
+
+    def test_run_and_streaming_are_published(self):
+        publisher = self.simulation.start_publishing()
+        reader = SharedBookReader(publisher.name)
+        self.addCleanup(reader.close)
+
+        self.simulation.run(2, log=False)
+        self.assertEqual(3, reader.sequence)
+        np.testing.assert_array_equal(self.simulation.order_book_store.ask_prices, reader.read().ask_prices)
+
+        stats = self.simulation.run_streaming(duration=0.05, mean_rate=200.0)
+        self.assertGreater(reader.sequence, 3)
+        self.assertGreaterEqual(stats["processed"], reader.sequence - 3)
+        np.testing.assert_array_equal(self.simulation.order_book_store.bid_prices, reader.read().bid_prices)
+
+    def test_snapshot_times_out_while_buffer_is_written(self):
+        publisher = self.simulation.start_publishing()
+        reader = SharedBookReader(publisher.name)
+        self.addCleanup(reader.close)
+        # Mark the current buffer as being written, as a writer stopped mid publish would leave it.
+        publisher._control[1 + reader.sequence % 2] += 1
+
+        with self.assertRaises(TimeoutError):
+            reader.snapshot(timeout=0.01)
+
+    def test_reader_in_another_process(self):
+        publisher = self.simulation.start_publishing()
+        self.simulation.run_batch(2)
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        process = context.Process(target=_read_in_child, args=(publisher.name, queue))
+        process.start()
+        sequence, ask_prices, mids = queue.get(timeout=30)
+        process.join(timeout=30)
+
+        self.assertEqual(0, process.exitcode)
+        self.assertEqual(3, sequence)
+        np.testing.assert_array_equal(self.simulation.order_book_store.ask_prices, ask_prices)
+        np.testing.assert_array_equal(self.simulation.price_production.calculate_all_pair_prices()[0], mids)
+
+    def test_store_growth_is_rejected(self):
+        publisher = self.simulation.start_publishing()
+        self.simulation.order_book_store.add_pair(CurrencyPair("USD", "JPY"))
+
+        with self.assertRaises(ValueError):
+            publisher.publish()
+
+
+if __name__ == '__main__':
+    unittest.main()
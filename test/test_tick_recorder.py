@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from market.fx_market_simulation import FXMarketSimulation
+from market.orderbook import OrderBook
+from market.orderbook_store import OrderBookStore
+from market.tick_recorder import TickRecorder, TickReplay
+from price_construction.price_crossing import PriceCrossing
+from price_construction.vwap_price import VWAPPrice
+from util.currency_pair import CurrencyPair
+
+
+class TestTickRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ticks.bin")
+        self.pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD"), CurrencyPair("USD", "SEK"),
+                      CurrencyPair("EUR", "GBP")]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip_across_chunks(self):
+        simulation = FXMarketSimulation(self.pairs, seed=3)
+        snapshots = []
+        simulation.start_recording(self.path, chunk_steps=4)
+        results, spreads = [], []
+        simulation.run_batch(10, on_step=lambda step, result: (
+            results.append(result),
+            spreads.append(simulation.price_production.calculate_all_pair_prices()[1]),
+            snapshots.append(simulation.order_book_store.ask_prices.copy())))
+        simulation.stop_recording()
+
+        replay = TickReplay(self.path)
+        self.assertEqual(10, len(replay))
+        self.assertEqual(self.pairs, replay.currency_pairs)
+        np.testing.assert_array_equal(np.array(snapshots), replay.column("ask_prices"))
+        rows = simulation.engine.book_rows
+        np.testing.assert_array_equal(results[6].mid_prices, replay.step(6)["mid_prices"][rows])
+        np.testing.assert_array_equal(results[9].executed_sizes, replay.step(9)["executed_sizes"][rows])
+        # Spreads are the price production's, not the maker's quoted ones.
+        np.testing.assert_array_equal(np.array(spreads), replay.column("spreads"))
+        self.assertTrue(np.all(replay.column("strategies") == 0))
+        with self.assertRaises(IndexError):
+            replay.step(10)
+
+    def test_books_deepening_within_and_across_chunks(self):
+        store = OrderBookStore(book_size=4)
+        store.add_pairs(self.pairs[:2])
+        recorder = TickRecorder(self.path, self.pairs[:2], store.book_size, chunk_steps=3)
+        snapshots = []
+        # Top of book, then three levels in the middle of the first chunk, two in the second and top again.
+        for depth in (1, 3, 1, 2, 1):
+            prices = 1 + np.arange(2)[:, None] + 0.01 * np.arange(depth)
+            store.update_all(prices, np.full((2, depth), 2.0), prices + 0.1, np.full((2, depth), 3.0))
+            recorder.record(store)
+            snapshots.append((store.bid_prices.copy(), store.ask_sizes.copy(), store.bid_levels.copy()))
+        recorder.close()
+
+        replay = TickReplay(self.path)
+        bid_prices, ask_sizes, bid_levels = (np.array(column) for column in zip(*snapshots))
+        np.testing.assert_array_equal(bid_prices, replay.column("bid_prices"))
+        np.testing.assert_array_equal(ask_sizes, replay.column("ask_sizes"))
+        np.testing.assert_array_equal(bid_levels, replay.column("bid_levels"))
+        for step in range(len(replay)):
+            np.testing.assert_array_equal(bid_prices[step], replay.step(step)["bid_prices"])
+        # Nothing but the books was recorded.
+        self.assertTrue(np.all(np.isnan(replay.column("mid_prices"))))
+        self.assertTrue(np.all(replay.column("strategies") == -1))
+
+    def test_replay_prices_without_simulating(self):
+        simulation = FXMarketSimulation(self.pairs, seed=5)
+        simulation.start_recording(self.path)
+        mids = []
+        simulation.run_batch(5, on_step=lambda step, result: mids.append(
+            simulation.price_crossing.generate_mid_prices()))
+        simulation.stop_recording()
+
+        replay = TickReplay(self.path)
+        store = OrderBookStore(book_size=replay.book_size, capacity=len(replay.currency_pairs))
+        production = VWAPPrice(vwap_mid_price=3, vwap_spread=3)
+        for cp in replay.currency_pairs:
+            production.update(OrderBook(currency_pair=cp, store=store))
+        crossing = PriceCrossing(replay.currency_pairs, production)
+        for step in replay.replay(store, production):
+            np.testing.assert_allclose(mids[step], crossing.generate_mid_prices())
+
+
+if __name__ == '__main__':
+    unittest.main()
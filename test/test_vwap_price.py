@@ -2,8 +2,11 @@ import unittest
 
 import numpy as np
 
-from market.orderbook import OrderBook
+from market.orderbook import LazyOrderBooks, OrderBook
+from market.orderbook_store import OrderBookStore
+from price_construction.pricing_cache import PricingCache
 from price_construction.vwap_price import VWAPPrice
+from util.currency_pair import CurrencyPair
 
 
 class TestVwapPrice(unittest.TestCase):
@@ -13,7 +16,7 @@ class TestVwapPrice(unittest.TestCase):
         vwap_spread_size = 3
         vwap_price_constructor = VWAPPrice(vwap_mid_price=vwap_mid_price_size, vwap_spread=vwap_spread_size)
 
-        orderbook = OrderBook(book_id=1, book_size=10)
+        orderbook = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=10)
 
         bid_prices = [1.0905, 1.0900, 1.0895]
         bid_sizes = np.array([1, 1, 5])
@@ -43,7 +46,7 @@ class TestVwapPrice(unittest.TestCase):
         vwap_spread_size = 5
         vwap_price_constructor = VWAPPrice(vwap_mid_price=vwap_mid_price_size, vwap_spread=vwap_spread_size)
 
-        orderbook = OrderBook(book_id=1, book_size=10)
+        orderbook = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=10)
 
         bid_prices = [1.0905, 1.0900, 1.0895]
         bid_sizes = np.array([1, 1, 5])
@@ -73,7 +76,7 @@ class TestVwapPrice(unittest.TestCase):
         vwap_spread_size = 3
         vwap_price_constructor = VWAPPrice(vwap_mid_price=vwap_mid_price_size, vwap_spread=vwap_spread_size)
 
-        orderbook = OrderBook(book_id=1, book_size=10)
+        orderbook = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=10)
 
         bid_prices = [1.0905, 1.0900, 1.0895]
         bid_sizes = np.array([1, 1, 5])
@@ -103,8 +106,8 @@ class TestVwapPrice(unittest.TestCase):
         vwap_spread_size = 3
         vwap_price_constructor = VWAPPrice(vwap_mid_price=vwap_mid_price_size, vwap_spread=vwap_spread_size)
 
-        orderbook_1 = OrderBook(book_id=1, book_size=10)
-        orderbook_2 = OrderBook(book_id=2, book_size=10)
+        orderbook_1 = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), book_size=10)
+        orderbook_2 = OrderBook(currency_pair=CurrencyPair("EUR", "SEK"), book_size=10)
 
         bid_prices_1 = np.array([1.0905, 1.0900, 1.0895])
         bid_sizes_1 = np.array([1, 1, 5])
@@ -144,3 +147,148 @@ class TestVwapPrice(unittest.TestCase):
 
         self.assertEqual(np.round(expected_spread, 5), np.round(actual_spread, 5))
         self.assertEqual(np.round(expected_mid_price, 5), np.round(actual_mid_price, 5))
+
+    def test_consensus_price_follows_book_updates(self):
+        vwap_price_constructor = VWAPPrice(vwap_mid_price=3, vwap_spread=3)
+        store = OrderBookStore(book_size=10, capacity=2)
+        orderbook_1 = OrderBook(currency_pair=CurrencyPair("EUR", "USD"), store=store)
+        orderbook_2 = OrderBook(currency_pair=CurrencyPair("EUR", "SEK"), store=store)
+
+        orderbook_1.update_bid(new_prices=[1.0905], new_sizes=[3])
+        orderbook_1.update_ask(new_prices=[1.1005], new_sizes=[3])
+        orderbook_2.update_bid(new_prices=[1.0805], new_sizes=[3])
+        orderbook_2.update_ask(new_prices=[1.0905], new_sizes=[3])
+        vwap_price_constructor.update(order_book=orderbook_1)
+        vwap_price_constructor.update(order_book=orderbook_2)
+
+        # Replacing a book swaps its levels in the merged book.
+        orderbook_2.update_bid(new_prices=[1.0910, 1.0900], new_sizes=[1, 3])
+        orderbook_2.update_ask(new_prices=[1.1000], new_sizes=[3])
+        vwap_price_constructor.update(order_book=orderbook_2)
+
+        actual_mid_price, actual_spread = vwap_price_constructor.calculate_consensus_price()
+        expected_bid_price = (1.0910 + 1.0905 * 2) / 3
+        self.assertAlmostEqual((expected_bid_price + 1.1000) / 2, actual_mid_price)
+        self.assertAlmostEqual(1.1000 - expected_bid_price, actual_spread)
+
+        # Bulk writes to the store are picked up by a resync.
+        store.update_all(np.array([1.0, 1.0]), np.array([3, 3]), np.array([1.2, 1.2]), np.array([3, 3]))
+        vwap_price_constructor.resync()
+        actual_mid_price, actual_spread = vwap_price_constructor.calculate_consensus_price()
+        self.assertAlmostEqual(1.1, actual_mid_price)
+        self.assertAlmostEqual(0.2, actual_spread)
+
+    def test_calculate_all_pair_prices_matches_pair_prices(self):
+        vwap_price_constructor = VWAPPrice(vwap_mid_price=3, vwap_spread=5)
+        store = OrderBookStore(book_size=10, capacity=2)
+        pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD"), CurrencyPair("USD", "SEK")]
+        orderbooks = [OrderBook(currency_pair=cp, store=store) for cp in pairs]
+
+        orderbooks[0].update_bid(new_prices=[1.0905, 1.0900, 1.0895], new_sizes=[1, 1, 5])
+        orderbooks[0].update_ask(new_prices=[1.1005, 1.1010, 1.1015], new_sizes=[1, 1, 5])
+        orderbooks[1].update_bid(new_prices=[1.2705, 1.2700], new_sizes=[2, 4])
+        orderbooks[1].update_ask(new_prices=[1.2710], new_sizes=[10])
+        # Leaving USD/SEK without asks means it cannot be priced.
+        orderbooks[2].update_bid(new_prices=[10.45], new_sizes=[1])
+
+        # Register in a different order than the store rows.
+        for orderbook in reversed(orderbooks):
+            vwap_price_constructor.update(order_book=orderbook)
+
+        mid_prices, spreads = vwap_price_constructor.calculate_all_pair_prices()
+
+        for cp in pairs[:2]:
+            expected_mid_price, expected_spread = vwap_price_constructor.calculate_pair_price(cp)
+            index = vwap_price_constructor.get_pair_index(cp)
+            self.assertAlmostEqual(expected_mid_price, mid_prices[index])
+            self.assertAlmostEqual(expected_spread, spreads[index])
+        self.assertTrue(np.isnan(mid_prices[vwap_price_constructor.get_pair_index(pairs[2])]))
+
+        expected_bid_price = (1.2705 * 2 + 1.2700 * 1) / 3
+        expected_mid_price = (expected_bid_price + 1.2710) / 2
+        self.assertAlmostEqual(expected_mid_price, mid_prices[vwap_price_constructor.get_pair_index(pairs[1])])
+
+    def test_consensus_price_matches_merged_books(self):
+        rng = np.random.default_rng(4)
+        vwap_price_constructor = VWAPPrice(vwap_mid_price=4, vwap_spread=7)
+        store = OrderBookStore(book_size=5, capacity=2)
+        orderbooks = [OrderBook(currency_pair=CurrencyPair(f"C{i}", "USD"), store=store) for i in range(40)]
+
+        def requote(orderbook):
+            # Few distinct prices, so books share levels.
+            orderbook.update_bid(new_prices=np.sort(rng.choice(np.arange(0.90, 1.0, 0.01), 3, replace=False))[::-1],
+                                 new_sizes=rng.integers(0, 4, 3))
+            orderbook.update_ask(new_prices=np.sort(rng.choice(np.arange(1.01, 1.1, 0.01), 3, replace=False)),
+                                 new_sizes=rng.integers(0, 4, 3))
+
+        def merged_vwap(prices, sizes, depth, descending):
+            order = np.argsort(-prices if descending else prices, kind="stable")
+            prices, sizes = prices[order], sizes[order]
+            weights = np.minimum(sizes, np.maximum(depth - (np.cumsum(sizes) - sizes), 0))
+            return np.sum(prices * weights) / np.sum(weights)
+
+        for step in range(60):
+            if step % 10 == 9:
+                # Bulk writes through the store.
+                for orderbook in orderbooks:
+                    requote(orderbook)
+                vwap_price_constructor.update_many(orderbooks)
+            else:
+                for orderbook in rng.choice(len(orderbooks), 3, replace=False):
+                    requote(orderbooks[orderbook])
+                    vwap_price_constructor.update(order_book=orderbooks[orderbook])
+
+            bid_prices, bid_sizes = store.bid_prices.ravel(), store.bid_sizes.ravel()
+            ask_prices, ask_sizes = store.ask_prices.ravel(), store.ask_sizes.ravel()
+            expected_mid_price = (merged_vwap(bid_prices, bid_sizes, 4, True) +
+                                  merged_vwap(ask_prices, ask_sizes, 4, False)) / 2
+            expected_spread = merged_vwap(ask_prices, ask_sizes, 7, False) - merged_vwap(bid_prices, bid_sizes, 7, True)
+            actual_mid_price, actual_spread = vwap_price_constructor.calculate_consensus_price()
+            self.assertAlmostEqual(expected_mid_price, actual_mid_price)
+            self.assertAlmostEqual(expected_spread, actual_spread)
+
+    def test_update_rows_invalidates_only_dependent_prices(self):
+        vwap_price_constructor = VWAPPrice(vwap_mid_price=1, vwap_spread=1)
+        store = OrderBookStore(book_size=2)
+        pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD"), CurrencyPair("USD", "SEK")]
+        store.add_pairs(pairs)
+        store.update_all(np.array([1.0, 2.0, 10.0]), np.ones(3), np.array([1.2, 2.2, 10.2]), np.ones(3))
+        vwap_price_constructor.register_store(LazyOrderBooks(store))
+        cache = PricingCache()
+        cache.reset(pairs, [[cp] for cp in pairs])
+        cache.store(np.arange(3), np.zeros(3), np.zeros(3, dtype=bool))
+        vwap_price_constructor.add_pricing_cache(cache)
+
+        store.update_all(np.array([0.5]), np.ones(1), np.array([0.7]), np.ones(1), rows=np.array([2]))
+        vwap_price_constructor.update_rows(store, np.array([2]))
+
+        np.testing.assert_array_equal([False, False, True], cache.dirty)
+        self.assertAlmostEqual(0.6, vwap_price_constructor.calculate_pair_price(pairs[2])[0])
+        self.assertAlmostEqual((2.0 + 0.7) / 2, vwap_price_constructor.calculate_consensus_price()[0])
+
+    def test_books_registered_after_store_stay_with_production(self):
+        vwap_price_constructor = VWAPPrice(vwap_mid_price=1, vwap_spread=1)
+        store = OrderBookStore(book_size=2)
+        pairs = [CurrencyPair("EUR", "USD"), CurrencyPair("GBP", "USD")]
+        store.add_pairs(pairs)
+        store.update_all(np.array([1.0, 2.0]), np.ones(2), np.array([1.2, 2.2]), np.ones(2))
+        order_books = LazyOrderBooks(store)
+        vwap_price_constructor.register_store(order_books)
+
+        usd_sek = OrderBook(currency_pair=CurrencyPair("USD", "SEK"))
+        usd_sek.update_bid(new_prices=[10.0], new_sizes=[1])
+        usd_sek.update_ask(new_prices=[10.2], new_sizes=[1])
+        vwap_price_constructor.update(usd_sek)
+        eur_usd = OrderBook(currency_pair=pairs[0])
+        eur_usd.update_bid(new_prices=[1.1], new_sizes=[1])
+        eur_usd.update_ask(new_prices=[1.3], new_sizes=[1])
+        vwap_price_constructor.update(eur_usd)
+
+        # The shared mapping still holds the store's pairs and views only.
+        self.assertEqual(2, len(order_books))
+        self.assertIsNot(eur_usd, order_books[pairs[0]])
+        self.assertEqual(pairs + [usd_sek.currency_pair], list(vwap_price_constructor.order_books))
+        self.assertEqual(3, len(vwap_price_constructor.order_books))
+        self.assertAlmostEqual(10.1, vwap_price_constructor.calculate_pair_price(usd_sek.currency_pair)[0])
+        self.assertAlmostEqual(1.2, vwap_price_constructor.calculate_pair_price(pairs[0])[0])
+        self.assertAlmostEqual(1.0, order_books[pairs[0]].get_bid_prices()[0])
@@ -1,21 +1,95 @@
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
 class CurrencyPair:
     """
     Represents a currency pair, e.g., EUR/USD.
+
+    Pairs are interned: CurrencyPair("EUR", "USD") always returns the same instance, so equality is
+    identity and hashing is the built-in identity hash. Every pair gets a small integer `id`, in
+    creation order, and its currencies get integer ids shared by all pairs; both can be used to index
+    arrays. Ids are stable for the lifetime of the process; pickled pairs are re-interned on load.
     """
-    def __init__(self, base, quote):
-        self.base = base
-        self.quote = quote
+    __slots__ = ("base", "quote", "id", "base_id", "quote_id", "_inverse")
+
+    _pairs: Dict[Tuple[str, str], "CurrencyPair"] = {}
+    _pairs_by_id: List["CurrencyPair"] = []
+    _currency_ids: Dict[str, int] = {}
+    _currencies: List[str] = []
+
+    def __new__(cls, base, quote):
+        pair = cls._pairs.get((base, quote))
+        if pair is not None:
+            return pair
+        pair = super().__new__(cls)
+        set_attribute = super().__setattr__
+        set_attribute(pair, "base", base)
+        set_attribute(pair, "quote", quote)
+        set_attribute(pair, "id", len(cls._pairs_by_id))
+        set_attribute(pair, "base_id", cls.currency_id(base))
+        set_attribute(pair, "quote_id", cls.currency_id(quote))
+        set_attribute(pair, "_inverse", None)
+        cls._pairs[(base, quote)] = pair
+        cls._pairs_by_id.append(pair)
+        return pair
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CurrencyPair is immutable")
+
+    def __reduce__(self):
+        return CurrencyPair, (self.base, self.quote)
+
+    def __repr__(self):
+        return f"CurrencyPair({self.base!r}, {self.quote!r})"
 
     def __str__(self):
         return f"{self.base}/{self.quote}"
 
-    def __eq__(self, other):
-        if isinstance(other, CurrencyPair):
-            return self.base == other.base and self.quote == other.quote
-        return False
-
-    def __hash__(self):
-        return hash((self.base, self.quote))
+    @property
+    def inverse(self) -> "CurrencyPair":
+        """
+        The pair with base and quote swapped, e.g. USD/EUR for EUR/USD.
+        """
+        if self._inverse is None:
+            inverse = CurrencyPair(self.quote, self.base)
+            super().__setattr__("_inverse", inverse)
+            super(CurrencyPair, inverse).__setattr__("_inverse", self)
+        return self._inverse
 
     def as_tuple(self):
         return self.base, self.quote
+
+    @classmethod
+    def currency_id(cls, currency: str) -> int:
+        """
+        Integer id of a currency code, assigned on first use.
+        """
+        currency_id = cls._currency_ids.get(currency)
+        if currency_id is None:
+            currency_id = cls._currency_ids[currency] = len(cls._currencies)
+            cls._currencies.append(currency)
+        return currency_id
+
+    @classmethod
+    def currency(cls, currency_id: int) -> str:
+        return cls._currencies[currency_id]
+
+    @classmethod
+    def from_id(cls, pair_id: int) -> "CurrencyPair":
+        return cls._pairs_by_id[pair_id]
+
+    @classmethod
+    def count(cls) -> int:
+        """
+        Number of pairs created so far, an upper bound for every pair id.
+        """
+        return len(cls._pairs_by_id)
+
+    @staticmethod
+    def ids(currency_pairs: Iterable["CurrencyPair"]) -> np.ndarray:
+        """
+        Ids of the given pairs as an int64 array.
+        """
+        return np.fromiter((cp.id for cp in currency_pairs), dtype=np.int64)
@@ -0,0 +1,44 @@
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from util.currency_pair import CurrencyPair
+
+
+class PairIndex:
+    """
+    Array from CurrencyPair.id to a row number, -1 for pairs without a row.
+    Translates many pairs to rows with one gather instead of one dict lookup per pair.
+    """
+    def __init__(self):
+        self.rows = np.full(16, -1, dtype=np.int64)
+
+    def __setitem__(self, currency_pair: CurrencyPair, row: int):
+        if currency_pair.id >= len(self.rows):
+            grown = np.full(max(2 * len(self.rows), CurrencyPair.count()), -1, dtype=np.int64)
+            grown[:len(self.rows)] = self.rows
+            self.rows = grown
+        self.rows[currency_pair.id] = row
+
+    def set_many(self, currency_pairs: Sequence[CurrencyPair], rows):
+        """
+        Assign rows[i] to currency_pairs[i] for many pairs at once.
+        """
+        pair_ids = CurrencyPair.ids(currency_pairs)
+        if len(pair_ids) and pair_ids.max() >= len(self.rows):
+            grown = np.full(max(2 * len(self.rows), CurrencyPair.count()), -1, dtype=np.int64)
+            grown[:len(self.rows)] = self.rows
+            self.rows = grown
+        self.rows[pair_ids] = rows
+
+    def lookup(self, currency_pairs: Iterable[CurrencyPair]) -> np.ndarray:
+        """
+        Rows of the given pairs, -1 where a pair has none.
+        """
+        return self.lookup_ids(CurrencyPair.ids(currency_pairs))
+
+    def lookup_ids(self, pair_ids: np.ndarray) -> np.ndarray:
+        rows = np.full(len(pair_ids), -1, dtype=np.int64)
+        known = pair_ids < len(self.rows)
+        rows[known] = self.rows[pair_ids[known]]
+        return rows
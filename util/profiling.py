@@ -0,0 +1,229 @@
+import functools
+import json
+import math
+import time
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from util.currency_pair import CurrencyPair
+
+# Durations are binned on a log2 scale with BINS_PER_OCTAVE bins per doubling, from 2**MIN_OCTAVE ns
+# (64 ns) to 2**MAX_OCTAVE ns (about 17 s); shorter and longer durations go to the first and last bin.
+BINS_PER_OCTAVE = 4
+MIN_OCTAVE = 6
+MAX_OCTAVE = 34
+N_BINS = (MAX_OCTAVE - MIN_OCTAVE) * BINS_PER_OCTAVE
+
+
+class _StageStats:
+    """
+    Count, total, extremes and log-scale histogram of one stage's durations, in constant memory.
+    """
+    __slots__ = ("count", "total_ns", "min_ns", "max_ns", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = math.inf
+        self.max_ns = 0
+        self.histogram = [0] * N_BINS
+
+    def add(self, duration_ns: int):
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        b = int(math.log2(duration_ns) * BINS_PER_OCTAVE) - MIN_OCTAVE * BINS_PER_OCTAVE if duration_ns > 0 else 0
+        self.histogram[min(max(b, 0), N_BINS - 1)] += 1
+
+    def percentile_ns(self, q: float) -> float:
+        """
+        Upper edge of the histogram bin holding the q-th percentile, capped by the observed maximum.
+        """
+        target = q / 100 * self.count
+        cumulative = 0
+        for b, n in enumerate(self.histogram):
+            cumulative += n
+            if n and cumulative >= target:
+                return min(2 ** (MIN_OCTAVE + (b + 1) / BINS_PER_OCTAVE), self.max_ns)
+        return self.max_ns
+
+
+class _Timer:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter_ns() - self.start)
+
+
+class Profiler:
+    """
+    Timers and counters for the simulation and pricing stages.
+
+    Stages are timed with `with profiler.stage(name):` or record(name, duration_ns); counters are
+    incremented by count(name). Per pair metrics are arrays indexed by CurrencyPair.id, updated for
+    many pairs at once by add_pairs. Components hold a `profiler` attribute that defaults to
+    NULL_PROFILER, whose methods do nothing; code that would do extra work only to feed the profiler
+    checks `profiler.enabled` first.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages: Dict[str, _StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.pair_metrics: Dict[str, np.ndarray] = {}
+
+    def stage(self, name: str) -> _Timer:
+        return _Timer(self, name)
+
+    def record(self, name: str, duration_ns: int):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = _StageStats()
+        stats.add(duration_ns)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_pairs(self, name: str, pair_ids: np.ndarray, values=1):
+        """
+        Add values (a scalar or one value per pair) to the per pair metric `name` of the given pair ids.
+        """
+        metric = self.pair_metrics.get(name)
+        size = CurrencyPair.count()
+        if metric is None or len(metric) < size:
+            grown = np.zeros(max(size, 16))
+            if metric is not None:
+                grown[:len(metric)] = metric
+            metric = self.pair_metrics[name] = grown
+        np.add.at(metric, pair_ids, values)
+
+    def reset(self):
+        self.stages.clear()
+        self.counters.clear()
+        self.pair_metrics.clear()
+
+    def summary(self, top: Optional[int] = None) -> dict:
+        """
+        Per stage count, total and latency statistics (percentiles from the histograms), the counters,
+        and per pair metrics keyed by pair, largest first; top limits the pairs listed per metric.
+        """
+        stages = {}
+        for name, stats in self.stages.items():
+            stages[name] = {
+                "count": stats.count,
+                "total_ms": stats.total_ns / 1e6,
+                "mean_us": stats.total_ns / stats.count / 1e3,
+                "min_us": stats.min_ns / 1e3,
+                "p50_us": stats.percentile_ns(50) / 1e3,
+                "p90_us": stats.percentile_ns(90) / 1e3,
+                "p99_us": stats.percentile_ns(99) / 1e3,
+                "max_us": stats.max_ns / 1e3,
+            }
+        pairs = {}
+        for name, metric in self.pair_metrics.items():
+            ids = np.flatnonzero(metric)
+            ids = ids[np.argsort(-metric[ids], kind="stable")][:top]
+            pairs[name] = {str(CurrencyPair.from_id(int(i))): float(metric[i]) for i in ids}
+        return {"stages": stages, "counters": dict(self.counters), "pairs": pairs}
+
+    def histograms(self) -> Dict[str, dict]:
+        """
+        Per stage duration histogram: bin edges in microseconds and counts, trimmed to the populated bins.
+        """
+        histograms = {}
+        for name, stats in self.stages.items():
+            populated = [b for b, n in enumerate(stats.histogram) if n]
+            first, last = populated[0], populated[-1] + 1
+            edges = [2 ** (MIN_OCTAVE + b / BINS_PER_OCTAVE) / 1e3 for b in range(first, last + 1)]
+            histograms[name] = {"edges_us": edges, "counts": stats.histogram[first:last]}
+        return histograms
+
+    def to_json(self, path: Optional[str] = None, top: Optional[int] = None) -> str:
+        """
+        summary() and histograms() as JSON, also written to path if given.
+        """
+        text = json.dumps({**self.summary(top), "histograms": self.histograms()}, indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def format_stages(self, names: Optional[Iterable[str]] = None) -> str:
+        """
+        Stage table sorted by total time, for printing at the end of a run.
+        """
+        stages = self.summary()["stages"]
+        names = sorted(stages, key=lambda name: -stages[name]["total_ms"]) if names is None else names
+        lines = [f"{'stage':<40}{'count':>9}{'total ms':>11}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}"]
+        for name in names:
+            s = stages[name]
+            lines.append(f"{name:<40}{s['count']:>9}{s['total_ms']:>11.1f}{s['mean_us']:>10.1f}"
+                         f"{s['p50_us']:>10.1f}{s['p99_us']:>10.1f}")
+        return "\n".join(lines)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullProfiler(Profiler):
+    """
+    Profiler that records nothing; the default of every instrumented component.
+    """
+    enabled = False
+
+    def stage(self, name: str) -> _NullTimer:
+        return _NULL_TIMER
+
+    def record(self, name: str, duration_ns: int):
+        pass
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def add_pairs(self, name: str, pair_ids: np.ndarray, values=1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def profiled(name: str):
+    """
+    Method decorator timing every call as stage `name` on the instance's `profiler` attribute.
+    With a disabled profiler the method is called directly. Nested stages are timed inclusively.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if not profiler.enabled:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler.record(name, time.perf_counter_ns() - start)
+        return wrapper
+    return decorate